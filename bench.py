@@ -0,0 +1,168 @@
+import argparse, gc, glob, hashlib, json, os, platform, resource, runpy, statistics, subprocess, sys, tempfile, time
+
+""" This file runs the benchmark suite: the example programs, and the microbenchmarks in the benchmarks directory. Every run of a program happens in a fresh interpreter process, through lisp.py just like running it by hand, and reports its wall time, how many top level forms it evaluated per second, its peak memory, and how much it allocated (the number of memory blocks still allocated when it finished, and how many garbage collections it went through). Results can be written as JSON, and compared with a baseline written earlier, to catch performance regressions. """
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+# The example programs in the suite. 03.lisp takes minutes, so it only runs with --all.
+programs = ['01.lisp', '02.lisp', '04.lisp', '06.lisp', 'test.lisp']
+slow_programs = ['03.lisp']
+
+def suite(include_slow=False):
+  """ Returns the paths of the programs in the suite, relative to the root of the repository """
+  micro = sorted(os.path.relpath(path, root) for path in glob.glob(os.path.join(root, 'benchmarks', '*.lisp')))
+  return programs + (slow_programs if include_slow else []) + micro
+
+def measure(path, engine, cache=False):
+  """ Runs a program once in a fresh process, and returns its measurements """
+  handle, result_path = tempfile.mkstemp(suffix='.json')
+  os.close(handle)
+  try:
+    args = ['--engine', engine] + ([] if cache else ['--no-cache']) + [path]
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', result_path, '--', *args], cwd=root, capture_output=True)
+    with open(result_path, encoding='UTF-8') as file:
+      result = json.load(file)
+  except (OSError, ValueError):
+    result = {'error': process.stderr.decode(errors='replace').strip()[-500:] or 'no result'}
+  finally:
+    os.remove(result_path)
+  result['output_hash'] = hashlib.sha1(process.stdout).hexdigest()
+  return result
+
+def child(result_path, args):
+  """ The part of a run that happens in the benchmark's own process: runs lisp.py with the given arguments, and writes the measurements to result_path """
+  sys.path.insert(0, root)
+  import reader
+  path = args[-1]
+  forms = sum(1 for _ in reader.read_file(path))
+  sys.argv = ['lisp.py', *args]
+  collections = sum(stats['collections'] for stats in gc.get_stats())
+  blocks = sys.getallocatedblocks()
+  error = None
+  start = time.perf_counter()
+  try:
+    runpy.run_path(os.path.join(root, 'lisp.py'), run_name='__main__')
+  except SystemExit:
+    pass
+  except Exception as exception:
+    error = f"{type(exception).__name__}: {exception}"
+  wall = time.perf_counter() - start
+  result = {
+    'wall': wall,
+    'forms': forms,
+    'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'blocks': sys.getallocatedblocks() - blocks,
+    'collections': sum(stats['collections'] for stats in gc.get_stats()) - collections,
+  }
+  if error is not None:
+    result['error'] = error
+  with open(result_path, 'w', encoding='UTF-8') as file:
+    json.dump(result, file)
+
+def run(path, engine, warmup, repeat, cache=False):
+  """ Runs a program warmup times without keeping the results, then repeat times, and summarizes the measurements """
+  for _ in range(warmup):
+    measure(path, engine, cache)
+  runs = [measure(path, engine, cache) for _ in range(repeat)]
+  errors = [run['error'] for run in runs if 'error' in run]
+  if errors:
+    return {'error': errors[0]}
+  walls = [run['wall'] for run in runs]
+  median = statistics.median(walls)
+  return {
+    'wall_min': min(walls),
+    'wall_median': median,
+    'wall_mean': statistics.mean(walls),
+    'forms': runs[0]['forms'],
+    'forms_per_sec': runs[0]['forms'] / median if median > 0 else 0,
+    'peak_kb': max(run['peak_kb'] for run in runs),
+    'blocks': statistics.median(run['blocks'] for run in runs),
+    'collections': statistics.median(run['collections'] for run in runs),
+    'output_hash': runs[0]['output_hash'],
+    'runs': len(runs),
+  }
+
+def parse_throughput(path, repeat):
+  """ Reads all the forms of a program repeat times in this process, and returns how many megabytes of source per second the fastest run read """
+  sys.path.insert(0, root)
+  import reader
+  size = os.path.getsize(os.path.join(root, path))
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    for _ in reader.read_file(os.path.join(root, path)):
+      pass
+    best = min(best, time.perf_counter() - start)
+  return size / 1e6 / best
+
+def compare(results, baseline, threshold):
+  """ Prints how each result changed from the baseline, and returns the names of the ones that got slower by more than the threshold (a fraction), or whose output changed """
+  regressions = []
+  print(f"\n{'benchmark':<40} {'baseline s':>10} {'now s':>10} {'change':>8}")
+  for name, result in results.items():
+    before = baseline.get(name)
+    if before is None or 'error' in before or 'error' in result:
+      print(f"{name:<40} {'-':>10} {result.get('wall_median', float('nan')):>10.3f} {'n/a':>8}")
+      continue
+    change = result['wall_median'] / before['wall_median'] - 1
+    flags = []
+    if change > threshold:
+      flags.append('SLOWER')
+    if result['output_hash'] != before['output_hash']:
+      flags.append('OUTPUT CHANGED')
+    if flags:
+      regressions.append(name)
+    print(f"{name:<40} {before['wall_median']:>10.3f} {result['wall_median']:>10.3f} {change:>+8.1%}  {' '.join(flags)}")
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs the benchmark suite, and optionally compares it with a baseline.')
+  parser.add_argument('programs', nargs='*', help='only run the programs whose path contains one of these strings')
+  parser.add_argument('--engine', action='append', help='engine to benchmark, can be given several times (default: ast and compiled)')
+  parser.add_argument('--warmup', type=int, default=1, help='runs of each program whose results are thrown away (default: 1)')
+  parser.add_argument('--repeat', type=int, default=3, help='measured runs of each program (default: 3)')
+  parser.add_argument('--all', action='store_true', help='also run the programs that take minutes')
+  parser.add_argument('--cache', action='store_true', help='let lisp.py use its cache of parsed source files')
+  parser.add_argument('--parse', action='store_true', help='instead of running the programs, measure how fast the reader parses them, in MB/s')
+  parser.add_argument('--output', metavar='FILE', help='write the results to FILE as JSON')
+  parser.add_argument('--baseline', metavar='FILE', help='compare the results with the ones in FILE, and exit with status 1 if any got slower')
+  parser.add_argument('--threshold', type=float, default=0.1, help='how much slower than the baseline a benchmark may get, as a fraction (default: 0.1)')
+  options = parser.parse_args()
+
+  if options.parse:
+    print(f"{'program':<40} {'MB/s':>8}")
+    for path in suite(options.all):
+      if not options.programs or any(name in path for name in options.programs):
+        print(f"{path:<40} {parse_throughput(path, max(options.repeat, 20)):>8.2f}")
+    return
+
+  results = dict()
+  print(f"{'benchmark':<40} {'median s':>10} {'min s':>10} {'forms/s':>10} {'peak MB':>8} {'blocks':>9} {'gcs':>6}")
+  for engine in options.engine or ['ast', 'compiled']:
+    for path in suite(options.all):
+      if options.programs and not any(name in path for name in options.programs):
+        continue
+      name = f"{engine}:{path}"
+      result = results[name] = run(path, engine, options.warmup, options.repeat, options.cache)
+      if 'error' in result:
+        print(f"{name:<40} error: {result['error']}")
+      else:
+        print(f"{name:<40} {result['wall_median']:>10.3f} {result['wall_min']:>10.3f} {result['forms_per_sec']:>10.1f} {result['peak_kb'] / 1024:>8.1f} {result['blocks']:>9.0f} {result['collections']:>6.0f}")
+
+  if options.output is not None:
+    with open(options.output, 'w', encoding='UTF-8') as file:
+      json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'results': results}, file, indent=2)
+
+  if options.baseline is not None:
+    with open(options.baseline, encoding='UTF-8') as file:
+      baseline = json.load(file)['results']
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+      print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+      sys.exit(1)
+
+if __name__ == '__main__':
+  if len(sys.argv) > 2 and sys.argv[1] == '--child':
+    child(sys.argv[2], sys.argv[4:])
+  else:
+    main()
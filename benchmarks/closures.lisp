@@ -0,0 +1,17 @@
+; Closure creation: a fresh function is created and called on every iteration
+(def! make-adder
+  (fn* (n)
+    (fn* (x) (+ x n))
+  )
+)
+
+(def! run
+  (fn* (i acc)
+    (if (= i 0)
+      acc
+      (run (- i 1) ((make-adder i) acc))
+    )
+  )
+)
+
+(prn (run 50000 0))
@@ -0,0 +1,32 @@
+; Parsing large data literals: vectors of numbers and a map of strings are built as source text, then read back
+(def! numbers
+  (fn* (i acc)
+    (if (= i 0)
+      acc
+      (numbers (- i 1) (cons (* i 7919) acc))
+    )
+  )
+)
+
+(def! entries
+  (fn* (i acc)
+    (if (= i 0)
+      acc
+      (entries (- i 1) (cons (str ":k" i " \"value " i "\"") acc))
+    )
+  )
+)
+
+(def! ints (str "[" (join " " (numbers 20000 '())) "]"))
+(def! floats (str "[" (join " " (map (fn* (n) (/ n 3.0)) (numbers 20000 '()))) "]"))
+(def! table (str "{" (join " " (entries 5000 '())) "}"))
+
+(def! read-all
+  (fn* (i total)
+    (if (= i 0)
+      total
+      (read-all (- i 1) (+ total (count (read-string ints)) (count (read-string floats)) (count (read-string table))))
+    )
+  )
+)
+(prn (read-all 20 0))
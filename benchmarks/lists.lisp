@@ -0,0 +1,22 @@
+; List building: consing up a long list, then walking it with first and rest
+(def! build
+  (fn* (n lst)
+    (if (= n 0)
+      lst
+      (build (- n 1) (cons n lst))
+    )
+  )
+)
+
+(def! total
+  (fn* (lst acc)
+    (if (empty? lst)
+      acc
+      (total (rest lst) (+ acc (first lst)))
+    )
+  )
+)
+
+(def! numbers (build 30000 '()))
+(prn (count numbers) (total numbers 0))
+(prn (count (concat numbers numbers (list 1 2 3))))
@@ -0,0 +1,30 @@
+; Macro-heavy code: every iteration goes through several macro calls
+(defmacro! unless
+  (fn* (c a b) `(if ~c ~b ~a))
+)
+
+(defmacro! inc
+  (fn* (x) `(+ ~x 1))
+)
+
+(def! classify
+  (fn* (n)
+    (cond
+      (= (% n 15) 0) 3
+      (= (% n 5) 0) 2
+      (= (% n 3) 0) 1
+      true 0
+    )
+  )
+)
+
+(def! run
+  (fn* (i acc)
+    (unless (= i 0)
+      (run (- i 1) (+ acc (classify i) (inc 0)))
+      acc
+    )
+  )
+)
+
+(prn (run 20000 0))
@@ -0,0 +1,19 @@
+; Parsing a large input: a long source string is built, then read back
+(def! element
+  (fn* (i)
+    (str "(def! x" i " [" i " \"s" i "\" :k" i " {:a (+ " i " 1)}])\n")
+  )
+)
+
+(def! source
+  (fn* (i acc)
+    (if (= i 0)
+      acc
+      (source (- i 1) (cons (element i) acc))
+    )
+  )
+)
+
+; Printing the list of strings without quotes gives a single list holding all the definitions
+(def! text (str (source 5000 '())))
+(prn (count (read-string text)))
@@ -0,0 +1,12 @@
+; Printing a large structure: a nested tree of lists, vectors and maps is turned into a string
+(def! tree
+  (fn* (depth)
+    (if (= depth 0)
+      [1 "two" :three {:four 4}]
+      (list (tree (- depth 1)) (tree (- depth 1)))
+    )
+  )
+)
+
+(def! big (tree 12))
+(prn (count (pr-str big)))
@@ -0,0 +1,11 @@
+; Non-tail recursion: every call waits for the two calls it makes
+(def! fib
+  (fn* (n)
+    (if (< n 2)
+      n
+      (+ (fib (- n 1)) (fib (- n 2)))
+    )
+  )
+)
+
+(prn (fib 20))
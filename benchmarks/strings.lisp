@@ -0,0 +1,11 @@
+; String building: a string grown one piece at a time
+(def! build
+  (fn* (i s)
+    (if (= i 0)
+      s
+      (build (- i 1) (str s i ","))
+    )
+  )
+)
+
+(prn (count (build 20000 "")))
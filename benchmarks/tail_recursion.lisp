@@ -0,0 +1,11 @@
+; Deep tail recursion: a counting loop that only runs in constant stack space if tail calls are optimized
+(def! count-down
+  (fn* (n acc)
+    (if (= n 0)
+      acc
+      (count-down (- n 1) (+ acc 1))
+    )
+  )
+)
+
+(prn (count-down 100000 0))
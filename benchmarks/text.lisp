@@ -0,0 +1,34 @@
+; Text processing: a megabyte of text is built with a string builder, then split, searched and joined back with the string builtins
+(def! line
+  (fn* (i)
+    (str "line " i ": the quick brown fox jumps over the lazy dog, again and again and again\n")
+  )
+)
+
+(def! build
+  (fn* (i builder)
+    (if (= i 0)
+      (str builder)
+      (build (- i 1) (append! builder (line i)))
+    )
+  )
+)
+
+(def! text (build 12000 (string-builder)))
+
+; Counting the occurrences of a word by searching from the previous one, without copying the text
+(def! occurrences
+  (fn* (text word start n)
+    (let* (i (index-of text word start))
+      (if (= i nil)
+        n
+        (occurrences text word (+ i 1) (+ n 1))
+      )
+    )
+  )
+)
+
+(def! lines (split text "\n"))
+(prn (count text) (count lines) (count (split text)))
+(prn (occurrences (subs text 0 (count text)) "fox" 0 0))
+(prn (count (join "\n" (reverse lines))) (= (reverse (reverse text)) text))
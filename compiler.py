@@ -0,0 +1,365 @@
+from lisp_types import *
+from memo import Memoized, missing
+import evaluator, jit, profiler
+
+""" This file contains an alternative engine to the one in evaluator.py. Instead of walking the abstract syntax tree every time it runs, each form is analyzed once and turned into a tree of Python closures (one per special form, call site, symbol and constant). Running a form then only means calling its closure with an environment. The bodies of fn* forms are analyzed together with the form that contains them, so calling a function never looks at its AST again. """
+
+# A quick explanation of how tail calls work here: a call in tail position doesn't call the procedure, it returns a TailCall holding the procedure and its arguments instead. That value travels back up through the closures of the body (if, do and let* simply return what their tail position returned), until it reaches the call that isn't in tail position, which runs it and loops on what comes back (see resume()). This keeps the Python stack flat in the same cases where evaluate() would continue its loop.
+
+# A quick explanation of lexical addressing: the parameters of fn* and the bindings of let* are known during analysis, so every symbol that refers to one of them is resolved to a (depth, slot) pair: how many frames to go out, and which slot to read there. At runtime a frame is a plain Python list holding the outer frame at index 0 followed by the values of its slots, so a lookup is a couple of indexing operations instead of a walk through dictionaries. Symbols that aren't bound lexically are looked up in the Environment the form was evaluated in (usually the global one), which stays dictionary based.
+
+class TailCall:
+  """ A pending call to a Procedure, returned from a tail position instead of the call's result """
+  __slots__ = ('proc', 'args')
+
+  def __init__(self, proc, args):
+    self.proc = proc
+    self.args = args
+
+class Entry:
+  """ The code of a compiled Procedure: the closure of its body, along with how many fixed parameters it has, and whether it has a variadic one. Calling it with the outer frame and the arguments builds the procedure's frame and runs the body. When there are exactly as many arguments as fixed parameters, which is the most common case, callers build the frame themselves instead (exact is that number, or -1 for variadic procedures), which saves a Python frame. """
+  __slots__ = ('body', 'fixed', 'variadic', 'exact')
+
+  def __init__(self, body, fixed, variadic):
+    self.body = body
+    self.fixed = fixed
+    self.variadic = variadic
+    self.exact = -1 if variadic else fixed
+
+  def __call__(self, outer, args):
+    if len(args) < self.fixed:
+      raise TypeError(f"Expected {self.fixed} arguments, got {len(args)}")
+    if self.variadic:
+      return self.body([outer, *args[:self.fixed], List(args[self.fixed:])])
+    return self.body([outer, *args[:self.fixed]])
+
+class Scope:
+  """ The names bound by a fn* or let* frame during analysis, in slot order, along with the scope that encloses it """
+  __slots__ = ('names', 'outer', 'defined', 'pending')
+
+  def __init__(self, names, outer):
+    self.names = names
+    self.outer = outer
+    # Slots created by def! inside the frame, which might not have been assigned yet when they are read
+    self.defined = set()
+    # Slots of let* bindings whose value is being analyzed. The value sees its own name (a fn* in it can call itself), but reading the name before the value is assigned finds the binding outside the let*, as it does with the other engines.
+    self.pending = set()
+
+  def add(self, name):
+    """ Returns the slot of a name in this scope, allocating a new one if needed """
+    if name in self.names:
+      return self.names.index(name)
+    self.names.append(name)
+    return len(self.names) - 1
+
+  def resolve(self, name):
+    """ Returns the (depth, slot) pair of a name, along with the scope that holds it, or None if the name isn't bound lexically """
+    scope, depth = self, 0
+    while scope is not None:
+      if name in scope.names:
+        return depth, scope.names.index(name), scope
+      scope, depth = scope.outer, depth + 1
+    return None
+
+# Placeholder held by slots that def! hasn't assigned yet
+unbound = object()
+
+def evaluate(ast, env):
+  """ Analyzes an abstract syntax tree and runs the resulting closure in a given environment """
+  return analyze(ast, None, env)(env)
+
+def analyze(ast, scope, base, tail=False):
+  """ Turns an abstract syntax tree into a closure that takes a frame (or the base Environment, outside of any fn* or let*) and returns the value of the tree. Scope holds the lexically bound names, base is the Environment everything else is looked up in. If tail is true, the tree is in tail position, and calls to procedures it makes are returned as TailCalls. """
+  if isinstance(ast, Symbol):
+    return analyze_symbol(ast, scope, base)
+  elif isinstance(ast, List):
+    if len(ast) == 0:
+      return analyze_constant(ast)
+    elif isinstance(ast[0], Symbol) and ast[0] in special_forms:
+      closure = special_forms[ast[0]](ast, scope, base, tail)
+      # Forms analyzed while profiling count how often they run; the others don't pay for it
+      return profiler.count_form(ast[0], closure) if profiler.current is not None else closure
+    else:
+      return analyze_call(ast, scope, base, tail)
+  elif isinstance(ast, Vector):
+    items = [analyze(elem, scope, base) for elem in ast]
+    return lambda env: Vector([item(env) for item in items])
+  elif isinstance(ast, Map):
+    items = [(key, analyze(value, scope, base)) for key, value in ast.items()]
+    return lambda env: Map({key: item(env) for key, item in items})
+  else:
+    return analyze_constant(ast)
+
+def analyze_constant(ast):
+  return lambda env: ast
+
+def analyze_symbol(symbol, scope, base):
+  """ Returns a closure that reads a symbol's value, either straight from its frame slot, or from the base Environment """
+  address = scope.resolve(symbol) if scope is not None else None
+  if address is None:
+    data = base.data
+    def lookup_global(env):
+      try:
+        return data[symbol]
+      except KeyError:
+        return base.get(symbol)
+    return lookup_global
+  depth, slot, owner = address
+  index = slot + 1
+  if slot in owner.pending:
+    outer = analyze_symbol(symbol, owner.outer, base)
+    def lookup_pending(env):
+      for _ in range(depth):
+        env = env[0]
+      value = env[index]
+      return outer(env[0]) if value is unbound else value
+    return lookup_pending
+  elif slot in owner.defined:
+    def lookup_defined(env):
+      for _ in range(depth):
+        env = env[0]
+      if index < len(env) and env[index] is not unbound:
+        return env[index]
+      raise ValueError(f"{symbol} not found")
+    return lookup_defined
+  elif depth == 0:
+    return lambda env: env[index]
+  elif depth == 1:
+    return lambda env: env[0][index]
+  elif depth == 2:
+    return lambda env: env[0][0][index]
+  else:
+    def lookup(env):
+      for _ in range(depth):
+        env = env[0]
+      return env[index]
+    return lookup
+
+def analyze_call(ast, scope, base, tail):
+  """ Analyzes a list that isn't a special form. If the first element turns out to name a macro when the call runs, the macro is expanded and the expansion analyzed; both are kept for as long as the same macro is found there. """
+  head = analyze(ast[0], scope, base)
+  items = [analyze(arg, scope, base) for arg in ast[1:]]
+  arity = len(items)
+  a, b, c = (items + [None] * 3)[:3]
+  may_be_macro = isinstance(ast[0], Symbol)
+  expansion = [None, None] # The macro last expanded at this call site, and the closure of its expansion
+
+  # The arguments are evaluated and the procedure entered right here, rather than by closures and functions of their own, so that a call only takes one Python frame, which keeps non-tail recursion about as deep as the other engines allow
+  def call(env):
+    func = head(env)
+    if may_be_macro and isinstance(func, Procedure) and func.is_macro:
+      if expansion[0] is not func:
+        # The expansion comes from the macro cache, so that analyzing the same form again (as eval does every time) doesn't run the macro again
+        expansion[1] = analyze(evaluator.macro_cache.expand(ast, func), scope, base, tail)
+        expansion[0] = func
+      else:
+        evaluator.macro_cache.hits += 1
+      return expansion[1](env)
+    if arity == 0:
+      values = []
+    elif arity == 1:
+      values = [a(env)]
+    elif arity == 2:
+      values = [a(env), b(env)]
+    elif arity == 3:
+      values = [a(env), b(env), c(env)]
+    else:
+      values = [item(env) for item in items]
+    if isinstance(func, Procedure) and func.code is not None:
+      if tail:
+        return TailCall(func, values)
+      if profiler.current is not None:
+        return run_procedure(func, values)
+      result = jit.call(func, values)
+      if result is jit.bail:
+        code = func.code
+        result = code.body([func.env, *values]) if len(values) == code.exact else code(func.env, values)
+      return resume(result) if type(result) is TailCall else result
+    if tail and type(func) is Memoized:
+      return TailCall(func, values)
+    if callable(func):
+      return func(*values)
+    raise SyntaxError("First element of list is not a function.")
+
+  return call
+
+def run_procedure(proc, args):
+  """ Calls a compiled Procedure, and returns the value that finally comes back once the calls it makes in tail position are done """
+  return resume(TailCall(proc, args))
+
+def resume(result):
+  """ Runs a TailCall, and keeps running whatever it returns in tail position until an actual value comes back. Tail calls to memoized procedures return the result they remember for their arguments, or continue into the procedure; in that case the value that finally comes back is remembered for them. """
+  pending = None
+  while type(result) is TailCall:
+    proc, args = result.proc, result.args
+    if type(proc) is Memoized:
+      memo = proc
+      key = memo.key(args)
+      result = memo.lookup(key)
+      if result is not missing:
+        break
+      proc = memo.proc
+      if not isinstance(proc, Procedure) or proc.code is None:
+        # Builtins and procedures of the other engine can't be continued into, so they are just called
+        result = proc(*args)
+        memo.store(key, result)
+        break
+      pending = [] if pending is None else pending
+      pending.append((memo, key))
+    # Hot procedures run their fast path instead (see jit.py)
+    result = jit.call(proc, args)
+    if result is jit.bail:
+      code = proc.code
+      result = code.body([proc.env, *args]) if len(args) == code.exact else code(proc.env, args)
+
+  if pending is not None:
+    for memo, key in reversed(pending):
+      memo.store(key, result)
+  return result
+
+def make_procedure(ast, params, env, code, scope=None, base=None):
+  """ Creates a Procedure that runs the closure code, and can still be called like any other Python function. The scope and base the fn* form was analyzed in are kept, so that the procedure can be analyzed again after being sent to another process (see parallel.py). """
+  proc = Procedure(ast, params, env, None, code=code)
+  proc.fn = lambda *arguments: run_procedure(proc, arguments)
+  proc.scope, proc.base = scope, base
+  return proc
+
+# Analyzers for the special forms. Each receives the whole form, the scope and base it appears in, and whether it is in tail position, and returns the closure that runs it. They mirror the branches of evaluator.evaluate().
+
+def analyze_def(ast, scope, base, tail, is_macro=False):
+  key, value = ast[1], analyze(ast[2], scope, base)
+  if scope is None:
+    def define(env):
+      result = value(env)
+      if is_macro:
+        result.is_macro = True
+      evaluator.bind(env, key, result)
+      return result
+    return define
+
+  # Inside a fn* or let*, def! binds the name in the innermost frame, so it gets a slot there like any other local
+  slot = scope.add(key)
+  scope.defined.add(slot)
+  index = slot + 1
+
+  def define_local(env):
+    result = value(env)
+    if is_macro:
+      result.is_macro = True
+    if isinstance(result, Procedure) and result.name is None:
+      result.name = str(key)
+    if index >= len(env):
+      env.extend([unbound] * (index + 1 - len(env)))
+    env[index] = result
+    return result
+
+  return define_local
+
+def analyze_let(ast, scope, base, tail):
+  var_list = ast[1]
+  if not (isinstance(var_list, (List, Vector)) and len(var_list) % 2 == 0):
+    def invalid(env):
+      raise SyntaxError("Invalid argument list supplied.")
+    return invalid
+
+  # Like the other engines, which bind the names in the let*'s environment one by one, each value sees the bindings before it and its own name, whose slot is reserved before the value is analyzed. A name bound again keeps its slot, which holds the previous value until the new one is assigned.
+  let_scope = Scope([], scope)
+  bindings = []
+  for i in range(0, len(var_list), 2):
+    is_new = var_list[i] not in let_scope.names
+    slot = let_scope.add(var_list[i])
+    if is_new:
+      let_scope.pending.add(slot)
+    value = analyze(var_list[i + 1], let_scope, base)
+    let_scope.pending.discard(slot)
+    bindings.append((slot + 1, is_new, value))
+  body = analyze(ast[2], let_scope, base, tail)
+
+  def let(env):
+    frame = [env]
+    for index, is_new, value in bindings:
+      if is_new:
+        frame.append(unbound)
+      frame[index] = value(frame)
+    return body(frame)
+
+  return let
+
+def analyze_do(ast, scope, base, tail):
+  if len(ast) == 1:
+    return lambda env: nil
+  exprs = [analyze(expr, scope, base) for expr in ast[1:-1]]
+  last = analyze(ast[-1], scope, base, tail)
+
+  def do(env):
+    for expr in exprs:
+      expr(env)
+    return last(env)
+
+  return do
+
+def analyze_if(ast, scope, base, tail):
+  cond, true = analyze(ast[1], scope, base), analyze(ast[2], scope, base, tail)
+  false = analyze(ast[3], scope, base, tail) if len(ast) > 3 else None
+
+  def branch(env):
+    ev = cond(env)
+    if ev is False or ev is nil:
+      return false(env) if false is not None else nil
+    return true(env)
+
+  return branch
+
+def analyze_fn(ast, scope, base, tail):
+  params, body = ast[1], ast[2]
+  entry = analyze_entry(params, body, scope, base)
+  return lambda env: make_procedure(body, params, env, entry, scope, base)
+
+def analyze_entry(params, body, scope, base):
+  """ Analyzes the body of a fn* form into the Entry of the procedures it creates. The profiler also uses it to analyze the bodies of the procedures that exist when it starts again, so that their special forms are counted (see profiler.count_form()). """
+  # The parameters take the first slots of the frame. If there is a "&", the parameter after it takes the slot after the fixed ones, and receives the remaining arguments as a List.
+  names = [param for param in params if param != "&"]
+  fixed = len(names) - 1 if len(names) < len(params) else len(names)
+  variadic = fixed < len(names)
+  return Entry(analyze(body, Scope(names, scope), base, tail=True), fixed, variadic)
+
+def analyze_quote(ast, scope, base, tail):
+  return analyze_constant(ast[1])
+
+def analyze_quasiquote(ast, scope, base, tail):
+  return analyze(evaluator.quasiquote(ast[1]), scope, base, tail)
+
+def analyze_defmacro(ast, scope, base, tail):
+  return analyze_def(ast, scope, base, tail, is_macro=True)
+
+def analyze_macroexpand(ast, scope, base, tail):
+  # Macros are looked up in the base Environment, as frames don't have names to look them up by
+  return lambda env: evaluator.macroexpand(ast[1], base)
+
+def analyze_profile(ast, scope, base, tail):
+  expr = analyze(ast[1], scope, base, tail)
+
+  def profile(env):
+    if profiler.current is not None:
+      return expr(env)
+    profiler.start(base)
+    try:
+      # The argument is analyzed again once the profiler runs, so that its special forms are counted
+      return analyze(ast[1], scope, base)(env)
+    finally:
+      profiler.stop()
+
+  return profile
+
+special_forms = {
+  Symbol('def!'): analyze_def,
+  Symbol('let*'): analyze_let,
+  Symbol('do'): analyze_do,
+  Symbol('if'): analyze_if,
+  Symbol('fn*'): analyze_fn,
+  Symbol('quote'): analyze_quote,
+  Symbol('quasiquote'): analyze_quasiquote,
+  Symbol('defmacro!'): analyze_defmacro,
+  Symbol('macroexpand'): analyze_macroexpand,
+  Symbol('profile'): analyze_profile
+}
@@ -1,15 +1,17 @@
-import collections, global_env, lisp_types
+import lisp_types
 
 class Environment():
   """
   Environment represents an associative data structure that holds Symbols (or Keywords) and some associated value. Internally it uses a Python dictionary to achieve this. Environments can also be nested within each other (thus enabling scoping) by the way of the 'outer' attribute
   """
-  def __init__(self, outer=None, keys=(), vals=(), is_global=False):
+  __slots__ = ('outer', 'data')
+
+  def __init__(self, outer=None, keys=(), vals=(), bindings=None):
     self.outer = outer
     self.data = dict()
-    if is_global:
-      # If the global environment is supposed to be instantiated, then we want to load all the basic functions
-      self.data.update(global_env.funcs)
+    if bindings is not None:
+      # The global environment starts out with the builtins (see global_env.py) bound
+      self.data.update(bindings)
     # If any key/values are provided, they are to be paired up and added to the environment being created
     for i in range(len(keys)):
       if keys[i] == "&":
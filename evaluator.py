@@ -1,121 +1,162 @@
 from lisp_types import *
 from environment import Environment as Env
+from memo import Memoized, missing
+import jit, profiler
 
 """ This file contains the heart of the interpreter. It is concerned with parsing an abstract syntax tree, and evaluate it until it can be evaluated no further (usually arriving at a single value) """
 
-# The special forms are language constructs that control execution flow, modify the environment, declare functions, and deal with macros.
-special_forms = [Symbol('def!'), Symbol('let*'), Symbol('do'), Symbol('if'), Symbol('fn*'), Symbol('quote'), Symbol('quasiquote'), Symbol('defmacro!'), Symbol('macroexpand')]
-
 # A quick explanation of tail call optimization: the evaluate function contains an infinite loop. This allows optimizing function calls that are tail recursive (they call themselves as the last statement of the function). This is achieved by setting the ast to whatever needs to be evaluated next, change the environment if needed, and then continuing from the top of the loop for another cycle of evaluation. This allows writing smarter and more performant recursive functions that avoid overflowing the call stack in the case of deep recursion.
 def evaluate(ast, env):
   """ Evaluates an abstract syntax tree in a given environment """
+  # Calls to memoized procedures that were continued into by tail call optimization. They all return the value this evaluation ends with, which is remembered for them once it's known.
+  pending = None
+
   while True: # Infinite loop used for tail call optimization
     # First check if the AST is a macro, and if so expand it.
     ast = macroexpand(ast, env)
 
     # If the ast is not a list, call the mutually recursive eval_ast() function on it.
     if not isinstance(ast, List):
-      return eval_ast(ast, env)
+      value = eval_ast(ast, env)
+      break
 
     # Return the AST as it is, if it's just an empty sequence, as there's nothing more to be done.
     if len(ast) == 0:
-      return ast
-    elif not isinstance(ast[0], List) and ast[0] in special_forms:
-
-      # This following section deals with applying the logic of each special form.
-      form, args = ast[0], ast[1:]
-
-      # def! assigns a value to a key in the current environment.
-      if form == Symbol("def!"):
-        value = evaluate(args[1], env)
-        env.define(args[0], value)
-        return value
-
-      # let* evaluates a form in a temporary environment.
-      elif form == Symbol("let*"):  
-        var_list = args[0]
-        if isinstance(var_list, (List, Vector)) and len(var_list) % 2 == 0:
-          new_env = Env(outer=env)
-          for i in range(0, len(var_list), 2):
-            new_env.define(var_list[i], evaluate(var_list[i + 1], new_env))
-          env = new_env
-          ast = args[1]
-          continue # Tail call optimization
-        else:
-          raise SyntaxError("Invalid argument list supplied.")
-
-      # do evaluates all the elements of the list, and returns the final evaluated one. This constructs provides a way to sequentially execute things.
-      elif form == Symbol("do"):
-        for expr in args[:-1]:
-          last = evaluate(expr, env)
-        ast = args[-1]
-        continue # Tail call optimization
-
-      # if works as you'd expect. To be noted that it only evaluates the needed argument (first argument if the condition is true, second otherwise), and is also tail call optimized.
-      elif form == Symbol("if"):
-        cond, true = args[0], args[1]
-        false = args[2] if len(args) > 2 else None
-        ev = evaluate(cond, env)
-        if ev is False or ev == Nil():
-          if false is not None:
-            ast = false
-            continue
-          else:
-            return Nil()
-        else:
-          ast = true
-          continue
-
-      # fn* defines a lambda function, with the first argument being the parameter list, and the second being the function's body.
-      elif form == Symbol("fn*"):
-        params, body = args[0], args[1]
-
-        def fn(*arguments):
-          return evaluate(body, Env(env, params, arguments))
-        
-        return Procedure(body, params, env, fn)
-
-      # quote defers evaluation, just returning its argument as it is.
-      elif form == Symbol('quote'):
-        return args[0]
-
-      # quasiquote enables a quoted list to have certain elements evaluted by the way of unquote and splice-unquote.
-      elif form == Symbol('quasiquote'):
-        ast = quasiquote(args[0])
-        continue # Tail call optimized
-
-      # defmacro! defines a new macro in the current environment.
-      elif form == Symbol("defmacro!"):
-        value = evaluate(args[1], env)
-        value.is_macro = True
-        env.define(args[0], value)
-        return value
-
-      # macroexpand allows explicitly calling the macroexpand function. This can aid in debugging macros.
-      elif form == Symbol("macroexpand"):
-        return macroexpand(args[0], env)
-
-      # End of special forms logic
+      value = ast
+      break
+
+    # Special forms are looked up by their symbol in the special_forms table. Their handler either returns a final value (and None in place of the environment), or the AST and environment to continue with.
+    form = special_forms.get(ast[0]) if isinstance(ast[0], Symbol) else None
+    if form is not None:
+      ast, env = form(ast, env)
+      if env is None:
+        value = ast
+        break
+      continue # Tail call optimization
+
+    # First evaluate the list that holds the AST
+    evaluated = eval_ast(ast, env)
+
+    # Procedures primarily represent user defined functions. Hot ones run their fast path (see jit.py).
+    if isinstance(evaluated[0], Procedure) and evaluated[0].code is None:
+      proc, args = evaluated[0], evaluated[1:]
+      value = jit.call(proc, args)
+      if value is not jit.bail:
+        break
+      ast = proc.ast
+      env = proc.make_env(Env, args)
+      continue # Tail call optimization
+
+    # Memoized procedures return the result they remember for the arguments, or continue into the procedure like above
+    elif type(evaluated[0]) is Memoized and isinstance(evaluated[0].proc, Procedure) and evaluated[0].proc.code is None:
+      memo, args = evaluated[0], evaluated[1:]
+      key = memo.key(args)
+      value = memo.lookup(key)
+      if value is not missing:
+        break
+      pending = [] if pending is None else pending
+      pending.append((memo, key))
+      ast = memo.proc.ast
+      env = memo.proc.make_env(Env, args)
+      continue # Tail call optimization
+
+    # Callables represent the built-in functions, fully evaluated procedures, or procedures created by the compiler engine
+    elif callable(evaluated[0]):
+      value = evaluated[0](*evaluated[1:])
+      break
+
+    # During evaluation, a Lisp list is expected to hold a function reference as its first element
+    else:
+      raise SyntaxError("First element of list is not a function.")
+
+  if pending is not None:
+    # Stored innermost first, so that the outermost call ends up the most recently used
+    for memo, key in reversed(pending):
+      memo.store(key, value)
+  return value
 
+# The special forms are language constructs that control execution flow, modify the environment, declare functions, and deal with macros. The following functions deal with applying the logic of each of them.
+
+def eval_def(ast, env):
+  """ def! assigns a value to a key in the current environment. """
+  value = evaluate(ast[2], env)
+  bind(env, ast[1], value)
+  return value, None
+
+def eval_let(ast, env):
+  """ let* evaluates a form in a temporary environment. """
+  var_list = ast[1]
+  if isinstance(var_list, (List, Vector)) and len(var_list) % 2 == 0:
+    new_env = Env(outer=env)
+    for i in range(0, len(var_list), 2):
+      new_env.define(var_list[i], evaluate(var_list[i + 1], new_env))
+    return ast[2], new_env
+  else:
+    raise SyntaxError("Invalid argument list supplied.")
+
+def eval_do(ast, env):
+  """ do evaluates all the elements of the list, and returns the final evaluated one. This constructs provides a way to sequentially execute things. """
+  for expr in ast[1:-1]:
+    evaluate(expr, env)
+  return ast[-1], env
+
+def eval_if(ast, env):
+  """ if works as you'd expect. To be noted that it only evaluates the needed argument (first argument if the condition is true, second otherwise), and is also tail call optimized. """
+  ev = evaluate(ast[1], env)
+  if ev is False or ev is nil:
+    if len(ast) > 3:
+      return ast[3], env
     else:
-      # First evaluate the list that holds the AST
-      evaluated = eval_ast(ast, env)
+      return nil, None
+  else:
+    return ast[2], env
+
+def eval_fn(ast, env):
+  """ fn* defines a lambda function, with the first argument being the parameter list, and the second being the function's body. """
+  return make_procedure(ast[2], ast[1], env), None
+
+def eval_quote(ast, env):
+  """ quote defers evaluation, just returning its argument as it is. """
+  return ast[1], None
 
-      # Procedures primarily represent user defined functions
-      if isinstance(evaluated[0], Procedure):
-        proc = evaluated[0]
-        ast = proc.ast
-        env = proc.make_env(Env, evaluated[1:])
-        continue # Tail call optimization
+def eval_quasiquote(ast, env):
+  """ quasiquote enables a quoted list to have certain elements evaluted by the way of unquote and splice-unquote. """
+  return quasiquote(ast[1]), env
 
-      # Callables represent the built-in functions or fully evaluated procedures
-      elif callable(evaluated[0]):
-        return evaluated[0](*evaluated[1:])
+def eval_defmacro(ast, env):
+  """ defmacro! defines a new macro in the current environment. """
+  value = evaluate(ast[2], env)
+  value.is_macro = True
+  bind(env, ast[1], value)
+  return value, None
+
+def eval_profile(ast, env):
+  """ profile evaluates its argument with the profiler running, and prints a report of where the time went. Inside another profile form, or when the whole program is being profiled, it just evaluates its argument. """
+  if profiler.current is not None:
+    return ast[1], env
+  profiler.start(env)
+  try:
+    value = evaluate(ast[1], env)
+  finally:
+    profiler.stop()
+  return value, None
 
-      # During evaluation, a Lisp list is expected to hold a function reference as its first element
-      else:
-        raise SyntaxError("First element of list is not a function.")
-      
+def eval_macroexpand(ast, env):
+  """ macroexpand allows explicitly calling the macroexpand function. This can aid in debugging macros. """
+  return macroexpand(ast[1], env), None
+
+special_forms = {
+  Symbol('def!'): eval_def,
+  Symbol('let*'): eval_let,
+  Symbol('do'): eval_do,
+  Symbol('if'): eval_if,
+  Symbol('fn*'): eval_fn,
+  Symbol('quote'): eval_quote,
+  Symbol('quasiquote'): eval_quasiquote,
+  Symbol('defmacro!'): eval_defmacro,
+  Symbol('macroexpand'): eval_macroexpand,
+  Symbol('profile'): eval_profile
+}
 
 def eval_ast(ast, env):
   """ Function that is mutually recursive with evaluate(), thus enabling the actual evaluation of an abstract syntax tree (which is a nested data structure) """
@@ -151,24 +192,124 @@ def quasiquote(ast):
   else:
     return List([Symbol('cons'), quasiquote(ast[0]), quasiquote(ast[1:])])
 
-def is_macro_call(ast, env):
-  """ Check if a procedure of callable is flagged as being a macro """
+def make_procedure(body, params, env):
+  """ Creates the Procedure of a fn* form, closing over env """
+  def fn(*arguments):
+    value = jit.call(proc, arguments)
+    if value is jit.bail:
+      value = evaluate(body, Env(env, params, arguments))
+    return value
+
+  proc = Procedure(body, params, env, fn)
+  return proc
+
+def get_macro(ast, env):
+  """ Returns the macro an AST calls, or None if it isn't a macro call. Only symbols that have been bound to a macro at some point are looked up, so regular calls are turned down by a single set lookup. """
   if not isinstance(ast, List):
-    return False
-  if len(ast) == 0 or not isinstance(ast[0], Symbol):
-    return False
+    return None
+  if len(ast) == 0 or not isinstance(ast[0], Symbol) or ast[0] not in macro_cache.names:
+    return None
   try:
     func = env.get(ast[0])
   except ValueError:
-    return False
-  if (isinstance(func, Procedure) or callable(func)) and hasattr(func, 'is_macro'):
-    return func.is_macro
+    return None
+  if (isinstance(func, Procedure) or callable(func)) and getattr(func, 'is_macro', False):
+    return func
   else:
-    return False
+    return None
 
 def macroexpand(ast, env):
   """ Expands a macro until it results in an AST that can be directly evaluated """
-  while is_macro_call(ast, env):
-    func = env.get(ast[0])
-    ast = func(*ast[1:])
-  return ast
\ No newline at end of file
+  macro = get_macro(ast, env)
+  while macro is not None:
+    ast = macro_cache.expand(ast, macro)
+    macro = get_macro(ast, env)
+  return ast
+
+def macroexpand_all(ast, env, bound=frozenset()):
+  """ Expands every macro call in an AST ahead of evaluation, instead of waiting for evaluate() to reach them. Quoted forms are left alone, and so are calls through names that a fn* or let* inside the AST binds locally. """
+  if isinstance(ast, List) and len(ast) > 0:
+    head = ast[0]
+    if isinstance(head, Symbol) and head not in bound:
+      macro = get_macro(ast, env)
+      if macro is not None:
+        return macroexpand_all(macro_cache.expand(ast, macro), env, bound)
+      if head in (Symbol('quote'), Symbol('quasiquote'), Symbol('macroexpand')):
+        return ast
+      if head == Symbol('fn*') and len(ast) > 2:
+        params = ast[1]
+        return List([head, params, macroexpand_all(ast[2], env, bound | set(params))])
+      if head == Symbol('let*') and len(ast) > 2 and is_non_empty_seq(ast[1]) and len(ast[1]) % 2 == 0:
+        var_list = []
+        for i in range(0, len(ast[1]), 2):
+          var_list += [ast[1][i], macroexpand_all(ast[1][i + 1], env, bound)]
+          bound = bound | {ast[1][i]}
+        return List([head, type(ast[1])(var_list), macroexpand_all(ast[2], env, bound)])
+      if head in (Symbol('def!'), Symbol('defmacro!')) and len(ast) > 2:
+        return List([head, ast[1], macroexpand_all(ast[2], env, bound)])
+    return List([macroexpand_all(elem, env, bound) for elem in ast])
+  elif isinstance(ast, Vector):
+    return Vector([macroexpand_all(elem, env, bound) for elem in ast])
+  elif isinstance(ast, Map):
+    return Map({key: macroexpand_all(value, env, bound) for key, value in ast.items()})
+  else:
+    return ast
+
+def bind(env, key, value):
+  """ Defines a key in an environment on behalf of def! and defmacro!, keeping the macro cache aware of which names are bound to macros. Procedures are named after the first name they are bound to. """
+  proc = value.proc if isinstance(value, Memoized) else value
+  if isinstance(proc, Procedure) and proc.name is None:
+    proc.name = str(key)
+  if getattr(value, 'is_macro', False):
+    macro_cache.register(key)
+  elif key in macro_cache.names:
+    macro_cache.invalidate(key)
+  env.define(key, value)
+
+class MacroCache:
+  """ Remembers what each macro call expanded to, so that evaluating the same AST again (in a loop, or every time a function runs) doesn't run the macro again. Entries are keyed on the identity of the call's AST node, and are only used while the call still refers to the same macro. """
+  limit = 100000 # Past this many entries the cache starts over, so code that keeps building new ASTs can't grow it forever
+
+  def __init__(self):
+    self.names = set()
+    self.entries = dict()
+    self.hits = 0
+    self.misses = 0
+
+  def register(self, name):
+    """ Records that a name is bound to a macro, as only calls through such names are checked for expansion """
+    self.names.add(name)
+    self.invalidate(name)
+
+  def invalidate(self, name):
+    """ Drops the expansions of calls through a name that is being redefined """
+    self.entries = {key: entry for key, entry in self.entries.items() if entry[0][0] is not name}
+
+  def expand(self, ast, macro):
+    """ Returns the expansion of a macro call, running the macro only if this call hasn't been expanded with it before """
+    expansion = self.lookup(ast, macro)
+    if expansion is None:
+      expansion = macro(*ast[1:])
+      self.store(ast, macro, expansion)
+    return expansion
+
+  def lookup(self, ast, macro):
+    """ Returns the expansion remembered for a macro call, or None if the macro has to be run """
+    entry = self.entries.get(id(ast))
+    if entry is not None and entry[1] is macro:
+      self.hits += 1
+      return entry[2]
+    return None
+
+  def store(self, ast, macro, expansion):
+    """ Remembers the expansion the macro produced for a call """
+    self.misses += 1
+    if len(self.entries) >= self.limit:
+      self.entries.clear()
+    # The AST itself is kept in the entry, so its id can't be reused by another object while the entry exists
+    self.entries[id(ast)] = (ast, macro, expansion)
+
+  def stats(self):
+    return Map({Keyword(':hits'): self.hits, Keyword(':misses'): self.misses, Keyword(':entries'): len(self.entries)})
+
+macro_cache = MacroCache()
@@ -1,5 +1,8 @@
 from lisp_types import *
-import printer, reader
+from numeric import NumArray
+from lazy import LazySeq
+import itertools, lazy, memo, memory, numeric, operator, printer, reader, strings, tasks, time
+from functools import reduce
 from math import sqrt, floor
 
 """ This file represents the standard functions available in the language """
@@ -17,22 +20,45 @@ def func_str(*args):
     return ""
 
 def func_prn(*args):
-  if args:
-    print(' '.join([printer.pr_str(elem, True) for elem in args]))
-  else:
-    print()
-  return Nil()
+  write_values(args, printer.output.write, True)
+  printer.output.write('\n')
+  return nil
 
 def func_println(*args):
-  if args:
-    print(' '.join([printer.pr_str(elem, False) for elem in args]))
-  else:
-    print()
-  return Nil()
+  write_values(args, printer.output.write, False)
+  printer.output.write('\n')
+  return nil
+
+def write_values(args, write, print_readably):
+  """ Writes values separated by spaces, the way prn and println print them """
+  for i, elem in enumerate(args):
+    if i > 0:
+      write(' ')
+    printer.pr_write(elem, write, print_readably)
+
+def slurp(path):
+  with open(path, 'r', encoding='UTF-8') as file:
+    return file.read()
+
+def spit(path, *args):
+  """ (spit path & values) writes values to a file the way println prints them, without a newline at the end, and streaming them so that large ones are never built as a single string """
+  with open(path, 'w', encoding='UTF-8') as file:
+    write_values(args, file.write, False)
+  return nil
+
+def pr_to_file(path, *args):
+  """ (pr-to-file path & values) writes values to a file the way prn prints them, so read-seq can read them back """
+  with open(path, 'w', encoding='UTF-8') as file:
+    write_values(args, file.write, True)
+    file.write('\n')
+  return nil
 
 def deref(atom):
   if isinstance(atom, Atom):
     return atom.value
+  elif hasattr(atom, 'deref'):
+    # Futures (see parallel.py) wait for their value
+    return atom.deref()
   else:
     raise TypeError('Cannot dereferrence because argument is not an atom.')
 
@@ -44,43 +70,241 @@ def swap(atom, func, *args):
   atom.value = func(atom.value, *args)
   return atom.value
 
+# The arithmetic and comparison functions take any number of arguments. Arguments can also be numeric arrays, in which case they work element by element (see numeric.py).
+
+def add(*args):
+  if len(args) == 2:
+    return args[0] + args[1]
+  return reduce(operator.add, args) if args else 0
+
+def subtract(first, *rest):
+  if len(rest) == 1:
+    return first - rest[0]
+  return reduce(operator.sub, rest, first) if rest else -first
+
+def multiply(*args):
+  if len(args) == 2:
+    return args[0] * args[1]
+  return reduce(operator.mul, args) if args else 1
+
+def divide(first, *rest):
+  return reduce(operator.truediv, rest, first) if rest else 1 / first
+
+def modulo(first, *rest):
+  return reduce(operator.mod, rest, first)
+
+def comparison(op):
+  """ Returns a function that checks whether op holds between each of its arguments and the next one """
+  def compare(*args):
+    if len(args) == 2 and type(args[0]) is not NumArray and type(args[1]) is not NumArray:
+      return op(args[0], args[1])
+    return numeric.compare(op, args)
+  return compare
+
+def elementwise_or(func, scalar_func):
+  """ Returns a function that applies func to the elements of an array argument, and scalar_func to anything else """
+  return lambda a: numeric.apply(func, a) if isinstance(a, NumArray) else scalar_func(a)
+
+def logical(op, scalar_op):
+  """ Returns the two argument and/or function, which combines masks element by element """
+  return lambda a, b: numeric.elementwise(op, a, b) if isinstance(a, NumArray) or isinstance(b, NumArray) else scalar_op(a, b)
+
+def reduction(array_func, seq_func):
+  return lambda seq: array_func(seq) if isinstance(seq, NumArray) else seq_func(seq)
+
+def extremum(array_func, func):
+  """ Returns min or max, which take either several numbers, or a single array """
+  return lambda *args: array_func(args[0]) if len(args) == 1 and isinstance(args[0], NumArray) else func(*args)
+
+def as_list(seq):
+  """ Returns a sequence as a List, without copying it if it already is one """
+  if isinstance(seq, List):
+    return seq
+  elif seq is nil:
+    return List()
+  else:
+    return List(seq)
+
+# cons, concat and rest build on Cons cells, which share the list they are given instead of copying it. On lazy sequences they return lazy sequences, so they never realize more of them than needed.
+
+def cons(el, lst):
+  if isinstance(lst, LazySeq):
+    return LazySeq(lambda: itertools.chain((el,), lst))
+  return Cons(el, as_list(lst))
+
+def concat(*lsts):
+  if not lsts:
+    return List()
+  if any(isinstance(lst, LazySeq) for lst in lsts):
+    return LazySeq(lambda: itertools.chain(*lsts))
+  result = as_list(lsts[-1])
+  for lst in reversed(lsts[:-1]):
+    result = Cons.from_seq(lst, result)
+  return result
+
+def rest(coll):
+  if isinstance(coll, Cons):
+    return coll.rest
+  elif isinstance(coll, LazySeq):
+    return coll.rest()
+  elif isinstance(coll, NumArray):
+    return coll[1:]
+  elif coll is nil or len(coll) <= 1:
+    return List()
+  else:
+    # Turning the rest of a regular List into cells once makes every following rest on it free
+    return Cons.from_seq(coll[1:])
+
+def first(coll):
+  if isinstance(coll, LazySeq):
+    return coll.first()
+  return nil if coll is nil or len(coll) == 0 else coll[0]
+
+def is_empty(coll):
+  return coll.is_empty() if isinstance(coll, LazySeq) else len(coll) == 0
+
+# Maps and vectors are persistent: assoc, dissoc and conj return new collections sharing most of their structure with the ones they are given (see persistent.py).
+
+def assoc(coll, *args):
+  if coll is nil:
+    coll = Map()
+  if not isinstance(coll, (Map, Vector)):
+    raise TypeError("assoc only works on maps and vectors.")
+  if len(args) % 2 != 0:
+    raise TypeError("assoc takes keys and values in pairs.")
+  for i in range(0, len(args), 2):
+    coll = coll.assoc(args[i], args[i + 1])
+  return coll
+
+def dissoc(coll, *keys):
+  if coll is nil:
+    return nil
+  if not isinstance(coll, Map):
+    raise TypeError("dissoc only works on maps.")
+  for key in keys:
+    coll = coll.dissoc(key)
+  return coll
+
+def is_index(coll, key):
+  return type(key) is int and 0 <= key < len(coll)
+
+def get(coll, key, default=nil):
+  if isinstance(coll, Map):
+    return coll.get(key, default)
+  elif isinstance(coll, (List, Vector, NumArray)) and is_index(coll, key):
+    return coll[key]
+  return default
+
+def contains(coll, key):
+  if isinstance(coll, Map):
+    return key in coll
+  elif isinstance(coll, (List, Vector, NumArray)):
+    return is_index(coll, key)
+  return False
+
+def conj(coll, *elems):
+  """ Adds elements where the collection makes it cheap: at the end of vectors, at the front of lists, and [key value] pairs (or whole maps) to maps """
+  if isinstance(coll, Vector):
+    for elem in elems:
+      coll = coll.conj(elem)
+  elif isinstance(coll, Map):
+    for elem in elems:
+      pairs = elem.items() if isinstance(elem, Map) else [elem]
+      for pair in pairs:
+        if len(pair) != 2:
+          raise TypeError("Only [key value] pairs can be added to maps.")
+        coll = coll.assoc(pair[0], pair[1])
+  else:
+    for elem in elems:
+      coll = cons(elem, coll)
+  return coll
+
 funcs = {
-  Symbol('+'): lambda a, b: a + b,
-  Symbol('-'): lambda a, b: a - b,
-  Symbol('*'): lambda a, b: a * b,
-  Symbol('/'): lambda a, b: a / b,
-  Symbol('%'): lambda a, b: a % b,
-  Symbol('='): lambda a, b: a == b,
-  Symbol('<'): lambda a, b: a < b,
-  Symbol('<='): lambda a, b: a <= b,
-  Symbol('>'): lambda a, b: a > b,
-  Symbol('>='): lambda a, b: a >= b,
-  Symbol('sqrt'): lambda a: sqrt(a),
-  Symbol('floor'): lambda a: floor(a),
-  Symbol('not'): lambda a: (a is False or a == Nil()),
-  Symbol('and'): lambda a, b: a and b,
-  Symbol('or'): lambda a, b: a or b,
+  Symbol('+'): add,
+  Symbol('-'): subtract,
+  Symbol('*'): multiply,
+  Symbol('/'): divide,
+  Symbol('%'): modulo,
+  Symbol('='): comparison(operator.eq),
+  Symbol('<'): comparison(operator.lt),
+  Symbol('<='): comparison(operator.le),
+  Symbol('>'): comparison(operator.gt),
+  Symbol('>='): comparison(operator.ge),
+  Symbol('sqrt'): elementwise_or(sqrt, sqrt),
+  Symbol('floor'): elementwise_or(floor, floor),
+  Symbol('not'): elementwise_or(operator.not_, lambda a: (a is False or a is nil)),
+  Symbol('and'): logical(operator.and_, lambda a, b: a and b),
+  Symbol('or'): logical(operator.or_, lambda a, b: a or b),
+  Symbol('min'): extremum(numeric.array_min, min),
+  Symbol('max'): extremum(numeric.array_max, max),
+  Symbol('sum'): reduction(numeric.array_sum, sum),
+  Symbol('prod'): reduction(numeric.array_prod, lambda seq: reduce(operator.mul, seq, 1)),
+  Symbol('dot'): numeric.dot,
+  Symbol('array'): lambda *n: numeric.make_array(n[0] if len(n) == 1 and not isinstance(n[0], (int, float)) else n),
+  Symbol('array?'): lambda n: isinstance(n, NumArray),
+  Symbol('arange'): numeric.arange,
+  Symbol('select'): numeric.select,
   Symbol('list'): lambda *n: List(n),
   Symbol('vector'): lambda *n: Vector(n),
   Symbol('list?'): lambda n: isinstance(n, List),
   Symbol('vector?'): lambda n: isinstance(n, Vector),
-  Symbol('empty?'): lambda n: len(n) == 0,
+  Symbol('map?'): lambda n: isinstance(n, Map),
+  Symbol('assoc'): assoc,
+  Symbol('dissoc'): dissoc,
+  Symbol('get'): get,
+  Symbol('contains?'): contains,
+  Symbol('keys'): lambda n: List(n.keys()),
+  Symbol('vals'): lambda n: List(n.values()),
+  Symbol('conj'): conj,
+  Symbol('empty?'): is_empty,
   Symbol('count'): lambda n: len(n),
+  Symbol('string?'): strings.is_string,
+  Symbol('subs'): strings.subs,
+  Symbol('string-builder'): strings.string_builder,
+  Symbol('append!'): strings.append,
+  Symbol('reverse'): strings.reverse,
+  Symbol('join'): strings.join,
+  Symbol('split'): strings.split,
+  Symbol('index-of'): strings.index_of,
   Symbol('pr-str'): func_pr_str,
   Symbol('str'): func_str,
   Symbol('prn'): func_prn,
   Symbol('println'): func_println,
-  Symbol('read-string'): reader.read_str,
-  Symbol('slurp'): lambda file: open(file, 'r', encoding='UTF-8').read(),
+  Symbol('read-string'): lambda strg: reader.read_str(strings.as_str(strg)),
+  Symbol('read-seq'): lambda file: LazySeq(lambda: reader.read_file(file)),
+  Symbol('slurp'): AsyncBuiltin(slurp, tasks.slurp),
+  Symbol('spit'): AsyncBuiltin(spit, tasks.spit),
+  Symbol('sh'): AsyncBuiltin(tasks.sh, tasks.sh_async),
+  Symbol('pr-to-file'): pr_to_file,
   Symbol('atom'): lambda n: Atom(n),
   Symbol('atom?'): lambda n: isinstance(n, Atom),
   Symbol('deref'): deref,
   Symbol('reset!'): reset,
   Symbol('swap!'): swap,
-  Symbol('cons'): lambda el, lst: List([el, *lst]),
-  Symbol('concat'): lambda *lsts: List([el for lst in lsts for el in lst]),
+  Symbol('cons'): cons,
+  Symbol('concat'): concat,
   Symbol('nth'): lambda coll, index: coll[index],
-  Symbol('first'): lambda coll: Nil() if isinstance(coll, Nil) or len(coll) == 0 else coll[0],
-  Symbol('rest'): lambda coll: List() if isinstance(coll, Nil) or len(coll) == 0 else List(coll[1:]),
-  Symbol('take'): lambda coll, index: coll[:index]
+  Symbol('first'): first,
+  Symbol('rest'): rest,
+  Symbol('take'): lazy.take,
+  Symbol('drop'): lazy.drop,
+  Symbol('range'): lazy.lazy_range,
+  Symbol('iterate'): lazy.iterate,
+  Symbol('map'): lazy.lazy_map,
+  Symbol('filter'): lazy.lazy_filter,
+  Symbol('take-while'): lazy.take_while,
+  Symbol('reduce'): lazy.lazy_reduce,
+  Symbol('seq?'): lambda n: isinstance(n, LazySeq),
+  Symbol('memoize'): memo.memoize,
+  Symbol('memo-stats'): memo.memo_stats,
+  Symbol('mem-stats'): memory.mem_stats,
+  Symbol('spawn'): tasks.spawn,
+  Symbol('task?'): lambda n: isinstance(n, tasks.Task),
+  Symbol('await'): AsyncBuiltin(tasks.blocking(tasks.await_task), tasks.await_task),
+  Symbol('sleep'): AsyncBuiltin(tasks.blocking(tasks.sleep, time.sleep), tasks.sleep),
+  Symbol('chan'): lambda size=None: tasks.Channel(size),
+  Symbol('chan?'): lambda n: isinstance(n, tasks.Channel),
+  Symbol('take!'): AsyncBuiltin(tasks.blocking(tasks.take), tasks.take),
+  Symbol('put!'): AsyncBuiltin(tasks.blocking(tasks.put), tasks.put),
+  Symbol('close!'): tasks.close
 }
\ No newline at end of file
@@ -0,0 +1,304 @@
+import environment, evaluator, global_env, keyword, math, printer, profiler, sys
+from lisp_types import *
+
+""" This file implements the JIT compiler, the tier above the engines: every engine counts the calls to each procedure, and once a procedure has been called often enough (threshold times), its body is translated into the source of a Python function, compiled with compile() and exec, and kept as the procedure's fast path. From then on, calling the procedure runs that function instead of evaluating the body: no AST dispatch, no argument lists built from the AST, and no Environment per call, as parameters and let* bindings are Python locals. Self tail calls become a while loop that reassigns the parameters, and calls to the builtins of global_env.py call the builtin directly (the arithmetic ones with two arguments are Python operators).
+
+Only a procedure defined at the top level (closing over the global environment) whose body sticks to what can be translated gets a fast path: parameters, literals, if, do, let*, quote, vector and map literals, macros (expanded when the procedure is compiled), calls to builtins, and calls to the procedure itself in tail position. Anything else (fn*, def!, calls to other procedures or through parameters, self calls in other positions, which would grow the Python stack) leaves the procedure interpreted. --jit-dump prints the source of every fast path, or why a procedure didn't get one.
+
+The globals a fast path relies on (the builtins it calls, the macros it expanded and the procedure's own name) are looked up once, when it is compiled; other globals are read from the global environment every time, since a function the fast path calls could change them at any point. Each call checks that they are all still bound to the same values, and so does every iteration of the loop. If one of them was rebound, the fast path is dropped, the call goes on interpreted (from the current iteration, if the loop had started), and the procedure can be compiled again once it gets hot again. """
+
+# Whether procedures get compiled at all (lisp.py --no-jit turns it off), how many calls make a procedure hot, and whether the source of each fast path is printed (on stderr)
+enabled = True
+threshold = 100
+dump = False
+
+# Returned by call() when the procedure has to be interpreted instead
+bail = object()
+
+class NotCompilable(Exception):
+  """ Raised while translating a procedure that can't have a fast path, with the reason why """
+  pass
+
+# The builtins that are written as Python operators when they are called with two arguments, which is what they do then
+operators = {Symbol('+'): '+', Symbol('-'): '-', Symbol('*'): '*', Symbol('/'): '/', Symbol('%'): '%'}
+
+# Builtins a fast path doesn't call: the stack machine calls the function given to swap! on its own stack, and suspends the task calling an AsyncBuiltin
+excluded = {Symbol('swap!')}
+
+# The characters of Lisp names that get spelled out in the names of Python variables
+spelled = {'+': 'plus', '-': '_', '*': 'times', '/': 'div', '%': 'mod', '=': 'eq', '<': 'lt', '>': 'gt', '!': '_bang', '?': '_p', '&': 'rest', '.': '_'}
+
+def call(proc, args):
+  """ Runs the fast path of an interpreted procedure, compiling it first if this call makes the procedure hot. Returns bail if the call has to be interpreted. """
+  fast = proc.fast
+  if fast is None:
+    proc.calls += 1
+    if proc.calls != threshold or not compile_procedure(proc):
+      return bail
+    fast = proc.fast
+  return fast(args)
+
+def invalidate(proc):
+  """ Drops the fast path of a procedure one of whose globals was rebound, and starts counting its calls again """
+  proc.fast = None
+  proc.calls = 0
+  return bail
+
+def deopt(proc, args):
+  """ Drops the fast path of a procedure while its loop runs, and goes on with the call interpreted """
+  invalidate(proc)
+  return proc.fn(*args)
+
+def compile_procedure(proc):
+  """ Translates a hot procedure, and makes the result its fast path. Returns whether it has one now. """
+  if not enabled:
+    return False
+  if profiler.current is not None:
+    # The profiler wraps the builtins while it runs, and procedures it watches are better interpreted, so it's tried again later
+    proc.calls = 0
+    return False
+  name = proc.name or 'anonymous'
+  try:
+    source, bindings = Translator(proc).translate()
+  except NotCompilable as error:
+    if dump:
+      print(f";; jit: {name} stays interpreted, as {error}", file=sys.stderr)
+    return False
+  if dump:
+    print(f";; jit: {name}\n{source}", file=sys.stderr)
+  namespace = dict()
+  exec(compile(source, f"<jit {name}>", 'exec'), namespace)
+  proc.fast = namespace['make'](**bindings)
+  return True
+
+def tuple_of(exprs):
+  """ Writes the elements of a Python tuple, without the parentheses """
+  return exprs[0] + ',' if len(exprs) == 1 else ', '.join(exprs)
+
+def is_literal(ast):
+  return type(ast) in (int, float, bool, str, Keyword, Nil)
+
+def branch(ast):
+  """ The branch an if whose condition is a literal (a macro's expansion can leave one) takes """
+  if ast[1] is False or ast[1] is nil:
+    return ast[3] if len(ast) > 3 else nil
+  return ast[2]
+
+def identifier(name):
+  """ Turns a Lisp name into a valid Python identifier """
+  if name == '-':
+    return 'minus'
+  name = ''.join(spelled.get(char, char) if char.isalnum() or char == '_' or char in spelled else '_' for char in name)
+  if not name or name[0].isdigit():
+    name = '_' + name
+  return name
+
+class Translator:
+  """ Writes the source of a procedure's fast path: a function make() that receives the values the fast path uses, and returns the fast path itself, which takes the arguments as a sequence. Lisp locals are renamed to unique Python names, so that a let* binding shadowing a parameter doesn't overwrite it. """
+
+  def __init__(self, proc):
+    self.proc = proc
+    if not isinstance(proc.env, environment.Environment) or proc.env.outer is not None:
+      raise NotCompilable("it closes over local bindings")
+    self.globals = proc.env.data
+    # The values make() receives, by name
+    self.bindings = {'G': self.globals, 'proc': proc, 'nil': nil, 'bail': bail, 'invalidate': invalidate, 'deopt': deopt, 'Vector': Vector, 'Map': Map}
+    self.names = set(self.bindings) | {'make', 'get', 'args', 'test', 'len'}
+    # The globals the fast path relies on: symbol -> (name of the symbol, name of the value it must still be bound to)
+    self.guarded = dict()
+    self.symbols = dict()
+    self.loops = False
+    self.lines = []
+
+  def name(self, base):
+    """ Returns a Python name built on base that isn't taken yet """
+    name, i = base, 1
+    while name in self.names or keyword.iskeyword(name):
+      name, i = f"{base}_{i}", i + 1
+    self.names.add(name)
+    return name
+
+  def bind(self, base, value):
+    """ Passes a value to make(), and returns the name the fast path knows it by """
+    name = self.name(base)
+    self.bindings[name] = value
+    return name
+
+  def translate(self):
+    params = list(self.proc.params)
+    if any(not isinstance(param, Symbol) or param == '&' for param in params):
+      raise NotCompilable("it takes a variable number of arguments")
+    if len(set(params)) != len(params):
+      raise NotCompilable("it has duplicate parameters")
+    scope = {param: self.name(identifier(str(param))) for param in params}
+    self.params = [scope[param] for param in params]
+    self.tail(self.proc.ast, scope, 2)
+    guard = ' or '.join(f"get({symbol}) is not {value}" for symbol, value in self.guarded.values())
+
+    fname = self.name(identifier(self.proc.name or 'anonymous'))
+    lines = [f"def make({', '.join(self.bindings)}):", "  get = G.get", f"  def {fname}(args):"]
+    lines += [f"    if len(args) != {len(params)}:", "      return bail"]
+    if guard:
+      lines += [f"    if {guard}:", "      return invalidate(proc)"]
+    if params:
+      lines.append(f"    {tuple_of(self.params)} = args")
+    if self.loops:
+      lines.append("    while True:")
+    indent = '  ' if self.loops else ''
+    for line in self.lines:
+      if type(line) is tuple:
+        # The guard each iteration of the loop checks, which is only known once the whole body has been translated
+        spaces = indent + line[0]
+        lines += [f"{spaces}if {guard}:", f"{spaces}  return deopt(proc, ({tuple_of(self.params)}))"]
+      else:
+        lines.append(indent + line)
+    lines.append(f"  return {fname}")
+    return '\n'.join(lines) + '\n', self.bindings
+
+  # The globals
+
+  def global_value(self, symbol):
+    """ Returns the expression a global is read with. Builtins and the procedure itself are the values they were bound to when it was compiled (and guarded); any other global is looked up every time it is read, as a function the fast path calls (the one given to reduce, say) could rebind it in the middle of an iteration. """
+    if symbol not in self.globals:
+      raise NotCompilable(f"{symbol} isn't defined")
+    value = self.globals[symbol]
+    if value is self.proc or global_env.funcs.get(symbol) is value:
+      return self.guard(symbol)
+    return f"get({self.symbol(symbol)})"
+
+  def guard(self, symbol):
+    """ Returns the name of the value a global is bound to, which the fast path checks it is still bound to """
+    if symbol not in self.guarded:
+      if symbol not in self.globals:
+        raise NotCompilable(f"{symbol} isn't defined")
+      value = self.globals[symbol]
+      if value is self.proc:
+        name = 'proc'
+      else:
+        name = self.bind(('f_' if global_env.funcs.get(symbol) is value else 'g_') + identifier(str(symbol)), value)
+      self.guarded[symbol] = (self.symbol(symbol), name)
+    return self.guarded[symbol][1]
+
+  def symbol(self, symbol):
+    """ Returns the name of a global's Symbol, which the fast path looks the global up with """
+    if symbol not in self.symbols:
+      self.symbols[symbol] = self.bind('s_' + identifier(str(symbol)), symbol)
+    return self.symbols[symbol]
+
+  def is_builtin(self, symbol, scope):
+    value = self.globals.get(symbol)
+    return symbol not in scope and value is not None and global_env.funcs.get(symbol) is value and symbol not in excluded and not isinstance(value, AsyncBuiltin)
+
+  def is_self(self, symbol, scope):
+    return symbol not in scope and self.globals.get(symbol) is self.proc
+
+  def expand(self, ast, scope):
+    """ Expands the macro calls at the head of an AST, the way the engines would. The macros are guarded like any other global. """
+    while isinstance(ast, List) and len(ast) > 0 and isinstance(ast[0], Symbol) and ast[0] not in scope and ast[0] not in evaluator.special_forms:
+      macro = evaluator.get_macro(ast, self.proc.env)
+      if macro is None:
+        break
+      self.guard(ast[0])
+      ast = evaluator.macro_cache.expand(ast, macro)
+    return ast
+
+  # Translating forms
+
+  def tail(self, ast, scope, depth):
+    """ Translates a form in tail position into statements that return its value, or continue the loop for a self tail call """
+    indent = '  ' * depth
+    ast = self.expand(ast, scope)
+    if isinstance(ast, List) and len(ast) > 0 and isinstance(ast[0], Symbol):
+      head = ast[0]
+      if head is Symbol('if') and len(ast) > 2 and is_literal(ast[1]):
+        self.tail(branch(ast), scope, depth)
+        return
+      if head is Symbol('if') and len(ast) > 2:
+        self.lines.append(f"{indent}if (test := {self.expr(ast[1], scope)}) is False or test is nil:")
+        self.tail(ast[3] if len(ast) > 3 else nil, scope, depth + 1)
+        self.tail(ast[2], scope, depth)
+        return
+      if head is Symbol('do') and len(ast) > 1:
+        for form in ast[1:-1]:
+          self.lines.append(f"{indent}{self.expr(form, scope)}")
+        self.tail(ast[-1], scope, depth)
+        return
+      if head is Symbol('let*'):
+        scope = self.let_bindings(ast, scope, lambda name, value: self.lines.append(f"{indent}{name} = {value}"))
+        self.tail(ast[2], scope, depth)
+        return
+      if head not in evaluator.special_forms and self.is_self(head, scope):
+        if len(ast) - 1 != len(self.params):
+          raise NotCompilable(f"it calls itself with {len(ast) - 1} arguments instead of {len(self.params)}")
+        self.guard(head)
+        self.loops = True
+        if self.params:
+          self.lines.append(f"{indent}{tuple_of(self.params)} = {tuple_of([self.expr(arg, scope) for arg in ast[1:]])}")
+        self.lines.append((indent,))
+        self.lines.append(f"{indent}continue")
+        return
+    self.lines.append(f"{indent}return {self.expr(ast, scope)}")
+
+  def expr(self, ast, scope):
+    """ Translates a form into a Python expression """
+    ast = self.expand(ast, scope)
+    if isinstance(ast, Symbol):
+      return scope[ast] if ast in scope else self.global_value(ast)
+    if isinstance(ast, List) and len(ast) > 0:
+      head = ast[0]
+      if head is Symbol('if') and len(ast) > 2 and is_literal(ast[1]):
+        return self.expr(branch(ast), scope)
+      if head is Symbol('if') and len(ast) > 2:
+        false = self.expr(ast[3], scope) if len(ast) > 3 else 'nil'
+        return f"({false} if (test := {self.expr(ast[1], scope)}) is False or test is nil else {self.expr(ast[2], scope)})"
+      if head is Symbol('do') and len(ast) > 1:
+        return self.sequence([self.expr(form, scope) for form in ast[1:]])
+      if head is Symbol('let*'):
+        parts = []
+        scope = self.let_bindings(ast, scope, lambda name, value: parts.append(f"({name} := {value})"))
+        return self.sequence(parts + [self.expr(ast[2], scope)])
+      if head is Symbol('quote') and len(ast) > 1:
+        return self.constant(ast[1])
+      if isinstance(head, Symbol) and head in evaluator.special_forms:
+        raise NotCompilable(f"it uses {head}")
+      if isinstance(head, Symbol) and self.is_builtin(head, scope):
+        args = [self.expr(arg, scope) for arg in ast[1:]]
+        if head in operators and len(args) == 2:
+          self.guard(head)
+          return f"({args[0]} {operators[head]} {args[1]})"
+        return f"{self.guard(head)}({', '.join(args)})"
+      if isinstance(head, Symbol) and self.is_self(head, scope):
+        raise NotCompilable("it calls itself outside of a tail position")
+      raise NotCompilable(f"it calls {printer.pr_str(head)}, which isn't a builtin")
+    if isinstance(ast, Vector):
+      return f"Vector([{', '.join(self.expr(elem, scope) for elem in ast)}])"
+    if isinstance(ast, Map):
+      return f"Map({{{', '.join(f'{self.constant(key)}: {self.expr(value, scope)}' for key, value in ast.items())}}})"
+    return self.constant(ast)
+
+  def let_bindings(self, ast, scope, emit):
+    """ Translates the bindings of a let* one by one, each seeing the ones before it, and returns the scope its body sees """
+    if len(ast) < 3 or not isinstance(ast[1], (List, Vector)) or len(ast[1]) % 2 != 0:
+      raise NotCompilable("it has an invalid let*")
+    var_list = ast[1]
+    for i in range(0, len(var_list), 2):
+      if not isinstance(var_list[i], Symbol):
+        raise NotCompilable("it has an invalid let*")
+      value = self.expr(var_list[i + 1], scope)
+      name = self.name(identifier(str(var_list[i])))
+      emit(name, value)
+      scope = {**scope, var_list[i]: name}
+    return scope
+
+  def sequence(self, exprs):
+    """ An expression that evaluates expressions in order, and has the value of the last one """
+    return exprs[0] if len(exprs) == 1 else f"({', '.join(exprs)})[-1]"
+
+  def constant(self, value):
+    """ Writes a constant as a Python literal when there is one for it, or passes it to make() """
+    if type(value) in (int, bool, str) or (type(value) is float and math.isfinite(value)):
+      text = repr(value)
+      return f"({text})" if text.startswith('-') else text
+    if value is nil:
+      return 'nil'
+    return self.bind('k_' + identifier(str(value)[1:]) if type(value) is Keyword else 'k', value)
@@ -0,0 +1,161 @@
+import itertools, strings
+from lisp_types import *
+
+""" This file implements lazy sequences: sequences whose elements are only computed when something asks for them. A lazy sequence is created from a recipe, a function returning a Python iterator over its elements. A sequence is realized a chunk of elements at a time, to keep the cost per element low, and remembers the chunks so the elements are computed only once, whether they are reached by taking its first and rest, or by walking it (to reduce, count or print it, or to feed it to map or filter): the functions a recipe calls can have side effects, or depend on state, and walking the sequence again must neither repeat the effects nor see different elements. The exception is ranges (and the sequences taken or dropped from them), whose elements cost nothing to compute again and don't depend on anything: walking one that hasn't been realized yet streams its elements from a fresh iterator instead, without remembering them, so that (reduce + (range 100000000)) runs in constant memory even though the arguments of the call to reduce hold on to the head of the sequence it is walking. """
+
+# How many elements are pulled from the underlying iterator at a time
+chunk_size = 32
+
+class Chunk:
+  """ A run of realized elements, along with the LazySeq that continues after them (None at the end of the sequence) """
+  __slots__ = ('items', 'next')
+
+  def __init__(self, items, next):
+    self.items = items
+    self.next = next
+
+class LazySeq:
+  """ A lazy sequence. Until it is first realized, it only holds its recipe, or for the continuation of a realized chunk, the iterator the rest of the elements come from. After that it holds the Chunk its elements were realized into, and the offset of its first element in it. Taking the rest of a sequence returns a new LazySeq that shares the same chunks. Stream is true for sequences that are walked without being realized. """
+  __slots__ = ('recipe', 'source', 'chunk', 'offset', 'stream')
+
+  def __init__(self, recipe=None, source=None, chunk=None, offset=0, stream=False):
+    self.recipe = recipe
+    self.source = source
+    self.chunk = chunk
+    self.offset = offset
+    self.stream = stream
+
+  def realize(self):
+    """ Returns the chunk this sequence starts in, pulling it from the source the first time """
+    if self.chunk is None:
+      source = self.source if self.source is not None else iter(self.recipe())
+      items = list(itertools.islice(source, chunk_size))
+      self.chunk = Chunk(items, LazySeq(source=source) if len(items) == chunk_size else None)
+      self.recipe = self.source = None
+    return self.chunk
+
+  def is_empty(self):
+    return self.offset >= len(self.realize().items)
+
+  def first(self):
+    chunk = self.realize()
+    return chunk.items[self.offset] if self.offset < len(chunk.items) else nil
+
+  def rest(self):
+    chunk = self.realize()
+    if self.offset + 1 < len(chunk.items):
+      return LazySeq(chunk=chunk, offset=self.offset + 1)
+    elif chunk.next is not None:
+      return chunk.next
+    else:
+      return LazySeq(tuple)
+
+  def __iter__(self):
+    return walk(self)
+
+  def __len__(self):
+    # Counting a sequence walks all of it
+    return sum(1 for _ in walk(self))
+
+  def __bool__(self):
+    return not self.is_empty()
+
+  def __getitem__(self, index):
+    if isinstance(index, slice) or index < 0:
+      return List(list(self))[index]
+    seq, index = self, index + self.offset
+    while True:
+      chunk = seq.realize()
+      if index < len(chunk.items):
+        return chunk.items[index]
+      if chunk.next is None:
+        raise IndexError("sequence index out of range")
+      seq, index = chunk.next, index - len(chunk.items)
+
+  def __eq__(self, other):
+    if isinstance(other, (LazySeq, List, Vector, list)):
+      return list(self) == list(other)
+    return NotImplemented
+
+  __hash__ = None
+
+def walk(seq):
+  """ Generator over the elements of a lazy sequence, which realizes its chunks as it reaches them. It only refers to the chunk it is in, so the chunks it has passed can be freed if nothing else holds on to them. """
+  while True:
+    if seq.stream and seq.recipe is not None:
+      # Nothing has been realized yet, and the elements can be computed again, so they are streamed without being remembered
+      yield from seq.recipe()
+      return
+    chunk = seq.realize()
+    yield from itertools.islice(chunk.items, seq.offset, None)
+    if chunk.next is None:
+      return
+    seq = chunk.next
+
+def is_true(value):
+  """ Lisp truthiness: everything except false and nil is true """
+  return value is not False and value is not nil
+
+# Functions that create lazy sequences. Sequences can be given as anything iterable: lists, vectors, strings, arrays or other lazy sequences.
+
+def lazy_range(*args):
+  """ (range) counts up from 0 forever, (range end), (range start end) and (range start end step) work like Python's range, but also accept floats """
+  if not args:
+    return LazySeq(itertools.count, stream=True)
+  start, end, step = (0, args[0], 1) if len(args) == 1 else (args + (1,))[:3]
+  if all(isinstance(arg, int) for arg in (start, end, step)):
+    return LazySeq(lambda: range(start, end, step), stream=True)
+  in_range = (lambda x: x < end) if step > 0 else (lambda x: x > end)
+  return LazySeq(lambda: itertools.takewhile(in_range, itertools.count(start, step)), stream=True)
+
+def iterate(func, value):
+  """ The infinite sequence value, (func value), (func (func value)) and so on """
+  def generate():
+    current = value
+    while True:
+      yield current
+      current = func(current)
+  return LazySeq(generate)
+
+def lazy_map(func, *colls):
+  return LazySeq(lambda: map(func, *colls))
+
+def lazy_filter(pred, coll):
+  return LazySeq(lambda: (x for x in coll if is_true(pred(x))))
+
+def take_while(pred, coll):
+  return LazySeq(lambda: itertools.takewhile(lambda x: is_true(pred(x)), coll))
+
+def streams(coll):
+  """ Whether a sequence taken or dropped from coll can be streamed: coll has to be one that is streamed itself """
+  return isinstance(coll, LazySeq) and coll.stream
+
+def take(coll, n):
+  """ The first n elements of a sequence. Lists, vectors and strings are sliced as before (so negative counts still work on them), anything else is taken lazily. Strings give views (see strings.py) instead of copies. """
+  if isinstance(coll, LazySeq) or not hasattr(coll, '__getitem__'):
+    return LazySeq(lambda: itertools.islice(coll, n), stream=streams(coll))
+  if type(coll) is str:
+    coll = strings.view(coll)
+  return coll[:n]
+
+def drop(coll, n):
+  """ Everything but the first n elements of a sequence """
+  if isinstance(coll, LazySeq) or not hasattr(coll, '__getitem__'):
+    return LazySeq(lambda: itertools.islice(coll, n, None), stream=streams(coll))
+  if type(coll) is str:
+    coll = strings.view(coll)
+  return coll[n:]
+
+def lazy_reduce(func, *args):
+  """ (reduce f coll) or (reduce f init coll). Walks the sequence one element at a time without keeping the elements it has passed. """
+  if len(args) == 1:
+    items = iter(args[0])
+    try:
+      result = next(items)
+    except StopIteration:
+      return func()
+  else:
+    result, items = args[0], iter(args[1])
+  for item in items:
+    result = func(result, item)
+  return result
@@ -1,16 +1,43 @@
-import readline, reader, printer, evaluator, environment, sys
+import time
+started = time.perf_counter()
+
+# Only what every run needs is imported here: the engine once the command line chose it, optimizer.py unless --no-optimize turns it off, readline when the REPL starts, server.py when serving, parallel.py the first time something runs in parallel, and the modules below import the rest of what they use when they first need it
+import argparse, atexit, importlib, os, reader, printer, evaluator, environment, jit, profiler, source_cache, sys
+from global_env import funcs as builtins
 from lisp_types import *
 
+# How long each phase of the startup took, reported by --startup-stats
+phases = [('imports', time.perf_counter() - started)]
+phase_started = time.perf_counter()
+
+def end_phase(name):
+  global phase_started
+  now = time.perf_counter()
+  phases.append((name, now - phase_started))
+  phase_started = now
+
+def report_startup():
+  total = time.perf_counter() - started
+  print(f"Startup: {total * 1000:.2f} ms (Python's own startup, before lisp.py runs, isn't included)", file=sys.stderr)
+  for name, seconds in phases:
+    print(f"  {name:<20} {seconds * 1000:>8.2f} ms", file=sys.stderr)
+
+# The engines that can evaluate an abstract syntax tree, each being the name of a module with an evaluate function, imported only if it is chosen. "ast" walks the tree every time it's evaluated, "compiled" analyzes it once into closures and runs those, "stack" walks the tree like "ast" but keeps track of what it's doing on a stack of its own instead of Python's, so recursion isn't limited by Python's recursion limit.
+engines = {'ast': 'evaluator', 'compiled': 'compiler', 'stack': 'machine'}
+engine = evaluator
+
 def READ(inpt):
   """ Read source code as a string and return an abstract syntax tree """
   try:
     return reader.read_str(inpt)
   except Exception as error:
-    print(error)
+    printer.output.write(f"{error}\n")
 
 def EVAL(ast, env):
-  """ Evaluate an abstract syntax tree in an environment """
-  return evaluator.evaluate(ast, env)
+  """ Evaluate an abstract syntax tree in an environment, optimizing it first (see optimizer.py) """
+  if options.optimize:
+    ast = optimizer.optimize(ast, env)
+  return engine.evaluate(ast, env)
 
 def PRINT(ast):
   """ Return a string output of an abstract syntax tree """
@@ -20,32 +47,157 @@ def rep(inpt, env):
   """ Read, evaluate, and print """
   return PRINT(EVAL(READ(inpt), env))
 
+def run_file(path):
+  """ Evaluate the forms of a source file one by one, as they are read from it, and return the value of the last one """
+  value = nil
+  for form in source_cache.read_forms(path):
+    if options.expand_on_load:
+      form = evaluator.macroexpand_all(form, global_env)
+    value = EVAL(form, global_env)
+  return value
+
+def load_file(path):
+  run_file(path)
+  return nil
+
+def optimize(ast):
+  import optimizer
+  return optimizer.optimize(ast, global_env)
+
+def load_parallel():
+  """ Returns parallel.py, importing it the first time pmap, pcall or future is called """
+  import parallel
+  parallel.workers = options.jobs
+  return parallel
+
+def run_request(request):
+  """ Runs a request sent to the eval server, in the child forked for it (see server.py), and returns the printed value of its last form """
+  os.chdir(request['cwd'])
+  global_env.define(Symbol('*ARGV*'), List(request['argv']))
+  try:
+    if request.get('code') is not None:
+      value = EVAL(READ(request['code']), global_env)
+    else:
+      value = run_file(request['file'])
+    return printer.pr_str(value)
+  finally:
+    printer.output.flush()
+
+# Parse the command line. Options have to come before the source file, everything after it ends up in *ARGV*.
+
+def help_formatter(prog):
+  """ argparse creates a formatter for each option it is given, to check it, and the default one imports shutil and asks for the size of the terminal every time. The help is laid out for 80 columns instead, which is what it gets when the output isn't a terminal anyway. """
+  return argparse.HelpFormatter(prog, width=78)
+
+parser = argparse.ArgumentParser(description='Lisp interpreter. Runs the given source file, or starts a REPL if there is none.', formatter_class=help_formatter)
+parser.add_argument('--engine', choices=engines, default='ast', help='evaluation engine to use (default: ast)')
+parser.add_argument('--expand-on-load', action='store_true', help='expand all the macros in each form load-file reads, before evaluating it')
+parser.add_argument('--no-optimize', dest='optimize', action='store_false', help='evaluate forms as written, without folding constants and pruning dead code ahead of time')
+parser.add_argument('--no-jit', action='store_true', help='always interpret procedures, instead of compiling the hot ones to Python functions')
+parser.add_argument('--jit-threshold', type=int, default=jit.threshold, help=f'number of calls after which a procedure is compiled (default: {jit.threshold})')
+parser.add_argument('--jit-dump', action='store_true', help='print the Python source generated for each compiled procedure, or why it couldn\'t be compiled, on stderr')
+parser.add_argument('--no-cache', action='store_true', help='always parse source files, without reading or writing their cache files')
+parser.add_argument('--clear-cache', action='store_true', help='remove the cache file of the source file before running it')
+parser.add_argument('--cache-dir', help='keep cache files in this directory instead of next to the sources')
+parser.add_argument('--cache-report', action='store_true', help='instead of running the source file, report how long loading it takes with and without its cache file')
+parser.add_argument('--jobs', type=int, help='number of worker processes pmap, pcall and future use (default: one per core)')
+parser.add_argument('--profile', action='store_true', help='profile the source file, and print a report of where the time went when it finishes')
+parser.add_argument('--profile-stacks', metavar='PATH', help='also write the profile to PATH as collapsed stacks, for flame graph tools (applies to the profile special form too)')
+parser.add_argument('--preload', metavar='FILE', action='append', default=[], help='load FILE before anything else, can be given several times')
+parser.add_argument('--serve', metavar='SOCKET', help='instead of running a source file, serve requests from server.py clients on the Unix domain socket SOCKET')
+parser.add_argument('--serve-jobs', type=int, help='number of requests the server runs at the same time (default: 4)')
+parser.add_argument('--serve-timeout', type=float, help='seconds a request may run for (default: 60)')
+parser.add_argument('--startup-stats', action='store_true', help='report how long each phase of the interpreter\'s startup took, on stderr')
+parser.add_argument('file', nargs='?', help='source file to execute')
+parser.add_argument('argv', nargs=argparse.REMAINDER, help='arguments passed to the program as *ARGV*')
+options = parser.parse_args()
+engine = importlib.import_module(engines[options.engine])
+if options.optimize:
+  import optimizer
+source_cache.enabled = not options.no_cache
+source_cache.directory = options.cache_dir
+profiler.stacks_path = options.profile_stacks
+jit.enabled = not options.no_jit
+jit.threshold = options.jit_threshold
+jit.dump = options.jit_dump
+end_phase('command line')
+
 # Instantiate the global environment and define some symbols
 
-global_env = environment.Environment(is_global=True)
-global_env.define(Symbol('eval'), lambda ast: evaluator.evaluate(ast, global_env))
-global_env.define(Symbol('*ARGV*'), List(sys.argv[2:]))
+global_env = environment.Environment(bindings=builtins)
+global_env.define(Symbol('eval'), lambda ast: EVAL(ast, global_env))
+global_env.define(Symbol('*ARGV*'), List(options.argv))
+global_env.define(Symbol('load-file'), load_file)
+global_env.define(Symbol('macroexpand-all'), lambda ast: evaluator.macroexpand_all(ast, global_env))
+global_env.define(Symbol('optimize'), optimize)
+global_env.define(Symbol('macro-cache-stats'), lambda: evaluator.macro_cache.stats())
+global_env.define(Symbol('pmap'), lambda func, *colls: load_parallel().pmap(global_env, func, *colls))
+global_env.define(Symbol('pcall'), lambda *funcs: load_parallel().pcall(global_env, *funcs))
+global_env.define(Symbol('future'), lambda func: load_parallel().future(global_env, func))
+
+end_phase('global environment')
+
+# The forms defined using Lisp itself are in prelude.lisp. Its parsed forms are always read from the source cache (even with --no-cache), which makes it a snapshot built the first time the interpreter runs.
+
+for form in source_cache.read_forms(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prelude.lisp'), cached=True):
+  EVAL(form, global_env)
+end_phase('prelude')
+
+# What prn and println print is buffered, so it has to be written out before quitting
+
+atexit.register(printer.output.flush)
 
-# The following forms are defined using Lisp itself
+# Files given with --preload are loaded first (with --serve, once, before serving). What they printed is written out right away, so that the children forked for requests don't inherit it in the buffer and send it back to every client.
 
-rep('(def! load-file (fn* (f) (eval (read-string (str "(do " (slurp f) "\nnil)")))))', global_env)
-rep('(defmacro! cond (fn* (& xs) (if (> (count xs) 0) (list \'if (first xs) (if (> (count xs) 1) (nth xs 1) (throw "odd number of forms to cond")) (cons \'cond (rest (rest xs)))))))', global_env)
+try:
+  for path in options.preload:
+    load_file(path)
+finally:
+  printer.output.flush()
+end_phase('preload')
 
-# If the script is run with command line arguments, interpret the first argument as a source code file to execute, and save the rest as a list under the global *ARGV* symbol. At the end of execution, quit.
+if options.startup_stats:
+  report_startup()
 
-if (len(sys.argv) >= 2):
-  rep(f'(load-file "{sys.argv[1]}")', global_env)
+# With --serve, the environment built so far is kept warm, and each request runs in a copy of it
+
+if options.serve is not None:
+  import server
+  server.serve(options.serve, run_request, options.serve_jobs, options.serve_timeout)
+  sys.exit(0)
+
+# If the script is run with command line arguments, interpret the first argument as a source code file to execute, and save the rest as a list under the global *ARGV* symbol. At the end of execution, quit. What the program printed is written out before the error that stopped it, if any, is reported.
+
+if options.file is not None:
+  try:
+    if options.clear_cache:
+      source_cache.clear(options.file)
+    if options.cache_report:
+      source_cache.report(options.file)
+    elif options.profile:
+      profiler.start(global_env)
+      try:
+        load_file(options.file)
+      finally:
+        profiler.stop()
+    else:
+      load_file(options.file)
+  finally:
+    printer.output.flush()
   sys.exit(0)
 
-# Otherwise start the REPL environment
+# Otherwise start the REPL environment, with line editing and history
+
+import readline
 
 while True:
   try:
+    printer.output.flush()
     inpt = input('lisp> ')
-    print(rep(inpt, global_env))
+    printer.output.write(rep(inpt, global_env) + '\n')
   except BlankLine:
     continue
   except EOFError:
     break
   except Exception as error:
-    print(error)
+    printer.output.write(f"{error}\n")
@@ -1,33 +1,67 @@
 import collections, re
+from persistent import Map, Vector
 
-# Atomic types
+# Atomic types. Every type here declares its attributes in __slots__, so that instances are a single small object each, without a dictionary of attributes.
 
-class Symbol(collections.UserString):
-  def __eq__(self, other):
-    return isinstance(other, Symbol) and self.data == other.data
-  def __hash__(self):
-    return hash(self.data)
+class Name:
+  """ What Symbols and Keywords have in common: the name, in data, and printing as it. They used to be UserStrings, and take the same arguments; being interned, they compare and hash by identity. """
+  __slots__ = ('data',)
 
-class Keyword(collections.UserString):
-  pattern = re.compile(r':[a-zA-Z0-9\-*+!_\'?<>=]*')
-  def __init__(self, value):
-    if re.fullmatch(Keyword.pattern, value) is None:
-      raise ValueError("Invalid keyword")
-    super().__init__(value)
+  def __str__(self):
+    return self.data
 
-  def __eq__(self, other):
-    if isinstance(other, Keyword):
-      return self.data == other.data
-    else:
-      return False
+  def __repr__(self):
+    return repr(self.data)
+
+  def __len__(self):
+    return len(self.data)
+
+  def __lt__(self, other):
+    return self.data < str(other)
+
+  def __gt__(self, other):
+    return self.data > str(other)
+
+  def __reduce__(self):
+    return (type(self), (self.data,))
 
-  def __hash__(self):
-    return hash(self.data)
+class Symbol(Name):
+  """ Symbols are interned: there is only ever one Symbol object for a given name, so they are compared and hashed by identity, which is what makes environment lookups and special form dispatch cheap """
+  __slots__ = ()
+  table = dict()
+
+  def __new__(cls, name):
+    name = str(name)
+    symbol = cls.table.get(name)
+    if symbol is None:
+      symbol = super().__new__(cls)
+      symbol.data = name
+      cls.table[name] = symbol
+    return symbol
+
+class Keyword(Name):
+  """ Keywords are interned the same way Symbols are. The pattern only needs to be checked the first time a keyword is created. """
+  __slots__ = ()
+  pattern = re.compile(r':[a-zA-Z0-9\-*+!_\'?<>=]*')
+  table = dict()
+
+  def __new__(cls, value):
+    value = str(value)
+    keyword = cls.table.get(value)
+    if keyword is None:
+      if re.fullmatch(Keyword.pattern, value) is None:
+        raise ValueError("Invalid keyword")
+      keyword = super().__new__(cls)
+      keyword.data = value
+      cls.table[value] = keyword
+    return keyword
 
 class SForm(collections.UserString):
   pass
 
 class Atom:
+  __slots__ = ('value',)
+
   def __init__(self, value):
     self.value = value
 
@@ -35,40 +69,247 @@ class Atom:
     return f"(atom {self.value})"
 
 class Nil:
+  """ There is a single nil value, so Nil() always returns the same object, and nil can be checked for by identity """
+  __slots__ = ()
+  instance = None
+
+  def __new__(cls):
+    if cls.instance is None:
+      cls.instance = super().__new__(cls)
+    return cls.instance
+
   def __repr__(self):
     return "nil"
 
-  def __eq__(self, other):
-    return isinstance(other, Nil)
-
   def __len__(self):
     return 0
 
+nil = Nil()
+
 # Collection types
 
-class List(collections.UserList):
-  pass
+class List(collections.abc.MutableSequence):
+  """ A list, wrapping a Python list of its elements (in data) the way UserList does, and with the same methods, but without UserList's dictionary of attributes. Slicing, adding and multiplying lists return Lists. """
+  __slots__ = ('data',)
 
-class Vector(collections.UserList):
-  pass
+  def __init__(self, initlist=None):
+    self.data = [] if initlist is None else list(initlist)
 
-class Map(collections.UserDict):
-  pass
+  def __repr__(self):
+    return repr(self.data)
+
+  def __eq__(self, other):
+    return self.data == cast(other)
+
+  def __lt__(self, other):
+    return self.data < cast(other)
+
+  def __le__(self, other):
+    return self.data <= cast(other)
+
+  def __gt__(self, other):
+    return self.data > cast(other)
+
+  def __ge__(self, other):
+    return self.data >= cast(other)
+
+  def __contains__(self, item):
+    return item in self.data
+
+  def __len__(self):
+    return len(self.data)
+
+  def __iter__(self):
+    return iter(self.data)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return type(self)(self.data[index])
+    return self.data[index]
+
+  def __setitem__(self, index, item):
+    self.data[index] = item
+
+  def __delitem__(self, index):
+    del self.data[index]
+
+  def __add__(self, other):
+    return type(self)(self.data + list(cast(other)))
+
+  def __radd__(self, other):
+    return type(self)(list(cast(other)) + self.data)
+
+  def __iadd__(self, other):
+    self.data += cast(other)
+    return self
+
+  def __mul__(self, n):
+    return type(self)(self.data * n)
+
+  __rmul__ = __mul__
+
+  def __imul__(self, n):
+    self.data *= n
+    return self
+
+  def insert(self, index, item):
+    self.data.insert(index, item)
+
+  def append(self, item):
+    self.data.append(item)
+
+  def extend(self, other):
+    self.data.extend(cast(other))
+
+  def pop(self, index=-1):
+    return self.data.pop(index)
+
+  def remove(self, item):
+    self.data.remove(item)
+
+  def clear(self):
+    self.data.clear()
+
+  def copy(self):
+    return type(self)(self.data)
+
+  __copy__ = copy
+
+  def count(self, item):
+    return self.data.count(item)
+
+  def index(self, item, *args):
+    return self.data.index(item, *args)
+
+  def reverse(self):
+    self.data.reverse()
+
+  def sort(self, *args, **kwargs):
+    self.data.sort(*args, **kwargs)
+
+  def __reduce__(self):
+    return (rebuild, (type(self), self.data))
+
+def cast(other):
+  """ The Python list a List compares and combines with: the one it wraps, or other itself if it isn't a List """
+  return other.data if isinstance(other, List) else other
+
+class Cons(List):
+  """ An immutable list cell, holding the first element of a list and the List with the rest of its elements. Cells are never modified, so consing onto a list or taking its rest shares the cells already there instead of copying them. The chain of cells ends in a regular List (usually an empty one). """
+  __slots__ = ('first', 'rest', 'length')
+
+  def __init__(self, first, rest):
+    self.first = first
+    self.rest = rest
+    self.length = 1 + len(rest)
+
+  @classmethod
+  def from_seq(cls, seq, tail=None):
+    """ Builds a chain of cells holding the elements of a sequence, ending in tail (an empty List by default) """
+    result = List() if tail is None else tail
+    for elem in reversed(list(seq)):
+      result = cls(elem, result)
+    return result
+
+  @property
+  def data(self):
+    # The methods inherited from UserList work on a Python list of the elements, so one is built when they need it
+    return list(self)
+
+  def __len__(self):
+    return self.length
+
+  def __iter__(self):
+    cell = self
+    while type(cell) is Cons:
+      yield cell.first
+      cell = cell.rest
+    yield from cell
+
+  def __reversed__(self):
+    return reversed(list(self))
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      # Dropping elements from the front is the common case, and can share the remaining cells
+      if index.step is None and index.stop is None and index.start is not None and 0 <= index.start:
+        return self.drop(index.start)
+      return List(self.data[index])
+    if index < 0:
+      index += self.length
+    if not 0 <= index < self.length:
+      raise IndexError("list index out of range")
+    return self.drop(index)[0] if index > 0 else self.first
+
+  def drop(self, n):
+    """ Returns the List left after skipping the first n elements """
+    cell = self
+    while n > 0 and type(cell) is Cons:
+      cell, n = cell.rest, n - 1
+    return cell[n:] if n > 0 else cell
+
+  def __add__(self, other):
+    return List(self.data + list(other))
+
+  def __radd__(self, other):
+    return List(list(other) + self.data)
+
+  def __mul__(self, n):
+    return List(self.data * n)
+
+  __rmul__ = __mul__
+
+  def copy(self):
+    return self
+
+  def immutable(self, *args, **kwargs):
+    # The mutating methods inherited from UserList would modify the list the data property builds, and the change would be lost
+    raise TypeError("Cons cells are immutable.")
+
+  __setitem__ = __delitem__ = __iadd__ = __imul__ = insert = append = extend = pop = remove = clear = reverse = sort = immutable
+
+  def __reduce__(self):
+    # Pickling the cells one by one would recurse as deep as the list is long
+    return (Cons.from_seq, (list(self),))
 
 # Function type
 
 class Procedure:
-  def __init__(self, ast, params, env, fn, is_macro=False):
+  # Procedures created by the compiler engine also have the scope and base they were analyzed in (see compiler.py)
+  __slots__ = ('ast', 'params', 'env', 'fn', 'is_macro', 'name', 'code', 'scope', 'base', 'calls', 'fast')
+
+  def __init__(self, ast, params, env, fn, is_macro=False, code=None):
     self.ast = ast
     self.params = params
     self.env = env
     self.fn = fn
-    self.make_env = lambda Env, args: Env(env, params, args)
     self.is_macro = is_macro
-  
+    # The name the procedure was first bound to by def!, which the profiler reports it under
+    self.name = None
+    # For procedures created by the compiler engine, the function that runs the body given the captured environment and the arguments
+    self.code = code
+    # How many times the procedure was called, and the Python function that runs it once it got called often enough to be compiled (see jit.py)
+    self.calls = 0
+    self.fast = None
+
+  def make_env(self, Env, args):
+    """ Creates the environment a call runs the body in, binding the parameters to the arguments """
+    return Env(self.env, self.params, args)
+
   def __call__(self, *args):
     return self.fn(*args)
 
+class AsyncBuiltin:
+  """ A builtin that waits for something: time to pass, I/O, another task. Called like any other function, it blocks until it's done. When the stack machine runs it for a task, it calls coroutine instead, and suspends the task until the coroutine is done, so that other tasks run in the meantime (see tasks.py). """
+  __slots__ = ('func', 'coroutine')
+
+  def __init__(self, func, coroutine):
+    self.func = func
+    self.coroutine = coroutine
+
+  def __call__(self, *args):
+    return self.func(*args)
+
 # Exceptions
 
 class BlankLine(Exception):
@@ -76,12 +317,11 @@ class BlankLine(Exception):
 
 # Some helper functions
 
-def parse_str(value):
-    pattern = re.compile(r'"(?:[\\].|[^\\"])*"')
-    if re.match(pattern, value):
-      return unescape(value[1:-1])
-    else:
-      raise ValueError("Not a valid string")
+def rebuild(cls, data):
+  """ Used when unpickling collections, to wrap the already unpickled data without going through __init__, which would copy it """
+  obj = cls.__new__(cls)
+  obj.data = data
+  return obj
 
 def unescape(string):
   return string.replace('\\\\', '\u00b6').replace('\\n', '\n').replace('\\"', '"').replace('\u00b6', '\\')
\ No newline at end of file
@@ -0,0 +1,300 @@
+from lisp_types import *
+from environment import Environment as Env
+from memo import Memoized, missing
+import evaluator, global_env, jit, profiler
+
+""" This file contains a third engine, which evaluates abstract syntax trees like evaluator.py does, but without using the Python stack to remember what it was doing. Whenever evaluating a form needs the value of a sub-form first (the condition of an if, the arguments of a call, the value of a let* binding...), it pushes a frame saying what to do with that value onto a stack of its own, which lives on the heap, and goes on to evaluate the sub-form. When a value is found, the frame on top of the stack is popped and handles it. Non-tail recursion therefore only grows that stack, and can go as deep as memory allows, instead of stopping at Python's recursion limit. """
+
+# A quick explanation of the frames: a frame is a list whose first element is the function that handles the value it was waiting for, the rest being whatever that function needs to carry on. Like the special form handlers, these functions return either the AST and environment to evaluate next, or a final value and None in place of the environment. Tail positions (the branches of if, the last form of do and the bodies of let* and procedures) are evaluated without pushing a frame, so tail calls don't grow the stack either.
+
+# Set while a task (see tasks.py) runs on the machine. Calls to AsyncBuiltins then return a Pause, which suspends the task, instead of blocking.
+suspendable = False
+
+class Pause:
+  """ Handed back by run() when a task waits for an awaitable. The task's stack is left as it was, and run() continues from it with the awaitable's result. """
+  __slots__ = ('awaitable',)
+
+  def __init__(self, awaitable):
+    self.awaitable = awaitable
+
+def evaluate(ast, env):
+  """ Evaluates an abstract syntax tree in a given environment """
+  global suspendable
+  if not suspendable:
+    return run(ast, env, [])
+  # Called from Python while a task runs (by a builtin like map, say), the evaluation can't suspend the task, as the Python stack it is on can't be put aside
+  suspendable = False
+  try:
+    return run(ast, env, [])
+  finally:
+    suspendable = True
+
+def run(ast, env, stack):
+  """ Evaluates an AST with a stack of frames waiting for its value, or, if env is None, hands the value ast to those frames. Returns the value the stack ends up with, or a Pause if a task has to wait, in which case the stack is kept as it is, to continue from once the wait is over. """
+  while True:
+    # Evaluate the AST, until either a value is found, or a frame is pushed to wait for the value of a sub-form
+    while env is not None:
+      if isinstance(ast, Symbol):
+        ast, env = env.get(ast), None
+      elif isinstance(ast, List):
+        if len(ast) == 0:
+          break
+        head = ast[0]
+        if isinstance(head, Symbol):
+          if head in evaluator.macro_cache.names:
+            macro = evaluator.get_macro(ast, env)
+            if macro is not None:
+              ast, env = expand(ast, env, macro, stack)
+              continue
+          form = special_forms.get(head)
+          if form is not None:
+            ast, env = form(ast, env, stack)
+            continue
+        ast, env = scan(ast, env, [], 0, stack)
+      elif isinstance(ast, Vector) and len(ast) > 0:
+        ast, env = scan_vector(ast, env, [], 0, stack)
+      elif isinstance(ast, Map) and len(ast) > 0:
+        ast, env = scan_map(ast, env, dict(), list(ast.items()), 0, stack)
+      else:
+        break
+    value = ast
+
+    # Hand the value to the frames waiting for it, until one of them has something else to evaluate
+    while True:
+      if not stack or type(value) is Pause:
+        return value
+      frame = stack.pop()
+      ast, env = frame[0](frame, value, stack)
+      if env is not None:
+        break
+      value = ast
+
+# Calls
+
+def scan(ast, env, values, start, stack):
+  """ Evaluates the elements of a call from start on, adding their values to values, and then applies the function to the arguments. Symbols and constants are evaluated right away; anything else gets a frame that continues the scan once its value is known. """
+  for i in range(start, len(ast)):
+    elem = ast[i]
+    if isinstance(elem, Symbol):
+      values.append(env.get(elem))
+    elif isinstance(elem, (List, Vector, Map)) and len(elem) > 0:
+      stack.append([resume_scan, ast, env, values, i])
+      return elem, env
+    else:
+      values.append(elem)
+  return apply(values, stack)
+
+def resume_scan(frame, value, stack):
+  _, ast, env, values, i = frame
+  values.append(value)
+  return scan(ast, env, values, i + 1, stack)
+
+def call(func, args, stack):
+  """ Calls a function on a stack, the way run() does it. Tasks start with this. """
+  ast, env = apply([func, *args], stack)
+  return run(ast, env, stack)
+
+def apply(values, stack):
+  """ Applies a function to arguments. Procedures are continued into (which is what makes tail calls not grow the stack), memoized procedures only when they don't remember a result. Builtins are called directly, except swap!, which calls the function it is given like any other call, so that it can be a procedure as well, and AsyncBuiltins while a task runs, which pause it instead. """
+  func = values[0]
+  if isinstance(func, Procedure) and func.code is None:
+    args = values[1:]
+    value = jit.call(func, args)
+    if value is not jit.bail:
+      return value, None
+    return func.ast, func.make_env(Env, args)
+  elif type(func) is Memoized and isinstance(func.proc, Procedure) and func.proc.code is None:
+    args = values[1:]
+    key = func.key(args)
+    value = func.lookup(key)
+    if value is not missing:
+      return value, None
+    stack.append([store_memoized, func, key])
+    return func.proc.ast, func.proc.make_env(Env, args)
+  elif func is global_env.swap:
+    atom, func, *args = values[1:]
+    stack.append([finish_swap, atom, atom.value, func, args])
+    return apply([func, atom.value, *args], stack)
+  elif type(func) is AsyncBuiltin and suspendable:
+    return Pause(func.coroutine(*values[1:])), None
+  elif callable(func):
+    return func(*values[1:]), None
+  else:
+    raise SyntaxError("First element of list is not a function.")
+
+def store_memoized(frame, value, stack):
+  _, memo, key = frame
+  memo.store(key, value)
+  return value, None
+
+def finish_swap(frame, value, stack):
+  _, atom, old, func, args = frame
+  if atom.value is not old:
+    # Another task changed the atom while the function was paused, so it is called again on the new value, and none of the updates is lost
+    stack.append([finish_swap, atom, atom.value, func, args])
+    return apply([func, atom.value, *args], stack)
+  atom.value = value
+  return value, None
+
+def scan_vector(ast, env, values, start, stack):
+  """ Evaluates the elements of a vector, the same way scan() does for a call """
+  for i in range(start, len(ast)):
+    elem = ast[i]
+    if isinstance(elem, Symbol):
+      values.append(env.get(elem))
+    elif isinstance(elem, (List, Vector, Map)) and len(elem) > 0:
+      stack.append([resume_vector, ast, env, values, i])
+      return elem, env
+    else:
+      values.append(elem)
+  return Vector(values), None
+
+def resume_vector(frame, value, stack):
+  _, ast, env, values, i = frame
+  values.append(value)
+  return scan_vector(ast, env, values, i + 1, stack)
+
+def scan_map(ast, env, result, items, start, stack):
+  """ Evaluates the values of a map, the same way scan() does for a call """
+  for i in range(start, len(items)):
+    key, elem = items[i]
+    if isinstance(elem, (List, Vector, Map, Symbol)):
+      stack.append([resume_map, ast, env, result, items, i])
+      return elem, env
+    result[key] = elem
+  return Map(result), None
+
+def resume_map(frame, value, stack):
+  _, ast, env, result, items, i = frame
+  result[items[i][0]] = value
+  return scan_map(ast, env, result, items, i + 1, stack)
+
+def expand(ast, env, macro, stack):
+  """ Expands a macro call. An expansion the macro cache remembers is evaluated right away; otherwise the macro's body is evaluated like a procedure's, with a frame that caches its result and then evaluates it. """
+  expansion = evaluator.macro_cache.lookup(ast, macro)
+  if expansion is not None:
+    return expansion, env
+  if isinstance(macro, Procedure) and macro.code is None:
+    stack.append([finish_expand, ast, env, macro])
+    return macro.ast, macro.make_env(Env, ast[1:])
+  return evaluator.macro_cache.expand(ast, macro), env
+
+def finish_expand(frame, value, stack):
+  _, ast, env, macro = frame
+  evaluator.macro_cache.store(ast, macro, value)
+  return value, env
+
+def make_procedure(body, params, env):
+  """ Creates the Procedure of a fn* form. Called from Python (by builtins like map, or to expand a macro outside of this engine), it runs on a stack of its own. """
+  def fn(*arguments):
+    value = jit.call(proc, arguments)
+    if value is jit.bail:
+      value = evaluate(body, Env(env, params, arguments))
+    return value
+
+  proc = Procedure(body, params, env, fn)
+  return proc
+
+# The special forms. Each handler receives the whole form, the environment and the stack, and returns either the AST and environment to evaluate next, or a final value and None. They mirror the ones in evaluator.py.
+
+def eval_def(ast, env, stack):
+  stack.append([finish_def, ast[1], env, False])
+  return ast[2], env
+
+def eval_defmacro(ast, env, stack):
+  stack.append([finish_def, ast[1], env, True])
+  return ast[2], env
+
+def finish_def(frame, value, stack):
+  _, key, env, is_macro = frame
+  if is_macro:
+    value.is_macro = True
+  evaluator.bind(env, key, value)
+  return value, None
+
+def eval_let(ast, env, stack):
+  var_list = ast[1]
+  if isinstance(var_list, (List, Vector)) and len(var_list) % 2 == 0:
+    return bind_let(ast, Env(outer=env), 0, stack)
+  else:
+    raise SyntaxError("Invalid argument list supplied.")
+
+def bind_let(ast, new_env, start, stack):
+  """ Evaluates the bindings of a let* from start on, then continues into its body """
+  var_list = ast[1]
+  for i in range(start, len(var_list), 2):
+    value = var_list[i + 1]
+    if isinstance(value, Symbol):
+      new_env.define(var_list[i], new_env.get(value))
+    elif isinstance(value, (List, Vector, Map)) and len(value) > 0:
+      stack.append([resume_let, ast, new_env, i])
+      return value, new_env
+    else:
+      new_env.define(var_list[i], value)
+  return ast[2], new_env
+
+def resume_let(frame, value, stack):
+  _, ast, new_env, i = frame
+  new_env.define(ast[1][i], value)
+  return bind_let(ast, new_env, i + 2, stack)
+
+def eval_do(ast, env, stack):
+  if len(ast) > 2:
+    stack.append([resume_do, ast, env, 1])
+  return ast[1] if len(ast) > 1 else nil, env
+
+def resume_do(frame, value, stack):
+  _, ast, env, i = frame
+  if i + 2 < len(ast):
+    frame[3] = i + 1
+    stack.append(frame)
+  return ast[i + 1], env
+
+def eval_if(ast, env, stack):
+  stack.append([resume_if, ast, env])
+  return ast[1], env
+
+def resume_if(frame, value, stack):
+  _, ast, env = frame
+  if value is False or value is nil:
+    if len(ast) > 3:
+      return ast[3], env
+    else:
+      return nil, None
+  else:
+    return ast[2], env
+
+def eval_fn(ast, env, stack):
+  return make_procedure(ast[2], ast[1], env), None
+
+def eval_quote(ast, env, stack):
+  return ast[1], None
+
+def eval_quasiquote(ast, env, stack):
+  return evaluator.quasiquote(ast[1]), env
+
+def eval_macroexpand(ast, env, stack):
+  return evaluator.macroexpand(ast[1], env), None
+
+def eval_profile(ast, env, stack):
+  if profiler.current is not None:
+    return ast[1], env
+  profiler.start(env)
+  try:
+    value = evaluate(ast[1], env)
+  finally:
+    profiler.stop()
+  return value, None
+
+special_forms = {
+  Symbol('def!'): eval_def,
+  Symbol('let*'): eval_let,
+  Symbol('do'): eval_do,
+  Symbol('if'): eval_if,
+  Symbol('fn*'): eval_fn,
+  Symbol('quote'): eval_quote,
+  Symbol('quasiquote'): eval_quasiquote,
+  Symbol('defmacro!'): eval_defmacro,
+  Symbol('macroexpand'): eval_macroexpand,
+  Symbol('profile'): eval_profile
+}
@@ -0,0 +1,74 @@
+import collections
+from lisp_types import *
+from lazy import LazySeq
+from numeric import NumArray
+
+""" This file implements memoized procedures, created by the memoize builtin and the defmemo macro. A memoized procedure remembers the results of the calls made to it, keyed on the structure of their arguments, so that calling it again with equal arguments returns the remembered result instead of running the procedure. Both engines run calls to memoized procedures made in tail position without growing the Python stack, like calls to regular procedures (see evaluator.evaluate() and compiler.run_procedure()). """
+
+# Default number of results a memoized procedure remembers. Past that, the least recently used ones are forgotten.
+default_limit = 10000
+
+# Returned by Memoized.lookup() when there is no remembered result, as nil is a valid result
+missing = object()
+
+class Memoized:
+  """ A procedure along with the results of the calls made to it, from least to most recently used. Limit is the most results it keeps, or None for no limit. """
+
+  def __init__(self, proc, limit=default_limit):
+    self.proc = proc
+    self.limit = limit
+    self.results = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def key(self, args):
+    return tuple(structural_key(arg) for arg in args)
+
+  def lookup(self, key):
+    """ Returns the result remembered for a key, or missing """
+    value = self.results.get(key, missing)
+    if value is missing:
+      self.misses += 1
+    else:
+      self.hits += 1
+      self.results.move_to_end(key)
+    return value
+
+  def store(self, key, value):
+    self.results[key] = value
+    if self.limit is not None and len(self.results) > self.limit:
+      self.results.popitem(last=False)
+
+  def __call__(self, *args):
+    key = self.key(args)
+    value = self.lookup(key)
+    if value is missing:
+      value = self.proc(*args)
+      self.store(key, value)
+    return value
+
+  def stats(self):
+    return Map({Keyword(':hits'): self.hits, Keyword(':misses'): self.misses, Keyword(':size'): len(self.results), Keyword(':limit'): nil if self.limit is None else self.limit})
+
+def structural_key(value):
+  """ Returns a hashable key for a Lisp value, equal for values that are equal. Sequences become tuples of the keys of their elements (so lists and vectors holding the same elements share a key, like they compare equal), maps frozensets of their keys and values. """
+  if isinstance(value, (List, Vector, LazySeq)):
+    return tuple(structural_key(elem) for elem in value)
+  elif isinstance(value, Map):
+    return frozenset((structural_key(key), structural_key(elem)) for key, elem in value.items())
+  elif isinstance(value, NumArray):
+    return (NumArray, tuple(value.tolist()))
+  return value
+
+# The functions behind the builtins
+
+def memoize(proc, limit=default_limit):
+  """ (memoize f) or (memoize f limit), where a limit of nil means remembering every result """
+  if not callable(proc):
+    raise TypeError("Only functions can be memoized.")
+  return Memoized(proc, None if limit is nil else limit)
+
+def memo_stats(memoized):
+  if not isinstance(memoized, Memoized):
+    raise TypeError("Argument is not a memoized function.")
+  return memoized.stats()
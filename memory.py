@@ -0,0 +1,71 @@
+import gc, sys
+from lisp_types import *
+import environment, lazy, memo, numeric, persistent, strings, tasks
+
+""" This file implements mem-stats, which reports how many objects of each Lisp type are alive, and roughly how much memory they take, to keep track of how much a workload uses. Objects are found by walking the ones the garbage collector tracks, after a collection. Sizes are approximate: each object's own size, plus that of the Python containers only it holds (the list a List wraps, the dictionary of an environment, the tail of a vector...). Elements are counted under their own types; strings and numbers, which aren't Lisp types of their own, aren't counted. The nodes of persistent maps and vectors are counted separately, once each, even when several versions of a collection share them. """
+
+def owned(*attributes):
+  """ Returns a function giving the size of the containers held in the given attributes of an object """
+  return lambda obj: sum(sys.getsizeof(getattr(obj, name)) for name in attributes)
+
+def nothing(obj):
+  return 0
+
+# The name each Lisp type is reported under, and the size of what its objects hold on their own
+kinds = {
+  List: ('list', owned('data')),
+  Cons: ('cons', nothing),
+  Vector: ('vector', owned('tail')),
+  Map: ('map', nothing),
+  persistent.Node: ('map-node', owned('array')),
+  persistent.Small: ('map-node', owned('array')),
+  persistent.Collision: ('map-node', owned('array')),
+  Atom: ('atom', nothing),
+  Procedure: ('procedure', nothing),
+  environment.Environment: ('environment', owned('data')),
+  lazy.LazySeq: ('lazy-seq', nothing),
+  lazy.Chunk: ('lazy-chunk', owned('items')),
+  numeric.NumArray: ('array', owned('data')),
+  strings.StrView: ('string-view', nothing),
+  strings.StringBuilder: ('string-builder', owned('parts')),
+  memo.Memoized: ('memoized', owned('results')),
+  tasks.Task: ('task', nothing),
+  tasks.Channel: ('channel', owned('items'))
+}
+
+names = ['symbol', 'keyword'] + list(dict.fromkeys(name for name, _ in kinds.values())) + ['vector-node']
+
+def mem_stats():
+  """ (mem-stats) returns a map from the name of each Lisp type to the number of its objects alive (:count) and their approximate size in bytes (:bytes), along with the totals (under :total) """
+  gc.collect()
+  stats = {name: [0, 0] for name in names}
+  # Symbols and keywords are interned, so they are all in their tables
+  for name, table in (('symbol', Symbol.table), ('keyword', Keyword.table)):
+    stats[name] = [len(table), sum(sys.getsizeof(obj) + sys.getsizeof(obj.data) for obj in table.values())]
+  seen = set()
+  for obj in gc.get_objects():
+    kind = kinds.get(type(obj))
+    if kind is None:
+      continue
+    name, extra = kind
+    entry = stats[name]
+    entry[0] += 1
+    entry[1] += sys.getsizeof(obj) + extra(obj)
+    if type(obj) is Vector:
+      count_vector_nodes(obj, seen, stats['vector-node'])
+  total = [sum(entry[0] for entry in stats.values()), sum(entry[1] for entry in stats.values())]
+  stats['total'] = total
+  return Map({Keyword(':' + name): Map({Keyword(':count'): count, Keyword(':bytes'): size}) for name, (count, size) in stats.items()})
+
+def count_vector_nodes(vector, seen, entry):
+  """ Counts the nodes of a vector's trie (Python lists, which the garbage collector can't tell apart from any other) that haven't been counted yet """
+  nodes = [(vector.root, vector.shift)]
+  while nodes:
+    node, level = nodes.pop()
+    if id(node) in seen:
+      continue
+    seen.add(id(node))
+    entry[0] += 1
+    entry[1] += sys.getsizeof(node)
+    if level > 0:
+      nodes += [(child, level - persistent.bits) for child in node]
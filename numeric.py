@@ -0,0 +1,172 @@
+import array, itertools, math, operator
+from functools import reduce
+
+""" This file implements numeric arrays: fixed size sequences of numbers that arithmetic, comparisons and reductions work on element by element, in native code instead of one interpreted call per element. Arrays are backed by NumPy when it is installed, and by the standard library's array module otherwise (where element-wise operations are plain Python loops, but the storage is still compact). """
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+class NumArray:
+  """ A numeric array. The data attribute holds either a numpy.ndarray or an array.array; in the latter case masks (arrays of booleans) use the 'B' typecode, integers 'q' and floats 'd'. Elements are always handed out as plain Python numbers. """
+  __slots__ = ('data',)
+
+  def __init__(self, data):
+    self.data = data
+
+  def tolist(self):
+    if numpy is not None:
+      return self.data.tolist()
+    if self.data.typecode == 'B':
+      return [bool(x) for x in self.data]
+    return self.data.tolist()
+
+  def __len__(self):
+    return len(self.data)
+
+  def __iter__(self):
+    return iter(self.tolist())
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return NumArray(self.data[index])
+    value = self.data[index]
+    if numpy is not None:
+      return value.item()
+    return bool(value) if self.data.typecode == 'B' else value
+
+  def __eq__(self, other):
+    # Structural equality, so arrays can be compared and looked up like other values; the = builtin compares element-wise instead
+    return isinstance(other, NumArray) and self.tolist() == other.tolist()
+
+  __hash__ = None
+
+  def __repr__(self):
+    return f"NumArray({self.tolist()})"
+
+  # Arithmetic operators work element by element, so the regular +, -, *, / and % builtins accept arrays, mixed with scalars or with arrays of the same length
+
+  def __add__(self, other):
+    return elementwise(operator.add, self, other)
+
+  def __radd__(self, other):
+    return elementwise(operator.add, other, self)
+
+  def __sub__(self, other):
+    return elementwise(operator.sub, self, other)
+
+  def __rsub__(self, other):
+    return elementwise(operator.sub, other, self)
+
+  def __mul__(self, other):
+    return elementwise(operator.mul, self, other)
+
+  def __rmul__(self, other):
+    return elementwise(operator.mul, other, self)
+
+  def __truediv__(self, other):
+    return elementwise(operator.truediv, self, other)
+
+  def __rtruediv__(self, other):
+    return elementwise(operator.truediv, other, self)
+
+  def __mod__(self, other):
+    return elementwise(operator.mod, self, other)
+
+  def __rmod__(self, other):
+    return elementwise(operator.mod, other, self)
+
+  def __neg__(self):
+    return elementwise(operator.sub, 0, self)
+
+# Creating arrays
+
+def make_array(values):
+  """ Creates an array from a sequence of numbers or booleans """
+  values = values.tolist() if isinstance(values, NumArray) else list(values)
+  for value in values:
+    if not isinstance(value, (int, float)):
+      raise TypeError(f"Arrays can only hold numbers, not {value}")
+  if numpy is not None:
+    return NumArray(numpy.array(values))
+  if values and all(isinstance(value, bool) for value in values):
+    return NumArray(array.array('B', values))
+  if all(isinstance(value, int) for value in values):
+    try:
+      return NumArray(array.array('q', values))
+    except OverflowError:
+      pass
+  return NumArray(array.array('d', values))
+
+def arange(*args):
+  """ Creates an array of evenly spaced numbers: (arange stop), (arange start stop) or (arange start stop step) """
+  if numpy is not None:
+    return NumArray(numpy.arange(*args))
+  if all(isinstance(arg, int) for arg in args):
+    return NumArray(array.array('q', range(*args)))
+  start, stop, step = (0, args[0], 1) if len(args) == 1 else (args + (1,))[:3]
+  count = max(0, math.ceil((stop - start) / step))
+  return NumArray(array.array('d', (start + i * step for i in range(count))))
+
+# Element-wise operations
+
+def elementwise(op, a, b):
+  """ Applies a binary operator to every pair of elements of two arrays, or of an array and a scalar """
+  if numpy is not None:
+    return NumArray(op(unwrap(a), unwrap(b)))
+  if isinstance(a, NumArray) and isinstance(b, NumArray) and len(a) != len(b):
+    raise ValueError(f"Arrays of different lengths: {len(a)} and {len(b)}")
+  xs = a.tolist() if isinstance(a, NumArray) else itertools.repeat(a)
+  ys = b.tolist() if isinstance(b, NumArray) else itertools.repeat(b)
+  return make_array([op(x, y) for x, y in zip(xs, ys)])
+
+def unwrap(value):
+  return value.data if isinstance(value, NumArray) else value
+
+def apply(func, arr):
+  """ Applies a unary function to every element of an array """
+  if numpy is not None and func in numpy_functions:
+    return NumArray(numpy_functions[func](arr.data))
+  return make_array([func(x) for x in arr.tolist()])
+
+numpy_functions = {math.sqrt: numpy.sqrt, math.floor: numpy.floor, operator.not_: numpy.logical_not} if numpy is not None else {}
+
+def compare(op, args):
+  """ Compares each argument with the next one, combining the results: a boolean for scalars, a mask if any of the arguments is an array """
+  pairs = list(zip(args, args[1:]))
+  if not any(isinstance(arg, NumArray) for arg in args):
+    return all(op(a, b) for a, b in pairs)
+  masks = [elementwise(op, a, b) for a, b in pairs]
+  return reduce(lambda a, b: elementwise(operator.and_, a, b), masks)
+
+# Reductions
+
+def array_sum(arr):
+  if numpy is not None:
+    return numpy.sum(unwrap(arr)).item()
+  return sum(arr)
+
+def array_prod(arr):
+  if numpy is not None:
+    return numpy.prod(unwrap(arr)).item()
+  return math.prod(arr)
+
+def dot(a, b):
+  if numpy is not None:
+    return numpy.dot(unwrap(a), unwrap(b)).item()
+  if len(a) != len(b):
+    raise ValueError(f"Arrays of different lengths: {len(a)} and {len(b)}")
+  return sum(x * y for x, y in zip(a, b))
+
+def array_min(arr):
+  return numpy.min(arr.data).item() if numpy is not None else min(arr)
+
+def array_max(arr):
+  return numpy.max(arr.data).item() if numpy is not None else max(arr)
+
+def select(arr, mask):
+  """ Returns the elements of an array for which the mask is true """
+  if numpy is not None:
+    return NumArray(arr.data[mask.data])
+  return make_array(itertools.compress(arr.tolist(), mask.tolist()))
@@ -0,0 +1,182 @@
+from lisp_types import *
+import evaluator, global_env
+
+""" This file implements the optimization pass lisp.py runs over each form before evaluating it, so that the bodies of fn* and def! forms are simplified once, when they are defined, instead of on every call. The pass:
+- folds calls to pure builtins whose arguments are all literals, like (* 3 5), into their value
+- prunes the branch of an if whose condition is a literal
+- flattens nested do forms, dropping literals whose value is thrown away
+- turns quasiquote templates into direct calls to list and concat, or into a quoted constant when nothing in them is unquoted
+
+Macro calls are left alone, as their arguments aren't necessarily code, and so are calls through names that aren't bound yet, which could turn out to be macros. The pass runs before macros are expanded (so that redefining a macro still changes the code that uses it, as the macro cache expects), except with --expand-on-load, which expands them first.
+
+Builtins are only folded (and list and concat only used) when the name still refers to the original builtin, and isn't bound by an enclosing fn* or let*, or by a def! anywhere in the form. Code optimized before a builtin is rebound with def! keeps the original builtin's results; --no-optimize turns the pass off altogether. """
+
+# The builtins that always return the same result for the same arguments, without side effects
+pure = {Symbol(name) for name in ['+', '-', '*', '/', '%', '=', '<', '<=', '>', '>=', 'sqrt', 'floor', 'not', 'and', 'or', 'min', 'max', 'str', 'pr-str', 'count']}
+
+special_forms = set(evaluator.special_forms)
+
+# Values that evaluate to themselves, and can be written directly in an AST
+literal_types = {int, float, bool, str, Keyword, Nil}
+
+def is_literal(ast):
+  return type(ast) in literal_types
+
+def optimize(ast, env):
+  """ Returns the optimized form of an AST about to be evaluated in env, which is the AST itself if there's nothing to optimize in it """
+  defined, macros = targets(ast)
+  return walk(ast, env, frozenset(defined), macros)
+
+def targets(ast, defined=None, macros=None):
+  """ Returns the names def! and defmacro! forms in an AST bind, and the ones defmacro! binds. Calls through the latter are left alone, since they might be macros that don't exist yet. """
+  if defined is None:
+    defined, macros = set(), set()
+  if isinstance(ast, (List, Vector)) and len(ast) > 0:
+    if ast[0] is Symbol('quote'):
+      return defined, macros
+    if ast[0] in (Symbol('def!'), Symbol('defmacro!')) and len(ast) > 1 and isinstance(ast[1], Symbol):
+      defined.add(ast[1])
+      if ast[0] is Symbol('defmacro!'):
+        macros.add(ast[1])
+    for elem in ast:
+      targets(elem, defined, macros)
+  return defined, macros
+
+def is_builtin(symbol, env, bound):
+  """ Checks whether a symbol refers to the builtin of that name """
+  if symbol in bound:
+    return False
+  data = env.find(symbol)
+  return data is not None and symbol in global_env.funcs and data[symbol] is global_env.funcs[symbol]
+
+def walk(ast, env, bound, macros):
+  """ Optimizes an AST, where bound holds the names that don't refer to the global environment """
+  if isinstance(ast, List) and len(ast) > 0:
+    head = ast[0]
+    if isinstance(head, Symbol) and head in macros:
+      return ast
+    if isinstance(head, Symbol) and head not in bound:
+      if head not in special_forms and (env.find(head) is None or evaluator.get_macro(ast, env) is not None):
+        return ast
+      if head is Symbol('quote') or head is Symbol('macroexpand'):
+        return ast
+      if head is Symbol('quasiquote') and len(ast) > 1:
+        if not (is_builtin(Symbol('list'), env, bound) and is_builtin(Symbol('concat'), env, bound)):
+          return ast
+        expanded = expand_quasiquote(ast[1])
+        return ast if expanded is None else walk(expanded, env, bound, macros)
+      if head is Symbol('fn*') and len(ast) > 2:
+        return rebuild(ast, [head, ast[1], walk(ast[2], env, bound | set(ast[1]), macros)])
+      if head is Symbol('let*') and len(ast) > 2 and evaluator.is_non_empty_seq(ast[1]) and len(ast[1]) % 2 == 0:
+        var_list = []
+        for i in range(0, len(ast[1]), 2):
+          var_list += [ast[1][i], walk(ast[1][i + 1], env, bound, macros)]
+          bound = bound | {ast[1][i]}
+        return rebuild(ast, [head, rebuild(ast[1], var_list), walk(ast[2], env, bound, macros)])
+      if head in (Symbol('def!'), Symbol('defmacro!')) and len(ast) > 2:
+        return rebuild(ast, [head, ast[1], walk(ast[2], env, bound, macros)])
+      if head is Symbol('if') and len(ast) > 2:
+        return optimize_if(rebuild(ast, [head] + [walk(elem, env, bound, macros) for elem in ast[1:]]))
+      if head is Symbol('do') and len(ast) > 1:
+        return optimize_do(ast, [walk(elem, env, bound, macros) for elem in ast[1:]], bound)
+      ast = rebuild(ast, [head] + [walk(elem, env, bound, macros) for elem in ast[1:]])
+      if head in pure and all(is_literal(elem) for elem in ast[1:]) and is_builtin(head, env, bound):
+        return fold(ast)
+      return ast
+    return rebuild(ast, [walk(elem, env, bound, macros) for elem in ast])
+  elif isinstance(ast, Vector):
+    return rebuild(ast, [walk(elem, env, bound, macros) for elem in ast])
+  elif isinstance(ast, Map):
+    items = [(key, walk(value, env, bound, macros)) for key, value in ast.items()]
+    return ast if all(new is old for (_, new), old in zip(items, ast.values())) else Map(dict(items))
+  else:
+    return ast
+
+def rebuild(ast, elems):
+  """ Returns a form holding elems in place of a list or vector's elements. When they are the elements it already has, that's the form itself: code that isn't changed keeps its identity, which the macro cache is keyed on, so evaluating the same form again finds the expansions made the first time. """
+  if len(elems) == len(ast) and all(new is old for new, old in zip(elems, ast)):
+    return ast
+  return Vector(elems) if isinstance(ast, Vector) else List(elems)
+
+def fold(ast):
+  """ Calls the builtin of a call whose arguments are literals, and returns its value if it can be written as a literal. A call that fails is left as it is, so that it fails when it runs. """
+  try:
+    value = global_env.funcs[ast[0]](*ast[1:])
+  except Exception:
+    return ast
+  return value if is_literal(value) else ast
+
+def optimize_if(ast):
+  test = ast[1]
+  if not is_literal(test):
+    return ast
+  if test is False or test is nil:
+    return ast[3] if len(ast) > 3 else nil
+  return ast[2]
+
+def optimize_do(ast, forms, bound):
+  """ Splices the forms of nested do forms into their parent's, and drops literals whose value isn't the result """
+  flat = []
+  for form in forms:
+    if isinstance(form, List) and len(form) > 1 and form[0] is Symbol('do') and Symbol('do') not in bound:
+      flat += form[1:]
+    else:
+      flat.append(form)
+  flat = [form for form in flat[:-1] if not is_literal(form)] + flat[-1:]
+  return flat[0] if len(flat) == 1 else rebuild(ast, [ast[0]] + flat)
+
+# Quasiquote
+
+def expand_quasiquote(ast):
+  """ Returns a form that builds a quasiquote template directly, or None if the template is malformed (so that evaluating it reports the error). It builds the same value evaluator.quasiquote() does, which conses the elements one at a time, but with a single call to list for each run of elements that aren't spliced in, and a single call to concat to join those runs and the spliced sequences. """
+  if not evaluator.is_non_empty_seq(ast):
+    return ast if is_literal(ast) else List([Symbol('quote'), ast])
+  if ast[0] is Symbol('unquote'):
+    return ast[1] if len(ast) > 1 else None
+  if not has_unquote(ast):
+    return List([Symbol('quote'), constant(ast)])
+  segments, run, spliced = [], [], False
+  for i, elem in enumerate(ast):
+    if elem is Symbol('unquote'):
+      # An unquote in the middle of a template stands for the rest of it, like the tail of a dotted list
+      if i + 1 >= len(ast):
+        return None
+      tail = ast[i + 1]
+      break
+    if evaluator.is_non_empty_seq(elem) and elem[0] is Symbol('splice-unquote'):
+      if len(elem) < 2:
+        return None
+      if run:
+        segments.append(List([Symbol('list')] + run))
+        run = []
+      segments.append(elem[1])
+      spliced = True
+    else:
+      expanded = expand_quasiquote(elem)
+      if expanded is None:
+        return None
+      run.append(expanded)
+  else:
+    tail = None
+  if not spliced and tail is None:
+    return List([Symbol('list')] + run)
+  if run:
+    segments.append(List([Symbol('list')] + run))
+  if tail is not None:
+    segments.append(tail)
+  return List([Symbol('concat')] + segments)
+
+def constant(ast):
+  """ Returns the value of a template without unquotes. Like evaluator.quasiquote(), it builds every non-empty sequence in it as a list. """
+  if evaluator.is_non_empty_seq(ast):
+    return List([constant(elem) for elem in ast])
+  return ast
+
+def has_unquote(ast):
+  """ Checks whether anything in a template is unquoted or spliced in """
+  for elem in ast:
+    if elem is Symbol('unquote') or elem is Symbol('splice-unquote'):
+      return True
+    if evaluator.is_non_empty_seq(elem) and has_unquote(elem):
+      return True
+  return False
@@ -0,0 +1,226 @@
+import io, os, pickle
+from lisp_types import *
+from lazy import LazySeq
+from memo import Memoized
+import compiler, environment, evaluator, printer
+
+""" This file implements pmap, pcall and future, which run Lisp functions in a pool of worker processes to use more than one core. The workers are forked from the interpreter, so they start with a copy of its global environment; if a global binding the work refers to has changed since, the pool is forked again before the work is sent (see get_pool()). Functions, their arguments and their results travel between processes pickled by the Pickler below, which knows how to send procedures (closures included) and refers to the global environment instead of copying it. The work should be pure: changes a worker makes, to atoms for instance, stay in that worker. On platforms that can't fork, and inside the workers themselves, everything runs in the calling process instead. """
+
+# How many worker processes the pool has (None means one per core)
+workers = None
+
+# How many chunks each worker gets, when pmap splits its work. More chunks balance the load better, fewer cost less to send.
+chunks_per_worker = 4
+
+# The pool, and the global environment its workers were forked with, along with a copy of the bindings it had then
+pool = None
+global_env = None
+snapshot = None
+references = None # id of each function bound in the snapshot -> the symbol it is bound to
+
+# Set in the workers, where pmap and friends don't start pools of their own
+in_worker = False
+
+class Pickler(pickle.Pickler):
+  """ Pickles Lisp values to send them to, or back from, a worker. The global environment and the functions bound in it (builtins, which can't be pickled, included) are sent as references that the other side resolves to its own copy. Procedures are sent as the body and parameters of the fn* form that created them, and the environment they close over; compiled procedures also take the names of the frames around them, so they can be analyzed again on the other side. """
+
+  def persistent_id(self, obj):
+    if obj is global_env:
+      return 'global'
+    if obj is compiler.unbound:
+      return 'unbound'
+    key = references.get(id(obj)) if references is not None else None
+    return ('global', str(key)) if key is not None else None
+
+  def reducer_override(self, obj):
+    if isinstance(obj, Procedure):
+      if obj.code is None:
+        return restore_procedure, (obj.ast, obj.params, obj.env, obj.is_macro, obj.name)
+      scopes = []
+      scope = obj.scope
+      while scope is not None:
+        scopes.append((scope.names, scope.defined))
+        scope = scope.outer
+      return restore_compiled, (obj.ast, obj.params, obj.env, scopes, obj.base, obj.is_macro, obj.name)
+    elif isinstance(obj, LazySeq):
+      # The recipes of lazy sequences are Python closures, so they are sent realized
+      return List, (list(obj),)
+    return NotImplemented
+
+class Unpickler(pickle.Unpickler):
+  def persistent_load(self, pid):
+    if pid == 'global':
+      return global_env
+    if pid == 'unbound':
+      return compiler.unbound
+    return snapshot[Symbol(pid[1])]
+
+def dumps(obj):
+  file = io.BytesIO()
+  Pickler(file, pickle.HIGHEST_PROTOCOL).dump(obj)
+  return file.getvalue()
+
+def loads(data):
+  return Unpickler(io.BytesIO(data)).load()
+
+def restore_procedure(ast, params, env, is_macro, name):
+  proc = evaluator.make_procedure(ast, params, env)
+  proc.is_macro, proc.name = is_macro, name
+  return proc
+
+def restore_compiled(ast, params, env, scopes, base, is_macro, name):
+  scope = None
+  for names, defined in reversed(scopes):
+    scope = compiler.Scope(list(names), scope)
+    scope.defined = set(defined)
+  proc = compiler.analyze(List([Symbol('fn*'), params, ast]), scope, base)(env)
+  proc.is_macro, proc.name = is_macro, name
+  return proc
+
+# The pool
+
+# multiprocessing takes a while to import, so that only happens the first time something runs in parallel
+
+def can_fork():
+  import multiprocessing
+  return 'fork' in multiprocessing.get_all_start_methods()
+
+def get_pool(env, work):
+  """ Returns the pool to send work (the functions and arguments about to be pickled) to. The pool is forked (again) if the global environment env is nested in isn't the one it was forked with, or if a global the work refers to has been bound to something else since: the workers would otherwise see the old value. Changes to the other globals don't matter to the work, so they don't cost a fork. """
+  global pool, global_env, snapshot, references
+  while env.outer is not None:
+    env = env.outer
+  if pool is not None and env is global_env and all(snapshot.get(symbol, absent) is env.data[symbol] for symbol in dependencies(work, env)):
+    return pool
+  if pool is not None:
+    # The old pool finishes the work already sent to it (futures may still be waiting for their results), and its workers exit once it's done. The results that are pending keep it alive until then.
+    pool.close()
+  # Otherwise the workers would start with a copy of what is waiting to be printed
+  printer.output.flush()
+  global_env, snapshot = env, dict(env.data)
+  references = {id(value): key for key, value in snapshot.items() if callable(value)}
+  import multiprocessing
+  pool = multiprocessing.get_context('fork').Pool(workers, initializer=start_worker)
+  return pool
+
+# Stands for a symbol that wasn't bound when the pool was forked
+absent = object()
+
+def dependencies(work, env):
+  """ Returns the symbols bound in the global environment env that running work may look up: those in the bodies of the procedures it holds, and in turn those in the bodies of the global procedures and macros they name, and so on. Symbols are collected wherever they appear, quoted ones included, which can only make the pool fork when it didn't need to. """
+  found = set()
+  seen = set()
+  pending = [work]
+  while pending:
+    value = pending.pop()
+    if type(value) is Symbol:
+      if value not in found and value in env.data:
+        found.add(value)
+        pending.append(env.data[value])
+      continue
+    if isinstance(value, (int, float, str, Keyword)) or id(value) in seen:
+      continue
+    seen.add(id(value))
+    if isinstance(value, Procedure):
+      pending += (value.ast, value.env)
+    elif isinstance(value, Memoized):
+      pending.append(value.proc)
+    elif isinstance(value, environment.Environment):
+      # The global environment is looked up by symbol, the environments of closures are sent along with them
+      if value is not env:
+        pending += (value.outer, *value.data.values())
+    elif isinstance(value, Map):
+      pending += (*value.keys(), *value.values())
+    elif isinstance(value, Atom):
+      pending.append(value.value)
+    elif isinstance(value, (List, Vector, LazySeq, list, tuple)):
+      # Frames of compiled procedures are Python lists
+      pending += value
+  return found
+
+def start_worker():
+  global in_worker
+  in_worker = True
+
+def run_chunk(payload):
+  """ Runs in a worker: calls a function on each set of arguments in a chunk, and returns the pickled results, or the error that stopped it along with the position of the arguments that caused it """
+  func, chunk = loads(payload)
+  results = []
+  try:
+    for index, args in enumerate(chunk):
+      try:
+        results.append(func(*args))
+      except Exception as error:
+        return error_reply(index, error)
+  finally:
+    # Workers never exit normally, so what they printed is written out after each chunk
+    printer.output.flush()
+  try:
+    return dumps(('ok', results))
+  except Exception as error:
+    return error_reply(None, error)
+
+def error_reply(index, error):
+  try:
+    return dumps(('error', index, error))
+  except Exception:
+    # Not every exception can be pickled, but its message can
+    return dumps(('error', index, RuntimeError(f"{type(error).__name__}: {error}")))
+
+def check(reply, where):
+  """ Returns the results in a reply from run_chunk(), or raises the error it holds, saying where it happened """
+  reply = loads(reply)
+  if reply[0] == 'ok':
+    return reply[1]
+  _, index, error = reply
+  where = where(index)
+  try:
+    error = type(error)(f"{error} (in {where})")
+  except TypeError:
+    error = RuntimeError(f"{type(error).__name__}: {error} (in {where})")
+  raise error
+
+def call(func):
+  return func()
+
+# The functions behind the builtins. Each takes the environment they're called from first.
+
+def pmap(env, func, *colls):
+  """ Like map, but the calls are spread over the worker processes, in chunks. Unlike map it isn't lazy: it returns a List once all the results are in. """
+  items = list(zip(*colls))
+  if in_worker or not can_fork() or len(items) < 2:
+    return List([func(*args) for args in items])
+  pool = get_pool(env, (func, items))
+  size = max(1, len(items) // ((workers or os.cpu_count() or 1) * chunks_per_worker))
+  offsets = range(0, len(items), size)
+  replies = pool.imap(run_chunk, [dumps((func, items[offset:offset + size])) for offset in offsets])
+  results = []
+  for offset, reply in zip(offsets, replies):
+    results += check(reply, lambda index: f"pmap, on element {offset + index}" if index is not None else "pmap")
+  return List(results)
+
+def pcall(env, *funcs):
+  """ Calls functions without arguments in parallel, and returns a List of their results """
+  return pmap(env, call, funcs)
+
+class Future:
+  """ The result of a function running in a worker process. Dereferencing it waits for the function to finish. """
+  def __init__(self, result, value=None):
+    self.result = result
+    self.value = value
+
+  def deref(self):
+    if self.result is not None:
+      self.value = check(self.result.get(), lambda index: "future")[0]
+      self.result = None
+    return self.value
+
+  def __str__(self):
+    return "#<future>"
+
+def future(env, func):
+  """ Starts calling a function without arguments in a worker, and returns a Future for its result """
+  if in_worker or not can_fork():
+    return Future(None, func())
+  pool = get_pool(env, func)
+  return Future(pool.apply_async(run_chunk, (dumps((call, [(func,)])),)))
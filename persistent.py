@@ -0,0 +1,506 @@
+import collections.abc, itertools
+
+""" This file implements the persistent collections behind Map and Vector. Neither is ever modified once built: assoc, dissoc and conj return a new collection that shares everything but the path to the changed element with the old one, so an update costs O(log32 n) instead of a copy of the whole collection.
+
+Maps iterate (and so print) their keys in the order they were added, like Python dictionaries. Small maps, of up to 8 keys, are a plain list of keys and values in that order, which is quicker to search than hashing into a trie. Larger maps are hash array mapped tries, whose order depends on the hashes of the keys instead, which change from run to run (those of symbols and keywords are based on their identity, those of strings on PYTHONHASHSEED); so each key in a trie is stored with the sequence number it was added with, and iterating over the map sorts its keys by it. Each node has 32 slots, indexed by 5 bits of the key's hash (the bits used depend on the depth), but only stores the slots in use, along with a bitmap saying which ones those are. A slot holds either a key and its entry (its sequence number and value), or a node one level down holding the keys whose hashes share those bits. Keys whose hashes are entirely equal end up in a collision node, which is a plain list of keys and values.
+
+Vectors are bit-partitioned tries: the elements are stored in leaves of 32, and each level above groups 32 nodes, so the path to an element is given by its index, 5 bits per level. The last leaf (the tail) is kept outside of the trie, so conj only touches the trie once every 32 elements. """
+
+bits = 5
+width = 1 << bits
+slot_mask = width - 1
+
+def hash32(key):
+  """ Python hashes are 64 bits, 32 of them are enough to pick the slots """
+  return hash(key) & 0xFFFFFFFF
+
+# Marks the key slot of an entry that holds a node instead of a key and its value
+branch = object()
+
+# Returned by lookup() when a key is missing, as any value (None included) can be in a map
+missing = object()
+
+# Maps
+
+class Node:
+  """ A node of a map's trie. Array holds two items for each slot in use, in the order of their bits: a key and its entry, or branch and a node. Nodes created while building a new map are given the builder's edit token, which allows that builder (and nothing else) to update them in place; see Map.__init__. """
+  __slots__ = ('bitmap', 'array', 'edit')
+
+  def __init__(self, bitmap, array, edit=None):
+    self.bitmap = bitmap
+    self.array = array
+    self.edit = edit
+
+  def assoc(self, shift, h, key, entry, edit=None):
+    """ Returns the node with key set to the value of entry, and whether the key is new. A key that is already there keeps its sequence number. """
+    bit = 1 << ((h >> shift) & slot_mask)
+    i = 2 * (self.bitmap & (bit - 1)).bit_count()
+    if self.bitmap & bit:
+      k, v = self.array[i], self.array[i + 1]
+      if k is branch:
+        child, added = v.assoc(shift + bits, h, key, entry, edit)
+        return (self if child is v else self.set(i + 1, child, edit)), added
+      if k is key or k == key:
+        return (self if v[1] is entry[1] else self.set(i + 1, (v[0], entry[1]), edit)), False
+      # Two keys share the slot, so it becomes a branch to a node holding both
+      child = pair(shift + bits, k, v, h, key, entry, edit)
+      node = self.set(i, branch, edit)
+      node.array[i + 1] = child
+      return node, True
+    if edit is not None and self.edit is edit:
+      self.array[i:i] = (key, entry)
+      self.bitmap |= bit
+      return self, True
+    return Node(self.bitmap | bit, self.array[:i] + [key, entry] + self.array[i:], edit), True
+
+  def set(self, i, item, edit):
+    """ Returns the node with array[i] replaced, updating it in place if it belongs to edit """
+    if edit is not None and self.edit is edit:
+      self.array[i] = item
+      return self
+    array = self.array.copy()
+    array[i] = item
+    return Node(self.bitmap, array, edit)
+
+  def dissoc(self, shift, h, key):
+    """ Returns the node without key, itself if it doesn't hold key, or None if nothing is left in it """
+    bit = 1 << ((h >> shift) & slot_mask)
+    if not self.bitmap & bit:
+      return self
+    i = 2 * (self.bitmap & (bit - 1)).bit_count()
+    k, v = self.array[i], self.array[i + 1]
+    if k is branch:
+      child = v.dissoc(shift + bits, h, key)
+      if child is v:
+        return self
+      if child is not None:
+        return self.set(i + 1, child, None)
+    elif not (k is key or k == key):
+      return self
+    if self.bitmap == bit:
+      return None
+    return Node(self.bitmap ^ bit, self.array[:i] + self.array[i + 2:])
+
+  def entries(self):
+    """ Generator over the keys in the trie below the node and their entries, in no particular order """
+    array = self.array
+    for i in range(0, len(array), 2):
+      if array[i] is branch:
+        yield from array[i + 1].entries()
+      else:
+        yield array[i], array[i + 1]
+
+class Pairs:
+  """ A flat list of keys and values, searched from the start """
+  __slots__ = ('array', 'edit')
+
+  def find(self, key):
+    array = self.array
+    for i in range(0, len(array), 2):
+      if array[i] is key or array[i] == key:
+        return i
+    return -1
+
+  def items(self):
+    array = self.array
+    for i in range(0, len(array), 2):
+      yield array[i], array[i + 1]
+
+  entries = items
+
+# The most keys a map holds before it turns into a trie
+small_limit = 8
+
+class Small(Pairs):
+  """ The root of a small map. It holds the values themselves, as the order of its keys is the order they were added in. """
+  __slots__ = ()
+
+  def __init__(self, array, edit=None):
+    self.array = array
+    self.edit = edit
+
+  def assoc(self, shift, h, key, value, edit=None):
+    i = self.find(key)
+    if i >= 0:
+      if self.array[i + 1] is value:
+        return self, False
+      if edit is not None and self.edit is edit:
+        self.array[i + 1] = value
+        return self, False
+      array = self.array.copy()
+      array[i + 1] = value
+      return Small(array, edit), False
+    if len(self.array) < 2 * small_limit:
+      if edit is not None and self.edit is edit:
+        self.array += (key, value)
+        return self, True
+      return Small(self.array + [key, value], edit), True
+    # The map turns into a trie, where the keys so far get their positions as sequence numbers, and the new key the next one
+    node = Node(0, [], edit)
+    for seq, (k, v) in enumerate(self.items()):
+      node, _ = node.assoc(0, hash32(k), k, (seq, v), edit)
+    return node.assoc(0, h, key, (small_limit, value), edit)
+
+  def dissoc(self, shift, h, key):
+    i = self.find(key)
+    if i < 0:
+      return self
+    if len(self.array) == 2:
+      return None
+    return Small(self.array[:i] + self.array[i + 2:])
+
+class Collision(Pairs):
+  """ Holds the keys whose hashes are all equal, along with their entries """
+  __slots__ = ('hash',)
+
+  def __init__(self, h, array, edit=None):
+    self.hash = h
+    self.array = array
+    self.edit = edit
+
+  def assoc(self, shift, h, key, entry, edit=None):
+    if h != self.hash:
+      # A key with another hash goes next to the collision node, in a node of its own
+      node = Node(1 << ((self.hash >> shift) & slot_mask), [branch, self], edit)
+      return node.assoc(shift, h, key, entry, edit)
+    i = self.find(key)
+    if i >= 0:
+      old = self.array[i + 1]
+      if old[1] is entry[1]:
+        return self, False
+      array = self.array.copy()
+      array[i + 1] = (old[0], entry[1])
+      return Collision(h, array, edit), False
+    return Collision(h, self.array + [key, entry], edit), True
+
+  def dissoc(self, shift, h, key):
+    i = self.find(key) if h == self.hash else -1
+    if i < 0:
+      return self
+    if len(self.array) == 2:
+      return None
+    return Collision(h, self.array[:i] + self.array[i + 2:])
+
+def pair(shift, k1, v1, h2, k2, v2, edit):
+  """ Returns a node holding two keys (and their entries) that share the slots above shift """
+  h1 = hash32(k1)
+  if h1 == h2:
+    return Collision(h1, [k1, v1, k2, v2], edit)
+  node, _ = Node(0, [], edit).assoc(shift, h1, k1, v1, edit)
+  node, _ = node.assoc(shift, h2, k2, v2, edit)
+  return node
+
+def lookup(node, h, key, default):
+  """ Returns the value of key in the map whose root is node, or default """
+  if type(node) is Small:
+    i = node.find(key)
+    return node.array[i + 1] if i >= 0 else default
+  shift = 0
+  while node is not None:
+    if type(node) is Collision:
+      i = node.find(key) if h == node.hash else -1
+      return node.array[i + 1][1] if i >= 0 else default
+    bit = 1 << ((h >> shift) & slot_mask)
+    if not node.bitmap & bit:
+      return default
+    i = 2 * (node.bitmap & (bit - 1)).bit_count()
+    k = node.array[i]
+    if k is branch:
+      node = node.array[i + 1]
+      shift += bits
+    elif k is key or k == key:
+      return node.array[i + 1][1]
+    else:
+      return default
+  return default
+
+def put(root, seq, key, value, edit=None):
+  """ Sets key to value in the map whose root is root (None for an empty map), seq being the sequence number a key added to its trie gets. Returns the new root, the sequence number the next key will get, and whether the key is new. """
+  if root is None:
+    root = Small([], edit)
+  if type(root) is Small:
+    root, added = root.assoc(0, hash32(key), key, value, edit)
+    return root, (small_limit + 1 if type(root) is Node else 0), added
+  root, added = root.assoc(0, hash32(key), key, (seq, value), edit)
+  return root, seq + added, added
+
+def unordered(root):
+  """ Generator over the keys and values of the map whose root is root, in no particular order, for what doesn't care about it """
+  if type(root) is Small:
+    yield from root.items()
+  elif root is not None:
+    for key, entry in root.entries():
+      yield key, entry[1]
+
+def sequence(item):
+  return item[1][0]
+
+class Map(collections.abc.Mapping):
+  """ A persistent hash map. It can be built from a mapping or from key and value pairs, and is hashable, so maps can be keys of other maps. """
+  __slots__ = ('root', 'size', 'seq', 'hash_value')
+
+  def __init__(self, items=()):
+    if isinstance(items, collections.abc.Mapping):
+      items = items.items()
+    # Nobody else can see the nodes created while building the map, so they are updated in place. The edit token is dropped at the end, which freezes them.
+    edit = object()
+    root = None
+    size = seq = 0
+    for key, value in items:
+      if type(root) is Node:
+        root, added = root.assoc(0, hash32(key), key, (seq, value), edit)
+        seq += added
+      else:
+        root, seq, added = put(root, seq, key, value, edit)
+      size += added
+    self.root = root
+    self.size = size
+    self.seq = seq
+    self.hash_value = None
+
+  @classmethod
+  def make(cls, root, size, seq):
+    result = cls.__new__(cls)
+    result.root = root
+    result.size = size
+    result.seq = seq
+    result.hash_value = None
+    return result
+
+  def __len__(self):
+    return self.size
+
+  def __getitem__(self, key):
+    value = lookup(self.root, hash32(key), key, missing)
+    if value is missing:
+      raise KeyError(key)
+    return value
+
+  def get(self, key, default=None):
+    return lookup(self.root, hash32(key), key, default)
+
+  def __contains__(self, key):
+    return lookup(self.root, hash32(key), key, missing) is not missing
+
+  def __iter__(self):
+    for key, _ in self.items():
+      yield key
+
+  def items(self):
+    return ItemsView(self)
+
+  def values(self):
+    return ValuesView(self)
+
+  def assoc(self, key, value):
+    """ Returns the map with key set to value """
+    root = self.root
+    if type(root) is Node:
+      root, added = root.assoc(0, hash32(key), key, (self.seq, value))
+      seq = self.seq + added
+    else:
+      root, seq, added = put(root, self.seq, key, value)
+    return self if root is self.root else Map.make(root, self.size + added, seq)
+
+  def dissoc(self, key):
+    """ Returns the map without key """
+    if self.root is None:
+      return self
+    root = self.root.dissoc(0, hash32(key), key)
+    return self if root is self.root else Map.make(root, self.size - 1, self.seq)
+
+  def __eq__(self, other):
+    if self is other:
+      return True
+    if not isinstance(other, collections.abc.Mapping):
+      return NotImplemented
+    if len(self) != len(other):
+      return False
+    for key, value in unordered(self.root):
+      if other.get(key, missing) != value:
+        return False
+    return True
+
+  def __hash__(self):
+    if self.hash_value is None:
+      self.hash_value = hash(frozenset(unordered(self.root)))
+    return self.hash_value
+
+  def __reduce__(self):
+    return (Map, (list(self.items()),))
+
+  def __repr__(self):
+    return f"Map({dict(self.items())!r})"
+
+class ItemsView(collections.abc.ItemsView):
+  # Walks the trie once, instead of looking each key up again like the generic view would
+  def __iter__(self):
+    root = self._mapping.root
+    if root is None:
+      return iter(())
+    if type(root) is Small:
+      return root.items()
+    return in_order(root, self._mapping.seq, len(self._mapping))
+
+def in_order(root, seq, size):
+  """ Returns an iterator over the keys and values in a trie, sorted by their sequence numbers, which are all below seq. Unless removing keys has left too many numbers unused, each item is simply put in its place in a list of seq slots. """
+  if seq > 2 * size:
+    return ((key, entry[1]) for key, entry in sorted(root.entries(), key=sequence))
+  slots = [None] * seq
+  for key, entry in root.entries():
+    slots[entry[0]] = (key, entry[1])
+  return filter(None, slots) if seq > size else iter(slots)
+
+class ValuesView(collections.abc.ValuesView):
+  def __iter__(self):
+    for _, value in self._mapping.items():
+      yield value
+
+# Vectors
+
+def tail_offset(size):
+  """ The index of the first element in the tail """
+  return 0 if size < width else ((size - 1) >> bits) << bits
+
+def new_path(level, node):
+  """ Returns a chain of nodes leading from level down to node """
+  for _ in range(0, level, bits):
+    node = [node]
+  return node
+
+def push_tail(size, level, parent, tail):
+  """ Returns parent with the full tail added as the leaf after the last one, size being the number of elements before that tail is pushed plus its own """
+  i = ((size - 1) >> level) & slot_mask
+  result = parent.copy()
+  if level == bits:
+    child = tail
+  elif i < len(parent):
+    child = push_tail(size, level - bits, parent[i], tail)
+  else:
+    child = new_path(level - bits, tail)
+  if i < len(result):
+    result[i] = child
+  else:
+    result.append(child)
+  return result
+
+def assoc_in(level, node, index, value):
+  """ Returns node with the element at index replaced, copying the nodes on the path to it """
+  result = node.copy()
+  if level == 0:
+    result[index & slot_mask] = value
+  else:
+    i = (index >> level) & slot_mask
+    result[i] = assoc_in(level - bits, node[i], index, value)
+  return result
+
+# The root of the vectors whose elements all fit in their tail. Nodes are never changed once they are part of a vector, so they all share it.
+empty_root = []
+
+class Vector(collections.abc.Sequence):
+  """ A persistent vector. Elements are stored in a trie of nodes (Python lists) whose depth is shift / 5, except for the last up to 32 of them, which are in the tail. Vectors compare equal to any list holding the same elements, and are hashable. """
+  __slots__ = ('size', 'shift', 'root', 'tail', 'hash_value')
+
+  def __init__(self, items=()):
+    # The trie is built bottom up: full leaves first, then levels of up to 32 nodes, until a single level is left
+    items = list(items)
+    size = len(items)
+    offset = tail_offset(size)
+    level = [items[i:i + width] for i in range(0, offset, width)]
+    shift = bits
+    while len(level) > width:
+      level = [level[i:i + width] for i in range(0, len(level), width)]
+      shift += bits
+    self.size = size
+    self.shift = shift
+    self.root = level if level else empty_root
+    self.tail = items[offset:]
+    self.hash_value = None
+
+  @classmethod
+  def make(cls, size, shift, root, tail):
+    result = cls.__new__(cls)
+    result.size = size
+    result.shift = shift
+    result.root = root
+    result.tail = tail
+    result.hash_value = None
+    return result
+
+  def __len__(self):
+    return self.size
+
+  def leaf(self, index):
+    """ Returns the node of 32 elements index is in """
+    if index >= tail_offset(self.size):
+      return self.tail
+    node = self.root
+    for level in range(self.shift, 0, -bits):
+      node = node[(index >> level) & slot_mask]
+    return node
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return Vector([self[i] for i in range(*index.indices(self.size))])
+    if index < 0:
+      index += self.size
+    if not 0 <= index < self.size:
+      raise IndexError("vector index out of range")
+    if not self.root:
+      return self.tail[index]
+    return self.leaf(index)[index & slot_mask]
+
+  def __iter__(self):
+    if not self.root:
+      return iter(self.tail)
+    return itertools.chain.from_iterable(self.leaf(i) for i in range(0, self.size, width))
+
+  def __reversed__(self):
+    return reversed(list(self))
+
+  def conj(self, value):
+    """ Returns the vector with value added at the end """
+    size = self.size
+    if len(self.tail) < width:
+      return Vector.make(size + 1, self.shift, self.root, self.tail + [value])
+    # The tail is full: it becomes a leaf of the trie, which grows a level if its root is full as well
+    if (size >> bits) > (1 << self.shift):
+      root, shift = [self.root, new_path(self.shift, self.tail)], self.shift + bits
+    else:
+      root, shift = push_tail(size, self.shift, self.root, self.tail), self.shift
+    return Vector.make(size + 1, shift, root, [value])
+
+  def assoc(self, index, value):
+    """ Returns the vector with the element at index replaced, or value added at the end if index is its length """
+    if index < 0:
+      index += self.size
+    if index == self.size:
+      return self.conj(value)
+    if not 0 <= index < self.size:
+      raise IndexError("vector index out of range")
+    if index >= tail_offset(self.size):
+      tail = self.tail.copy()
+      tail[index & slot_mask] = value
+      return Vector.make(self.size, self.shift, self.root, tail)
+    return Vector.make(self.size, self.shift, assoc_in(self.shift, self.root, index, value), self.tail)
+
+  def __eq__(self, other):
+    if self is other:
+      return True
+    if not isinstance(other, (Vector, tuple, collections.abc.MutableSequence)):
+      return NotImplemented
+    return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+  def __hash__(self):
+    if self.hash_value is None:
+      self.hash_value = hash(tuple(self))
+    return self.hash_value
+
+  def __add__(self, other):
+    return Vector(itertools.chain(self, other))
+
+  def __reduce__(self):
+    return (Vector, (list(self),))
+
+  def __repr__(self):
+    return f"Vector({list(self)!r})"
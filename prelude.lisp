@@ -0,0 +1,4 @@
+;; The forms every global environment starts with, evaluated after the builtins are bound. lisp.py reads them from a snapshot in the source cache, so they aren't parsed on every start.
+
+(defmacro! defmemo (fn* (name params body) `(def! ~name (memoize (fn* ~params ~body)))))
+(defmacro! cond (fn* (& xs) (if (> (count xs) 0) (list 'if (first xs) (if (> (count xs) 1) (nth xs 1) (throw "odd number of forms to cond")) (cons 'cond (rest (rest xs)))))))
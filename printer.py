@@ -1,4 +1,9 @@
+import itertools, strings, sys
 from lisp_types import *
+from numeric import NumArray
+from lazy import LazySeq
+
+""" This file turns values back into text. Values are written piece by piece to a sink (any function taking a string, like the write method of a file), walking nested collections with an explicit stack instead of recursion, so printing a large or deeply nested structure never builds more than the pieces, and never hits the recursion limit. """
 
 def escape(strg):
   """ When printing readably, a few special characters need to be escaped. """
@@ -6,22 +11,101 @@ def escape(strg):
 
 def pr_str(ast, print_readably=True):
   """ Takes an abstract syntax tree and returns a printable string """
+  parts = []
+  pr_write(ast, parts.append, print_readably)
+  return ''.join(parts)
+
+def pr_write(ast, write, print_readably=True):
+  """ Writes the printable string of an abstract syntax tree to write, one piece at a time. Each collection being printed has a frame on the stack, holding an iterator over the elements it has left, the string that closes it, and whether an element has been written yet (to know when a separating space is needed). """
+  stack = []
+  while True:
+    cls = type(ast)
+    if cls in plain:
+      write(str(ast))
+    elif cls is str and print_readably:
+      write(f'"{escape(ast)}"')
+    else:
+      collection = brackets(ast)
+      if collection is None:
+        write(atom_str(ast, print_readably))
+      else:
+        opening, closing, elements = collection
+        write(opening)
+        stack.append([iter(elements), closing, False])
+
+    # Move on to the next element of the innermost collection that has one left, closing the ones that don't
+    while stack:
+      frame = stack[-1]
+      ast = next(frame[0], end)
+      if ast is not end:
+        if frame[2]:
+          write(' ')
+        frame[2] = True
+        break
+      write(frame[1])
+      stack.pop()
+    else:
+      return
+
+# Marks the end of the elements of a collection, as any value (None included) can be an element
+end = object()
+
+# Types whose printable string is simply str() of them
+plain = {int, float, Symbol, Keyword, Nil}
+
+def brackets(ast):
+  """ Returns the opening and closing strings of a collection, along with the elements to print between them, or None if the AST isn't a collection """
   if callable(ast) or isinstance(ast, Procedure):
-    return "#<function>"
-  elif isinstance(ast, List):
-    return f"({' '.join([pr_str(x, print_readably) for x in ast])})"
+    return None
+  elif isinstance(ast, (List, LazySeq)):
+    # Plain lists are iterated through their underlying Python list, which is much faster than UserList's indexing
+    return '(', ')', ast.data if type(ast) is List else ast
   elif isinstance(ast, Vector):
-    return f"[{' '.join([pr_str(x, print_readably) for x in ast])}]"
+    return '[', ']', ast
+  elif isinstance(ast, NumArray):
+    return '#a[', ']', ast
   elif isinstance(ast, Map):
-    return f"{{{' '.join([f'{pr_str(x, print_readably)} {pr_str(y, print_readably)}' for x, y in ast.items()])}}}"
+    return '{', '}', itertools.chain.from_iterable(ast.items())
+  return None
+
+def atom_str(ast, print_readably=True):
+  """ Returns the printable string of anything that isn't a collection """
+  if callable(ast) or isinstance(ast, Procedure):
+    return "#<function>"
   elif isinstance(ast, SForm):
     return str(ast)
   elif isinstance(ast, bool):
     return "true" if ast else "false"
+  elif isinstance(ast, (strings.StrView, strings.StringBuilder)):
+    # Views and builders print like the string they hold
+    return atom_str(str(ast), print_readably)
   elif isinstance(ast, str):
     if print_readably:
       return f'"{escape(ast)}"'
     else:
       return ast
   else:
-    return str(ast)
\ No newline at end of file
+    return str(ast)
+
+class Output:
+  """ Buffers what prn and println print to standard output. The buffer is written out once it holds limit characters, and whenever flush() is called: by the REPL before showing its prompt, when a program given on the command line stops (before its error, if any, is reported), and when the interpreter exits. """
+  limit = 1 << 16
+
+  def __init__(self):
+    self.parts = []
+    self.size = 0
+
+  def write(self, text):
+    self.parts.append(text)
+    self.size += len(text)
+    if self.size >= self.limit:
+      self.flush()
+
+  def flush(self):
+    if self.parts:
+      sys.stdout.write(''.join(self.parts))
+      self.parts = []
+      self.size = 0
+    sys.stdout.flush()
+
+output = Output()
@@ -0,0 +1,300 @@
+import environment, evaluator, printer, sys, time
+from collections import Counter
+from lisp_types import *
+from memo import Memoized, missing
+
+""" This file implements the profiler behind the --profile option and the profile special form. It attributes call counts and time to each named procedure and builtin, and counts special forms, tail calls, environment allocations and macro expansions. Apart from the compiler's call sites, which go through run_procedure() instead of entering procedures themselves while a profiler runs, the interpreter doesn't check whether it is being profiled: start() swaps the functions it needs to watch (the evaluate loop, the compiler's run_procedure, the stack machine's apply and special forms, calling a Procedure and the builtins in the global environment) for instrumented versions, and analyzes the bodies of the compiled procedures bound in the global environment again, so that their special forms are counted; stop() puts the originals back, so running without the profiler costs nothing. """
+
+# The running Profiler, if any
+current = None
+
+# Where stop() writes the profile as collapsed stacks (the input format of flame graph tools), if anywhere
+stacks_path = None
+
+# How many procedures the report lists
+limit = 30
+
+class Profiler:
+  """ Collects the measurements of a profiling run. Calls are kept on a stack of [name, start time, time spent in callees] entries, so that when a call ends, both its inclusive time and its exclusive time (without its callees) are known. """
+
+  def __init__(self):
+    self.stack = []
+    self.stats = dict() # Name -> [calls, inclusive time, exclusive time]
+    self.active = Counter() # How many calls of each name are on the stack, so recursive calls don't add to the inclusive time twice
+    self.stacks = Counter() # Collapsed stack -> exclusive time
+    self.forms = Counter()
+    self.tail_calls = 0
+    self.environments = 0
+    self.macro_hits = evaluator.macro_cache.hits
+    self.macro_misses = evaluator.macro_cache.misses
+    self.started = time.perf_counter()
+
+  def enter(self, name):
+    self.stack.append([name, time.perf_counter(), 0.0])
+    self.active[name] += 1
+
+  def leave(self):
+    path = ';'.join(frame[0] for frame in self.stack)
+    name, start, children = self.stack.pop()
+    elapsed = time.perf_counter() - start
+    stat = self.stats.get(name)
+    if stat is None:
+      stat = self.stats[name] = [0, 0.0, 0.0]
+    stat[0] += 1
+    stat[2] += elapsed - children
+    self.active[name] -= 1
+    if self.active[name] == 0:
+      stat[1] += elapsed
+    if self.stack:
+      self.stack[-1][2] += elapsed
+    self.stacks[path] += elapsed - children
+
+  def tail_call(self, name):
+    """ A call in tail position takes the place of the call it was made from """
+    self.tail_calls += 1
+    self.leave()
+    self.enter(name)
+
+  def report(self, file=sys.stderr):
+    total = time.perf_counter() - self.started
+    print(f"Profile: {total:.3f} s, {sum(stat[0] for stat in self.stats.values())} calls", file=file)
+    print(f"{'calls':>10} {'total s':>10} {'self s':>10}  name", file=file)
+    for name, (calls, inclusive, exclusive) in sorted(self.stats.items(), key=lambda item: -item[1][2])[:limit]:
+      print(f"{calls:>10} {inclusive:>10.4f} {exclusive:>10.4f}  {name}", file=file)
+    forms = ', '.join(f"{name} {count}" for name, count in self.forms.most_common())
+    print(f"Special forms: {forms or 'none'}", file=file)
+    print(f"Tail calls: {self.tail_calls}, environments: {self.environments}", file=file)
+    print(f"Macro expansions: {evaluator.macro_cache.misses - self.macro_misses} (reused: {evaluator.macro_cache.hits - self.macro_hits})", file=file)
+
+  def write_stacks(self, path):
+    """ Writes one "caller;callee;... microseconds" line per stack, which flamegraph.pl and speedscope read """
+    with open(path, 'w', encoding='UTF-8') as file:
+      for stack, seconds in self.stacks.items():
+        file.write(f"{stack} {round(seconds * 1e6)}\n")
+
+def name_of(proc):
+  if isinstance(proc, Memoized):
+    return name_of(proc.proc)
+  if isinstance(proc, Procedure):
+    return proc.name if proc.name is not None else f"(fn* {printer.pr_str(proc.params)})"
+  return getattr(proc, '__name__', 'builtin')
+
+# Starting and stopping
+
+def start(env):
+  """ Starts profiling. Env is any environment; the builtins of the global one it is nested in get wrapped while profiling runs. """
+  global current
+  # The compiler engine and the stack machine are only imported here, as they are patched too, so that running with another engine doesn't load them
+  import compiler, machine
+  while env.outer is not None:
+    env = env.outer
+  current = Profiler()
+  current.env = env
+  current.originals = (evaluator.evaluate, evaluator.Env, compiler.run_procedure, Procedure.__call__, machine.apply, machine.special_forms, machine.Env)
+  current.builtins = dict()
+  current.patched = []
+  reanalyzed = set()
+  for key, value in env.data.items():
+    proc = value.proc if isinstance(value, Memoized) else value
+    if isinstance(proc, Procedure) and proc.code is not None and id(proc) not in reanalyzed:
+      # The bodies of compiled procedures were analyzed before the profiler ran, so they are analyzed again for their special forms to be counted
+      reanalyzed.add(id(proc))
+      current.patched.append((proc, 'code', proc.code))
+      proc.code = compiler.analyze_entry(proc.params, proc.ast, proc.scope, proc.base)
+    if isinstance(value, (Memoized, AsyncBuiltin)):
+      # The engines treat these in ways of their own, so they stay in place, and the function they hold is timed instead (procedures are reported anyway)
+      attribute = 'proc' if isinstance(value, Memoized) else 'func'
+      inner = getattr(value, attribute)
+      if not isinstance(inner, Procedure) and not hasattr(inner, '__wrapped__'):
+        current.patched.append((value, attribute, inner))
+        setattr(value, attribute, timed(str(key), inner))
+    elif callable(value) and not isinstance(value, Procedure):
+      current.builtins[key] = value
+      env.data[key] = timed(str(key), value)
+  evaluator.evaluate = evaluate
+  evaluator.Env = Environment
+  compiler.run_procedure = run_procedure
+  Procedure.__call__ = call_procedure
+  machine.apply = machine_apply
+  machine.special_forms = {name: count_machine_form(name, form) for name, form in machine.special_forms.items()}
+  machine.Env = Environment
+  current.enter('<toplevel>')
+
+def stop():
+  """ Stops profiling, prints the report and writes the collapsed stacks """
+  global current
+  import compiler, machine
+  profile, current = current, None
+  while profile.stack:
+    profile.leave()
+  evaluator.evaluate, evaluator.Env, compiler.run_procedure, Procedure.__call__, machine.apply, machine.special_forms, machine.Env = profile.originals
+  for key, value in profile.builtins.items():
+    # Builtins redefined while profiling keep their new value
+    if getattr(profile.env.data.get(key), '__wrapped__', None) is value:
+      profile.env.data[key] = value
+  for obj, attribute, value in profile.patched:
+    setattr(obj, attribute, value)
+  profile.report()
+  if stacks_path is not None:
+    profile.write_stacks(stacks_path)
+
+# The instrumented versions of the functions start() swaps
+
+def evaluate(ast, env):
+  """ evaluator.evaluate(), reporting to the profiler. Entering a procedure's body counts as a call to it, which lasts until this function returns, or until a tail call replaces it. """
+  profile = current
+  entered = False
+  pending = None
+  try:
+    while True:
+      ast = evaluator.macroexpand(ast, env)
+      if not isinstance(ast, List):
+        value = evaluator.eval_ast(ast, env)
+        break
+      if len(ast) == 0:
+        value = ast
+        break
+      form = evaluator.special_forms.get(ast[0]) if isinstance(ast[0], Symbol) else None
+      if form is not None:
+        profile.forms[ast[0]] += 1
+        ast, env = form(ast, env)
+        if env is None:
+          value = ast
+          break
+        continue
+      evaluated = evaluator.eval_ast(ast, env)
+      proc, args = evaluated[0], evaluated[1:]
+      if type(proc) is Memoized and isinstance(proc.proc, Procedure) and proc.proc.code is None:
+        key = proc.key(args)
+        value = proc.lookup(key)
+        if value is not missing:
+          break
+        pending = [] if pending is None else pending
+        pending.append((proc, key))
+        proc = proc.proc
+      if isinstance(proc, Procedure) and proc.code is None:
+        if entered:
+          profile.tail_call(name_of(proc))
+        else:
+          profile.enter(name_of(proc))
+          entered = True
+        ast = proc.ast
+        env = proc.make_env(Environment, args)
+        continue
+      elif callable(proc):
+        value = proc(*args)
+        break
+      else:
+        raise SyntaxError("First element of list is not a function.")
+  finally:
+    if entered:
+      profile.leave()
+  if pending is not None:
+    for memo, key in reversed(pending):
+      memo.store(key, value)
+  return value
+
+def run_procedure(proc, args):
+  """ compiler.run_procedure(), reporting each procedure it runs to the profiler """
+  import compiler
+  profile = current
+  profile.enter(name_of(proc))
+  pending = None
+  try:
+    while True:
+      profile.environments += 1
+      result = proc.code(proc.env, args)
+      if type(result) is not compiler.TailCall:
+        break
+      proc, args = result.proc, result.args
+      profile.tail_call(name_of(proc))
+      if type(proc) is Memoized:
+        memo = proc
+        key = memo.key(args)
+        result = memo.lookup(key)
+        if result is not missing:
+          break
+        proc = memo.proc
+        if not isinstance(proc, Procedure) or proc.code is None:
+          result = proc(*args)
+          memo.store(key, result)
+          break
+        pending = [] if pending is None else pending
+        pending.append((memo, key))
+  finally:
+    profile.leave()
+  if pending is not None:
+    for memo, key in reversed(pending):
+      memo.store(key, result)
+  return result
+
+def call_procedure(self, *args):
+  """ Procedure.__call__(), for procedures called from Python (by builtins like map, or by macro expansion). Compiled procedures are reported by run_procedure(). """
+  if self.code is not None:
+    return self.fn(*args)
+  current.enter(name_of(self))
+  try:
+    return self.fn(*args)
+  finally:
+    current.leave()
+
+class Environment(environment.Environment):
+  """ Counts the environments the evaluator creates """
+  def __init__(self, *args, **kwargs):
+    current.environments += 1
+    super().__init__(*args, **kwargs)
+
+def machine_apply(values, stack):
+  """ machine.apply(), reporting the procedures the machine enters to the profiler. As the machine has no Python frame per call, a call lasts until the frame pushed under its body gets the body's value. A call made in tail position, which finds the frame of the call it was made from on top of the stack, takes the place of that call instead. """
+  profile = current
+  apply = profile.originals[4]
+  func = values[0]
+  proc = func.proc if type(func) is Memoized else func
+  if not isinstance(proc, Procedure) or proc.code is not None:
+    return apply(values, stack)
+  tail = bool(stack) and stack[-1][0] is leave_call
+  if tail:
+    profile.tail_call(name_of(proc))
+  else:
+    profile.enter(name_of(proc))
+  ast, env = apply(values, stack)
+  if env is None:
+    # The value is already known: it was remembered, or the procedure's fast path computed it (see jit.py)
+    if not tail:
+      profile.leave()
+  elif not tail:
+    stack.append([leave_call])
+  return ast, env
+
+def leave_call(frame, value, stack):
+  current.leave()
+  return value, None
+
+def count_machine_form(name, form):
+  """ Wraps the handler of a special form of the stack machine, to count how many times it runs """
+  def counted(ast, env, stack):
+    current.forms[name] += 1
+    return form(ast, env, stack)
+  return counted
+
+def timed(name, func):
+  """ Wraps a builtin so that calls to it are reported to the profiler """
+  def call(*args):
+    current.enter(name)
+    try:
+      return func(*args)
+    finally:
+      current.leave()
+  call.__wrapped__ = func
+  return call
+
+def count_form(name, closure):
+  """ Wraps the closure of a special form analyzed by the compiler while profiling, to count how many times it runs. let* frames are counted as environments here, as the compiler creates them without going through a function that could be swapped. """
+  let = name is Symbol('let*')
+  def counted(env):
+    if current is not None:
+      current.forms[name] += 1
+      if let:
+        current.environments += 1
+    return closure(env)
+  return counted
@@ -1,141 +1,207 @@
-import re
+import mmap, numeric, printer, re
 from lisp_types import *
 
-# Magic regex that breaks a string apart in tokens, according to the language's syntax
-token_pattern = re.compile(r'(?=.)[\s,]*(~@|[\[\]{}()\'`~^@]|"(?:\\.|[^\\"])*"?|;.*|[^\s\[\]{}(\'"`,;)]*)')
+""" This file turns source code into abstract syntax trees. The lexer breaks the source apart into typed tokens in a single pass of one precompiled regular expression: the group of the expression a token matched tells what kind of token it is, so atoms are turned into their values right away, without trying one kind of value after another. Whitespace, commas and comments are matched too, but never turned into tokens. The parser then builds forms out of the tokens, looking at nothing but their kinds. """
+
+# The characters that end a symbol, number or keyword
+delimiters = r'\s\[\]{}(\'"`,;)'
+atom_char = f'[^{delimiters}]'
+atom_end = f'(?!{atom_char})'
+
+# The patterns of the atoms whose values can be read right away. A number or keyword followed by more of a symbol's characters is a symbol.
+int_pattern = r'[+-]?\d+' + atom_end
+float_pattern = r'[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?' + atom_end
+string_pattern = r'"(?:\\.|[^\\"])*"'
+keyword_pattern = Keyword.pattern.pattern + atom_end
+
+# Magic regex that breaks a string apart in tokens, according to the language's syntax. Each group is a kind of token, numbered in the order below, and the first alternative (which has no group) is what is skipped.
+token_source = (
+  r'[\s,]+|;[^\n]*'
+  r'|([(\[{])'
+  r'|([)\]}])'
+  r'|(~@|[\'`~@^])'
+  rf'|({int_pattern})'
+  rf'|({float_pattern})'
+  rf'|({string_pattern})'
+  r'|(")'
+  rf'|({keyword_pattern})'
+  rf'|(#a){atom_end}'
+  rf'|({atom_char}+)'
+)
+
+# The kinds of tokens, which are the numbers of their groups in the pattern
+OPEN, CLOSE, PREFIX, INT, FLOAT, STRING, UNTERMINATED, KEYWORD, ARRAY, SYMBOL = range(1, 11)
+atom_kinds = {INT, FLOAT, STRING, KEYWORD, SYMBOL}
+
+# The kind of the tokens the lexer yields for atoms, whose values it has already read
+ATOM = 0
+
+# Vectors and maps holding nothing but literals (numbers, strings, keywords, nil and booleans) are matched as a whole, and built straight from their elements, without going through the parser. The elements of a vector of nothing but integers, or nothing but floats (written with a decimal point or an exponent), are converted all at once.
+literal = rf'(?:{int_pattern}|{float_pattern}|{string_pattern}|{keyword_pattern}|(?:nil|true|false){atom_end})'
+pure_float = r'[+-]?(?:(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+)' + atom_end
+literal_sources = {
+  '[': [(int, rf'\[(?:[\s,]*{int_pattern})*[\s,]*\]'), (float, rf'\[(?:[\s,]*{pure_float})*[\s,]*\]'), (Vector, rf'\[(?:[\s,]*{literal})*[\s,]*\]')],
+  '{': [(Map, rf'\{{(?:[\s,]*{literal})*[\s,]*\}}')],
+}
+
+def compile_patterns(encode):
+  """ Compiles the patterns the lexer uses, for strings (given str) or for bytes (given str.encode) """
+  return {
+    'token': re.compile(encode(token_source)),
+    'element': re.compile(encode(r'[^\s,]+')),
+    'literals': {opening: [(kind, re.compile(encode(source))) for kind, source in sources] for opening, sources in literal_sources.items()},
+  }
+
+# The patterns for strings and for bytes, each compiled the first time it is needed, as compiling them takes a while, and a run reading all its files from the source cache doesn't lex anything
+compiled = dict()
+
+def get_patterns(binary):
+  patterns = compiled.get(binary)
+  if patterns is None:
+    patterns = compiled[binary] = compile_patterns(str.encode if binary else str)
+  return patterns
 
 # Some values that are treated in special ways
-unique_values = {"nil": Nil(), "true": True, "false": False, "&": SForm("&")}
-
-class Reader:
-  """ Internally holds a sequence of tokens and a cursor that points to one of them """
-  def __init__(self, tokens):
-    self.position = 0
-    self.tokens = tokens
-
-  def next(self):
-    """ Return the current token, and move the cursor to the next one """
-    if self.position == len(self.tokens):
-      return None
-    result = self.tokens[self.position]
-    self.position += 1
-    return result
-
-  def peek(self):
-    """ Return the current token """
-    if self.position == len(self.tokens):
-      return None
-    return self.tokens[self.position]
+unique_values = {"nil": nil, "true": True, "false": False, "&": SForm("&")}
+
+# The symbols the prefix characters stand for: 'x reads as (quote x), and so on
+prefixes = {"'": Symbol('quote'), '`': Symbol('quasiquote'), '~': Symbol('unquote'), '~@': Symbol('splice-unquote'), '@': Symbol('deref')}
+
+closing = {'(': ')', '[': ']', '{': '}'}
+
+def atom_value(kind, text):
+  """ Returns the value of an atom token """
+  if kind == INT:
+    return int(text)
+  if kind == FLOAT:
+    return float(text)
+  if kind == STRING:
+    return unescape(text[1:-1])
+  if kind == KEYWORD:
+    return Keyword(text)
+  value = unique_values.get(text)
+  return Symbol(text) if value is None else value
+
+def lex(data, binary=False):
+  """ Generator that yields the tokens of a string (or, if binary is true, of bytes) as (kind, value) pairs. The value of an atom is what it reads as, the value of any other token is its text. """
+  patterns = get_patterns(binary)
+  match_token = patterns['token'].match
+  literals = patterns['literals']
+  position, end = 0, len(data)
+  while position < end:
+    match = match_token(data, position)
+    position = match.end()
+    kind = match.lastindex
+    if kind is None:
+      continue
+    text = match.group(kind)
+    if binary:
+      text = text.decode('utf-8')
+    if kind == OPEN and text != '(':
+      value, literal_end = read_literal(data, match.start(), literals[text], patterns, binary)
+      if value is not None:
+        position = literal_end
+        yield ATOM, value
+        continue
+    yield (ATOM, atom_value(kind, text)) if kind in atom_kinds else (kind, text)
+
+def read_literal(data, start, candidates, patterns, binary):
+  """ Builds the vector or map of literals starting at start, and returns it along with where it ends, or returns None if there is no such literal there (or it is a map with an odd number of elements, which the parser then reports) """
+  for kind, pattern in candidates:
+    match = pattern.match(data, start)
+    if match is not None:
+      break
+  else:
+    return None, None
+  if kind is int or kind is float:
+    return Vector(map(kind, patterns['element'].findall(data, start + 1, match.end() - 1))), match.end()
+  elements = []
+  for token in patterns['token'].finditer(data, start + 1, match.end() - 1):
+    group = token.lastindex
+    if group is not None:
+      text = token.group(group)
+      elements.append(atom_value(group, text.decode('utf-8') if binary else text))
+  if kind is Vector:
+    return Vector(elements), match.end()
+  if len(elements) % 2:
+    return None, None
+  return Map(dict(zip(elements[::2], elements[1::2]))), match.end()
 
 def read_str(data):
   """ Takes string input and returns an abstract syntax tree """
-  tokens = tokenize(data)
-  if len(tokens) == 0:
+  tokens = lex(data)
+  token = next(tokens, None)
+  if token is None:
     raise BlankLine("Blank line")
   try:
-    return read_form(Reader(tokens))
+    return read_form(token, tokens)
   except SyntaxError as error:
-    print(error)
-
-def tokenize(data):
-  """ Breaks the input string apart into tokens """
-  return re.findall(token_pattern, data)
-
-def read_form(reader):
-  """ Parses a sequence of tokens according to the language's syntax, and returns the resulting abstract syntax tree """
-  while True:
-    token = reader.peek()
-    if token[0] == ';':
-      reader.next()
-      continue
-    elif token == '(':
-      return read_list(reader)
-    elif token == '[':
-      return read_vector(reader)
-    elif token == '{':
-      return read_map(reader)
-    elif token == '\'':
-      reader.next()
-      return List([Symbol('quote'), read_form(reader)])
-    elif token == '`':
-      reader.next()
-      return List([Symbol('quasiquote'), read_form(reader)])
-    elif token == '~':
-      reader.next()
-      return List([Symbol('unquote'), read_form(reader)])
-    elif token == '~@':
-      reader.next()
-      return List([Symbol('splice-unquote'), read_form(reader)])
-    elif token == '@':
-      reader.next()
-      return List([Symbol('deref'), read_form(reader)])
-    elif token == '^':
-      reader.next()
-      form1 = read_form(reader)
-      form2 = read_form(reader)
-      return List([Symbol('with-meta'), form2, form1])
-    else:
-      return read_atom(reader)
+    # Reported through the output buffer, so that it comes out in order with what the program printed
+    printer.output.write(f"{error}\n")
 
-def read_atom(reader):
-  """ Figures out what kind of an atomic value is represented by a string token """
-  atom = reader.next()
-  try:
-    return int(atom)
-  except (TypeError, ValueError) as err:
+def lex_file(path):
+  """ Generator that yields the tokens of a source file one at a time. The file is memory mapped and scanned in place, so neither its contents nor its tokens are ever held in memory all at once. """
+  with open(path, 'rb') as file:
     try:
-      return float(atom)
-    except (TypeError, ValueError) as err:
-      if atom in unique_values:
-        return unique_values[atom]
-      try:
-        return parse_str(atom)
-      except ValueError as err:
-        if atom[0] == '"':
-          raise SyntaxError("Expected \", got EOF.")
-        try:
-          return Keyword(atom)
-        except ValueError as err:
-          try:
-            return Symbol(atom)
-          except ValueError as err:
-            raise SyntaxError("Error parsing or unexpected EOF.")
-
-# The following three methods deal with parsing sequences. Notice the call to read_form on each token. This is what enables sequences to be nested inside each other. It's what puts the "tree" in abstract syntax tree.
-
-def read_list(reader):
-  """ Consume tokens from the reader and generate a List """
-  result = List()
-  reader.next() # drop the opening paranthesis
-  while reader.peek() != ")":
-    if reader.peek() is None:
-      raise SyntaxError("Unexpected EOF while parsing.")
-    result.append(read_form(reader))
-  reader.next() # drop the closing paranthesis
-  return result
-
-def read_vector(reader):
-  """ Consume tokens from the reader and generate a Vector """
-  result = Vector()
-  reader.next() # drop the opening square bracket
-  while reader.peek() != "]":
-    if reader.peek() is None:
-      raise SyntaxError("Unexpected EOF while parsing.")
-    result.append(read_form(reader))
-  reader.next() # drop the closing square bracket
-  return result
-
-def read_map(reader):
-  """ Consume tokens from the reader and generate a Vector """
-  result = Map()
-  reader.next() # drop the opening curly brace
-  while reader.peek() != "}":
-    if reader.peek() is None:
-      raise SyntaxError("Unexpected EOF while parsing.")
-    key = read_form(reader)
-    value = read_form(reader)
-    if value == '}' or value is None:
-      raise SyntaxError("Error parsing map literal.")
-    result[key] = value
-  reader.next() # drop the closing curly brace
-  return result
\ No newline at end of file
+      data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+      # Empty files and things like pipes can't be mapped, so they are read instead
+      data = file.read()
+    yield from lex(data, True)
+
+def read_file(path):
+  """ Generator that yields the top level forms of a source file one at a time. Each form is only parsed when the previous one has been consumed, so forms can be evaluated as the file streams in. """
+  tokens = lex_file(path)
+  for token in tokens:
+    yield read_form(token, tokens)
+
+def read_next(tokens):
+  """ Parses the form the next tokens make up """
+  token = next(tokens, None)
+  if token is None:
+    raise SyntaxError("Unexpected EOF while parsing.")
+  return read_form(token, tokens)
+
+def read_form(token, tokens):
+  """ Parses the form that starts with token, and goes on with the tokens after it, according to the language's syntax, and returns the resulting abstract syntax tree """
+  kind, value = token
+  if kind == ATOM:
+    return value
+  elif kind == OPEN:
+    return read_sequence(value, tokens)
+  elif kind == PREFIX:
+    if value == '^':
+      form1 = read_next(tokens)
+      form2 = read_next(tokens)
+      return List([Symbol('with-meta'), form2, form1])
+    return List([prefixes[value], read_next(tokens)])
+  elif kind == ARRAY:
+    # A numeric array literal is written as a vector prefixed with #a
+    return numeric.make_array(read_next(tokens))
+  elif kind == UNTERMINATED:
+    raise SyntaxError("Expected \", got EOF.")
+  else:
+    raise SyntaxError(f"Unexpected {value} while parsing.")
+
+# Sequences are parsed by calling read_form on each token that isn't an atom. This is what enables sequences to be nested inside each other. It's what puts the "tree" in abstract syntax tree.
+
+def read_sequence(opening, tokens):
+  """ Consume tokens up to the closing parenthesis, bracket or brace matching opening, and generate a List, Vector or Map """
+  items = []
+  for token in tokens:
+    kind, value = token
+    if kind == ATOM:
+      items.append(value)
+    elif kind == CLOSE:
+      if value != closing[opening]:
+        raise SyntaxError(f"Expected {closing[opening]}, got {value} while parsing.")
+      if opening == '(':
+        return rebuild(List, items)
+      if opening == '[':
+        return Vector(items)
+      if len(items) % 2:
+        raise SyntaxError("Error parsing map literal.")
+      return Map(dict(zip(items[::2], items[1::2])))
+    else:
+      items.append(read_form(token, tokens))
+  raise SyntaxError("Unexpected EOF while parsing.")
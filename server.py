@@ -0,0 +1,146 @@
+import argparse, gc, io, json, os, select, signal, socket, sys, time
+
+""" This file implements the eval server, and the client that talks to it. Started with lisp.py --serve SOCKET, the interpreter builds its global environment and loads the --preload files once, then listens on a Unix domain socket. Each request (a source file to run, or an expression) is handled in a child forked from the server, which starts with the warm environment already in memory, shared copy-on-write with the server, and runs the request in it. Nothing a request does (definitions included) outlives its child, so requests are isolated from each other. The child replies with what the request printed and the printed value of its last form.
+
+Requests and replies are JSON objects, sent as a single line. A request holds either "file" or "code", along with "argv" (bound to *ARGV*), "cwd" (the directory to run in) and optionally "timeout" in seconds. A reply holds "stdout", "stderr", "result" (null if the request failed) and "error" (null unless it failed). """
+
+# How many requests run at the same time, and how many seconds one can run for at most
+default_jobs = 4
+default_timeout = 60.0
+
+# How long the server gives a child to reply on its own once its time is up, before killing it
+grace = 1.0
+
+# How often the server checks on its children while it waits for requests, in seconds
+poll_interval = 0.05
+
+def serve(path, run, jobs=None, timeout=None):
+  """ Serves requests on the Unix domain socket at path until interrupted. run(request) runs a request in the child forked for it, and returns the printed result. Jobs and timeout default to the values above. """
+  jobs = jobs or default_jobs
+  timeout = timeout or default_timeout
+  if os.path.exists(path):
+    os.unlink(path)
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  listener.bind(path)
+  listener.listen(64)
+  # Moving everything built so far out of the garbage collector's reach keeps the children from writing to (and so copying) the pages it lives in
+  gc.freeze()
+  # Being terminated shuts the server down cleanly, like an interrupt does
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  print(f"Serving on {path} ({jobs} jobs, {timeout:g} s timeout)", file=sys.stderr)
+  children = dict() # pid -> when to kill it
+  try:
+    while True:
+      reap(children)
+      if len(children) >= jobs:
+        # Pending connections wait in the listen backlog until a child is done
+        time.sleep(poll_interval)
+        continue
+      ready, _, _ = select.select([listener], [], [], poll_interval)
+      if not ready:
+        continue
+      conn, _ = listener.accept()
+      pid = os.fork()
+      if pid == 0:
+        listener.close()
+        handle(conn, run, timeout)
+      conn.close()
+      children[pid] = time.monotonic() + timeout + grace
+  except KeyboardInterrupt:
+    pass
+  finally:
+    listener.close()
+    os.unlink(path)
+    for pid in children:
+      os.kill(pid, signal.SIGKILL)
+
+def reap(children):
+  """ Collects the children that are done, and kills the ones that overran their timeout """
+  while children:
+    try:
+      pid, _ = os.waitpid(-1, os.WNOHANG)
+    except ChildProcessError:
+      children.clear()
+      return
+    if pid == 0:
+      break
+    children.pop(pid, None)
+  now = time.monotonic()
+  for pid, deadline in list(children.items()):
+    if now > deadline:
+      os.kill(pid, signal.SIGKILL)
+      children[pid] = float('inf')
+
+def handle(conn, run, timeout):
+  """ Runs in the child forked for a connection: reads the request, runs it with stdout and stderr captured, sends the reply, and exits """
+  status = 0
+  try:
+    with conn, conn.makefile('rb') as file:
+      request = json.loads(file.readline())
+      reply = {'result': None, 'error': None}
+      sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+      limit = min(float(request.get('timeout') or timeout), timeout)
+      signal.signal(signal.SIGALRM, time_out)
+      signal.setitimer(signal.ITIMER_REAL, limit)
+      try:
+        reply['result'] = run(request)
+      except Exception as error:
+        reply['error'] = f"{type(error).__name__}: {error}"
+      finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+      reply['stdout'], reply['stderr'] = sys.stdout.getvalue(), sys.stderr.getvalue()
+      conn.sendall(json.dumps(reply).encode() + b'\n')
+  except Exception:
+    status = 1
+  finally:
+    # Exiting right away skips the server's cleanup, which isn't the child's to run
+    os._exit(status)
+
+def time_out(signum, frame):
+  raise TimeoutError("the request ran out of time")
+
+# The client
+
+def request(path, message):
+  """ Sends a request to the server listening at path, and returns its reply """
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+    conn.connect(path)
+    conn.sendall(json.dumps(message).encode() + b'\n')
+    with conn.makefile('rb') as file:
+      line = file.readline()
+  if not line:
+    raise RuntimeError("the server closed the connection without replying (the request was killed after its timeout)")
+  return json.loads(line)
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs a source file or an expression on an eval server started with lisp.py --serve. Options have to come before the socket, everything after the source file ends up in *ARGV*.')
+  parser.add_argument('socket', help='path of the server\'s socket')
+  parser.add_argument('-e', '--eval', metavar='CODE', help='evaluate CODE instead of a source file, and print its value')
+  parser.add_argument('--result', action='store_true', help='also print the value of the last form of the source file')
+  parser.add_argument('--timeout', type=float, help='seconds the request may run for (the server\'s own limit still applies)')
+  parser.add_argument('file', nargs='?', help='source file to execute')
+  parser.add_argument('argv', nargs=argparse.REMAINDER, help='arguments passed to the program as *ARGV*')
+  options = parser.parse_args()
+  if (options.file is None) == (options.eval is None):
+    parser.error('give either a source file or --eval')
+
+  message = {'argv': options.argv, 'cwd': os.getcwd(), 'timeout': options.timeout}
+  if options.eval is not None:
+    message['code'] = options.eval
+  else:
+    message['file'] = os.path.abspath(options.file)
+  try:
+    reply = request(options.socket, message)
+  except (OSError, RuntimeError) as error:
+    print(error, file=sys.stderr)
+    sys.exit(2)
+  sys.stdout.write(reply['stdout'])
+  sys.stderr.write(reply['stderr'])
+  if reply['error'] is not None:
+    print(reply['error'], file=sys.stderr)
+    sys.exit(1)
+  if options.eval is not None or options.result:
+    print(reply['result'])
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,171 @@
+import gc, itertools, os, pickle, reader, time
+
+""" This file implements an on-disk cache of parsed source files, in the spirit of Python's .pyc files. The first time load-file reads a file, the forms it parses are pickled to a cache file in batches as they are read; the next time, they are unpickled from there instead of tokenizing and parsing the source again. Cache files live in a __lispcache__ directory next to the source, or in the directory set below. """
+
+# Changing the header's magic string invalidates every existing cache file, which is needed whenever the layout of the pickled types changes
+magic = b'LISPCACHE\x04\n'
+
+# Whether load-file uses the cache at all, and where cache files are kept (None means next to each source file)
+enabled = True
+directory = None
+
+# hashlib is imported by the functions that use it, as importing it is a noticeable part of the interpreter's startup, and a cache hit doesn't need it
+
+def cache_path(path):
+  """ Returns the path of the cache file for a source file """
+  path = os.path.abspath(path)
+  if directory is None:
+    folder, name = os.path.split(path)
+    return os.path.join(folder, '__lispcache__', name + 'c')
+  # In a shared cache directory the name has to be derived from the whole path of the source
+  import hashlib
+  return os.path.join(directory, hashlib.sha1(path.encode()).hexdigest() + '.lispc')
+
+def content_hash(path):
+  """ Hashes the contents of a file, reading it in blocks """
+  import hashlib
+  digest = hashlib.sha1()
+  with open(path, 'rb') as file:
+    for block in iter(lambda: file.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+def load(path):
+  """ Returns an iterator over the forms cached for a source file, or None if there is no valid cache entry. An entry is valid if the source's modification time and size are the ones recorded in it, or failing that, if the source's contents still hash to the recorded value. The forms are unpickled a batch at a time, as they are consumed. """
+  try:
+    stat = os.stat(path)
+    file = open(cache_path(path), 'rb')
+  except OSError:
+    return None
+  try:
+    if file.read(len(magic)) == magic:
+      header = pickle.load(file)
+      if (header['mtime'], header['size']) == (stat.st_mtime_ns, stat.st_size) or header['hash'] == content_hash(path):
+        return unpickle_forms(file)
+  except cache_errors:
+    pass
+  file.close()
+  return None
+
+# What can go wrong reading a cache file that is missing, truncated or otherwise unreadable, which is just a cache miss
+cache_errors = (OSError, EOFError, pickle.UnpicklingError, KeyError, AttributeError, TypeError)
+
+# Forms are pickled in batches of this many, which keeps what is held in memory bounded, while letting the forms of a batch share the symbols and keywords they use, which pickling each form on its own would repeat
+batch_size = 1024
+
+# Written after the last batch of a cache file, so that a truncated file can be told apart from a complete one
+end = None
+
+def unpickle_forms(file):
+  """ Generator that yields the forms pickled in a cache file, batch by batch, up to the end marker """
+  with file:
+    while True:
+      # Unpickling creates lots of containers and nothing to collect, so the garbage collector would only slow it down
+      gc.disable()
+      try:
+        forms = pickle.load(file)
+      finally:
+        gc.enable()
+      if forms is end:
+        return
+      yield from forms
+
+def store(path, forms):
+  """ Generator that passes on the forms it is given, and writes them to the cache file of a source file in batches as they go through, so they are never all held at once. The file is written under a temporary name and moved in place once the last form is written, so a reader never sees a partially written one; if the forms stop coming (because of a syntax error, or because the consumer stopped), the temporary file is removed. Failing to write the cache isn't an error. """
+  target = cache_path(path)
+  temp = f"{target}.{os.getpid()}.tmp"
+  file = None
+  try:
+    try:
+      stat = os.stat(path)
+      header = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': content_hash(path)}
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      file = open(temp, 'wb')
+      file.write(magic)
+      pickle.dump(header, file, pickle.HIGHEST_PROTOCOL)
+    except OSError:
+      file = discard(file, temp)
+    pending = []
+    for form in forms:
+      if file is not None:
+        pending.append(form)
+        if len(pending) == batch_size:
+          file = write_batch(file, temp, pending)
+          pending = []
+      yield form
+    if file is not None and pending:
+      file = write_batch(file, temp, pending)
+    if file is not None:
+      try:
+        pickle.dump(end, file, pickle.HIGHEST_PROTOCOL)
+        file.close()
+        os.replace(temp, target)
+        file = None
+      except OSError:
+        pass
+  finally:
+    discard(file, temp)
+
+def write_batch(file, temp, forms):
+  """ Pickles a batch of forms to a cache file being written, and returns the file, or None if it had to be given up """
+  try:
+    pickle.dump(forms, file, pickle.HIGHEST_PROTOCOL)
+    return file
+  except (OSError, pickle.PicklingError, RecursionError):
+    return discard(file, temp)
+
+def discard(file, temp):
+  """ Closes and removes a cache file that won't be completed, if there is one, and returns None """
+  if file is not None:
+    file.close()
+    try:
+      os.remove(temp)
+    except OSError:
+      pass
+  return None
+
+def clear(path):
+  """ Removes the cache file of a source file, if there is one """
+  try:
+    os.remove(cache_path(path))
+  except FileNotFoundError:
+    pass
+
+def read_forms(path, cached=None):
+  """ Generator that yields the top level forms of a source file, from its cache file if it has a valid one. Otherwise the forms are streamed from the source as usual, and written to the cache file as they are read. Cached overrides whether the cache is used at all, which otherwise depends on enabled. """
+  if not (enabled if cached is None else cached):
+    yield from reader.read_file(path)
+    return
+  forms = load(path)
+  done = 0
+  if forms is not None:
+    try:
+      for form in forms:
+        done += 1
+        yield form
+      return
+    except cache_errors:
+      # The cache file turned out to be damaged after its header, so it is written again, and the source takes over after the forms already read
+      pass
+  yield from itertools.islice(store(path, reader.read_file(path)), done, None)
+
+def report(path):
+  """ Prints how long it takes to get the forms of a source file without the cache, and with it """
+  start = time.perf_counter()
+  forms = list(reader.read_file(path))
+  cold = time.perf_counter() - start
+  for _ in store(path, forms):
+    pass
+  start = time.perf_counter()
+  cached = load(path)
+  if cached is not None:
+    for _ in cached:
+      pass
+  warm = time.perf_counter() - start
+  if cached is None:
+    print(f"{path}: could not write the cache file {cache_path(path)}")
+    return
+  print(f"{path}: {len(forms)} forms")
+  print(f"  cold (tokenize and parse): {cold * 1000:.2f} ms")
+  print(f"  warm (load {cache_path(path)}): {warm * 1000:.2f} ms")
+  print(f"  speedup: {cold / warm:.1f}x" if warm > 0 else "  speedup: n/a")
@@ -0,0 +1,174 @@
+from lisp_types import *
+import printer
+
+""" This file implements the string builder, substring views, and the builtins that work on text. Python strings are immutable, so building a string by adding pieces to it one at a time, or walking it by taking a shorter string at each step, copies it every time, which takes time quadratic in its length. A StringBuilder keeps the pieces appended to it and joins them once, when its contents are needed; a StrView is a substring that refers to the string it was taken from instead of copying it. Both print like the strings they hold, and views compare and hash like them, so they can be used in their place (as map keys, for instance). """
+
+class StringBuilder:
+  """ A mutable string, built by appending to it. Appending adds the piece to a list, and the pieces are joined (and replaced by the result) only when the contents are asked for. """
+  __slots__ = ('parts', 'size')
+
+  def __init__(self):
+    self.parts = []
+    self.size = 0
+
+  def append(self, text):
+    self.parts.append(text)
+    self.size += len(text)
+
+  def __str__(self):
+    if len(self.parts) > 1:
+      self.parts[:] = [''.join(self.parts)]
+    return self.parts[0] if self.parts else ''
+
+  def __len__(self):
+    return self.size
+
+  def __reduce__(self):
+    return (build, (str(self),))
+
+def build(text):
+  builder = StringBuilder()
+  builder.append(text)
+  return builder
+
+class StrView:
+  """ The characters of source between start and stop, without copying them. Slicing a view returns another view of the same source, so walking a string by taking its rest or dropping its last character costs nothing per step. The substring is materialized (copied into a string of its own) when something needs it as a Python string, and the copy is remembered. """
+  __slots__ = ('source', 'start', 'stop', 'text')
+
+  def __init__(self, source, start, stop):
+    self.source = source
+    self.start = start
+    self.stop = stop
+    self.text = None
+
+  def __str__(self):
+    if self.text is None:
+      self.text = self.source[self.start:self.stop]
+    return self.text
+
+  def __len__(self):
+    return self.stop - self.start
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      start, stop, step = index.indices(len(self))
+      if step != 1:
+        return str(self)[index]
+      return StrView(self.source, self.start + start, self.start + max(start, stop))
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("string index out of range")
+    return self.source[self.start + index]
+
+  def __iter__(self):
+    return iter(str(self))
+
+  def __eq__(self, other):
+    if isinstance(other, str):
+      # Compared in place, without materializing the view
+      return len(other) == len(self) and self.source.startswith(other, self.start, self.stop)
+    if isinstance(other, StrView):
+      return str(self) == str(other)
+    return NotImplemented
+
+  def __hash__(self):
+    return hash(str(self))
+
+  def __lt__(self, other):
+    return str(self) < as_str(other)
+
+  def __le__(self, other):
+    return str(self) <= as_str(other)
+
+  def __gt__(self, other):
+    return str(self) > as_str(other)
+
+  def __ge__(self, other):
+    return str(self) >= as_str(other)
+
+  def __add__(self, other):
+    return str(self) + as_str(other)
+
+  def __radd__(self, other):
+    return as_str(other) + str(self)
+
+  def __fspath__(self):
+    return str(self)
+
+  def __reduce__(self):
+    # Sent to another process, a view becomes the string it holds, rather than taking its whole source along
+    return (str, (str(self),))
+
+def view(strg):
+  """ Returns a view of a whole string """
+  return StrView(strg, 0, len(strg))
+
+def as_str(value):
+  """ Returns the Python string held by a string, view or builder """
+  if type(value) is str:
+    return value
+  if isinstance(value, (StrView, StringBuilder)):
+    return str(value)
+  raise TypeError("Argument is not a string.")
+
+def is_string(value):
+  return isinstance(value, (str, StrView))
+
+# The builtins
+
+def subs(strg, start, end=None):
+  """ (subs s start) or (subs s start end) returns a view of the characters of s from start up to (but not including) end, or the end of s """
+  if isinstance(strg, StringBuilder):
+    strg = str(strg)
+  elif not is_string(strg):
+    raise TypeError("Argument is not a string.")
+  end = len(strg) if end is None else end
+  if not 0 <= start <= end <= len(strg):
+    raise IndexError("String index out of range.")
+  if isinstance(strg, StrView):
+    return StrView(strg.source, strg.start + start, strg.start + end)
+  return StrView(strg, start, end)
+
+def string_builder(*values):
+  """ (string-builder & values) returns a new builder, holding the values printed the way str prints them """
+  return append(StringBuilder(), *values)
+
+def append(builder, *values):
+  """ (append! builder & values) appends the values to a builder, printed the way str prints them, and returns the builder """
+  if not isinstance(builder, StringBuilder):
+    raise TypeError("Argument is not a string builder.")
+  for value in values:
+    printer.pr_write(value, builder.append, False)
+  return builder
+
+def reverse(coll):
+  """ (reverse coll) returns the characters of a string in reverse order as a string, or the elements of any other sequence as a list """
+  if is_string(coll) or isinstance(coll, StringBuilder):
+    return as_str(coll)[::-1]
+  if coll is nil:
+    return List()
+  return List(reversed(list(coll)))
+
+def join(*args):
+  """ (join coll) or (join separator coll) returns the elements of coll printed the way str prints them, with the separator between them """
+  if len(args) == 1:
+    separator, coll = '', args[0]
+  elif len(args) == 2:
+    separator, coll = as_str(args[0]), args[1]
+  else:
+    raise TypeError("join takes a collection, and optionally a separator before it.")
+  return separator.join([elem if type(elem) is str else printer.pr_str(elem, False) for elem in coll])
+
+def split(strg, separator=None):
+  """ (split s) splits a string at whitespace, and (split s separator) at each occurrence of the separator """
+  return List(as_str(strg).split(None if separator is None else as_str(separator)))
+
+def index_of(strg, sub, start=0):
+  """ (index-of s sub) or (index-of s sub start) returns the index of the first occurrence of sub in s at or after start, or nil if there is none. Views are searched in place. """
+  sub = as_str(sub)
+  if isinstance(strg, StrView):
+    index = strg.source.find(sub, strg.start + start, strg.stop)
+    return nil if index < 0 else index - strg.start
+  index = as_str(strg).find(sub, start)
+  return nil if index < 0 else index
@@ -0,0 +1,196 @@
+import collections
+from lisp_types import *
+from memo import Memoized
+import global_env
+
+""" This file implements tasks: green threads that run Lisp functions concurrently on a single thread, switching between them whenever one waits (for time to pass, for I/O, for another task or for a channel). A task is a function running on the stack machine (see machine.py), whatever the engine, as the machine keeps everything it is doing on a stack of its own: when the function calls an AsyncBuiltin, the machine hands back a Pause, and the task's coroutine awaits it on an asyncio event loop, then continues the stack with the result. A task therefore only costs its stack of frames and the coroutine driving it, so thousands of them can wait at once.
+
+The event loop only runs while something waits for it: the program (or a function called from Python, like the function map calls, inside a task) calling sleep, await, take! or put!. Spawning a task schedules it, and it starts running the next time the loop does. The program ends when its last form has run; the tasks still pending then are cancelled.
+
+Only code the machine runs for a task can suspend it. A function called from Python (by map or reduce, for instance) runs on the Python stack, where the I/O builtins block the whole thread and sleep holds up every task, and waiting for a task or a channel is an error, as nothing else could run until it's done. Procedures created by the compiled engine always run on the Python stack, so spawn refuses them: with --engine compiled, tasks can only run builtins.
+
+Tasks only switch when one of them waits, so nothing else runs between reading an atom and setting it. swap! with a function that waits checks that the atom still holds the value it started from before setting it, and calls the function again on the new value if it doesn't. """
+
+# The event loop, created the first time it is needed, as importing asyncio takes a while
+loop = None
+
+def get_loop():
+  global loop
+  if loop is None:
+    import asyncio, atexit
+    loop = asyncio.new_event_loop()
+    atexit.register(shutdown)
+  return loop
+
+def shutdown():
+  """ Cancels the tasks still pending when the program ends, and closes the loop """
+  import asyncio
+  pending = asyncio.all_tasks(loop)
+  for future in pending:
+    future.cancel()
+  if pending:
+    loop.run_until_complete(asyncio.wait(pending))
+  loop.run_until_complete(loop.shutdown_default_executor())
+  loop.close()
+
+def blocking(coroutine, fallback=None):
+  """ Returns the function an AsyncBuiltin calls when it can't suspend a task: it runs the event loop until the coroutine is done. If the loop is already running (a task called the builtin from Python), it calls fallback instead, or fails if there is none. """
+  def wait(*args):
+    if loop is not None and loop.is_running():
+      if fallback is None:
+        raise RuntimeError("Cannot wait from a function called from Python (by map, for instance) while a task runs.")
+      return fallback(*args)
+    return get_loop().run_until_complete(coroutine(*args))
+  return wait
+
+def step(func, *args):
+  """ Runs a task on the machine until it is done or paused """
+  # The machine is imported when the first task runs, so that programs without tasks only load the engine they run on
+  import machine
+  machine.suspendable = True
+  try:
+    return func(*args)
+  finally:
+    machine.suspendable = False
+
+async def run(func, args):
+  """ The coroutine driving a task: whenever the machine pauses it, it waits for what the task waits for, and continues the task's stack with the result """
+  import machine
+  stack = []
+  value = step(machine.call, func, args, stack)
+  while type(value) is machine.Pause:
+    result = await value.awaitable
+    value = step(machine.run, result, None, stack)
+  return value
+
+class Task:
+  """ A function running as a task. await returns the value it returns, or raises the error it failed with. """
+  __slots__ = ('future',)
+
+  def __init__(self, func, args):
+    self.future = get_loop().create_task(run(func, args))
+
+  def __str__(self):
+    return "#<task>"
+
+class Channel:
+  """ A queue of values that tasks hand each other. take! waits until there is a value, put! waits while the channel holds as many values as its size allows (if it has a size). Once a channel is closed, nothing can be put on it, and take! returns nil once it is empty. """
+  __slots__ = ('items', 'size', 'closed', 'takers', 'putters')
+
+  def __init__(self, size=None):
+    if size is not None and (type(size) is not int or size < 1):
+      raise TypeError("The size of a channel must be a positive integer.")
+    self.items = collections.deque()
+    self.size = size
+    self.closed = False
+    # The futures of the tasks waiting to take a value, and to put one
+    self.takers = collections.deque()
+    self.putters = collections.deque()
+
+  async def take(self):
+    while not self.items:
+      if self.closed:
+        return nil
+      await self.wait(self.takers)
+    value = self.items.popleft()
+    self.wake(self.putters)
+    return value
+
+  async def put(self, value):
+    while True:
+      if self.closed:
+        raise ValueError("Cannot put a value on a closed channel.")
+      if self.size is None or len(self.items) < self.size:
+        break
+      await self.wait(self.putters)
+    self.items.append(value)
+    self.wake(self.takers)
+    return nil
+
+  def close(self):
+    self.closed = True
+    for waiters in (self.takers, self.putters):
+      while waiters:
+        self.wake(waiters)
+    return nil
+
+  def wait(self, waiters):
+    future = get_loop().create_future()
+    waiters.append(future)
+    return future
+
+  def wake(self, waiters):
+    """ Wakes the first task waiting that is still there (a waiting task can be cancelled) """
+    while waiters:
+      future = waiters.popleft()
+      if not future.done():
+        future.set_result(None)
+        return
+
+  def __str__(self):
+    return "#<channel>"
+
+# The functions behind the builtins
+
+def spawn(func, *args):
+  """ (spawn f & args) starts calling f on args as a task, and returns the task """
+  proc = func.proc if type(func) is Memoized else func
+  if isinstance(proc, Procedure) and proc.code is not None:
+    raise TypeError("Tasks can't run procedures created by the compiled engine, which can't be suspended; use --engine ast or --engine stack.")
+  return Task(func, args)
+
+async def await_task(task):
+  if not isinstance(task, Task):
+    raise TypeError("Only tasks can be awaited.")
+  return await task.future
+
+async def sleep(seconds):
+  import asyncio
+  await asyncio.sleep(seconds)
+  return nil
+
+def check_channel(channel):
+  if not isinstance(channel, Channel):
+    raise TypeError("Argument is not a channel.")
+  return channel
+
+async def take(channel):
+  return await check_channel(channel).take()
+
+async def put(channel, value):
+  return await check_channel(channel).put(value)
+
+def close(channel):
+  return check_channel(channel).close()
+
+# The I/O builtins. Files are read and written by the threads of the loop's executor, and processes run as asyncio subprocesses.
+
+async def slurp(path):
+  return await get_loop().run_in_executor(None, global_env.slurp, path)
+
+async def spit(path, *args):
+  # The text is built here, as printing a value may call Lisp functions (a lazy sequence's), which have to run on the loop's thread
+  parts = []
+  global_env.write_values(args, parts.append, False)
+  await get_loop().run_in_executor(None, write_text, path, ''.join(parts))
+  return nil
+
+def write_text(path, text):
+  with open(path, 'w', encoding='UTF-8') as file:
+    file.write(text)
+
+def sh(*command):
+  """ (sh program & args) runs a program, and returns a map of its exit status, and what it printed to its standard output and error """
+  import subprocess
+  process = subprocess.run([str(arg) for arg in command], capture_output=True)
+  return process_result(process.returncode, process.stdout, process.stderr)
+
+async def sh_async(*command):
+  import asyncio
+  process = await asyncio.create_subprocess_exec(*[str(arg) for arg in command], stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+  out, err = await process.communicate()
+  return process_result(process.returncode, out, err)
+
+def process_result(status, out, err):
+  return Map({Keyword(':exit'): status, Keyword(':out'): out.decode('UTF-8', 'replace'), Keyword(':err'): err.decode('UTF-8', 'replace')})
+
@@ -0,0 +1,17 @@
+import os, subprocess, sys
+import pytest
+
+""" The tests run the interpreter on small programs in a subprocess, the way it is run from the command line, and look at what it prints. """
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+engines = ['ast', 'compiled', 'stack']
+
+@pytest.fixture
+def lisp(tmp_path):
+  """ Returns a function that runs a program, given as source code, with the given command line options, and returns the finished process, with what it printed as text """
+  def run(source, *options, argv=()):
+    path = tmp_path / 'program.lisp'
+    path.write_text(source)
+    return subprocess.run([sys.executable, os.path.join(root, 'lisp.py'), '--no-cache', *options, str(path), *argv], capture_output=True, text=True, timeout=120, cwd=tmp_path)
+  return run
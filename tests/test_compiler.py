@@ -0,0 +1,20 @@
+""" Tests of the compiler engine """
+
+def test_recursion_depth(lisp):
+  # Non-tail recursion goes as deep on the compiled engine as on the ast engine
+  source = "(def! depth (fn* (n) (if (= n 0) 0 (+ 1 (depth (- n 1)))))) (prn (depth 300))"
+  for engine in ('ast', 'compiled'):
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "300\n", result.stderr
+
+def test_recursive_let(lisp):
+  # A fn* bound by let* sees its own name, while reading the name before the value is assigned finds the binding outside the let*
+  source = """
+(prn (let* (f (fn* (n) (if (= n 0) 0 (f (- n 1))))) (f 5)))
+(def! x 10)
+(prn (let* (x (+ x 1)) x))
+(prn (let* (y 1 y (+ y 1)) y))
+"""
+  for engine in ('ast', 'compiled'):
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "0\n11\n2\n", result.stderr
@@ -0,0 +1,16 @@
+from conftest import engines
+
+""" Tests of the JIT compiler """
+
+def test_global_rebound_by_callback(lisp):
+  # The function reduce calls rebinds bonus in the middle of an iteration of the compiled loop, which reads the new value right after
+  source = """
+(def! bonus 0)
+(def! rebind (fn* (a x) (eval (list 'def! 'bonus x))))
+(def! f (fn* (i acc) (if (= i 300) acc (f (+ i 1) (+ acc i (do (if (= i 100) (reduce rebind 0 [3]) nil) 0) bonus)))))
+(prn (f 0 0))
+"""
+  for engine in engines:
+    for options in [(), ('--no-jit',)]:
+      result = lisp(source, '--engine', engine, *options)
+      assert result.stdout == "45450\n", result.stderr
@@ -0,0 +1,30 @@
+from conftest import engines
+
+""" Tests of lazy sequences """
+
+def test_walked_once(lisp):
+  # Walking a sequence again reads the elements it realized the first time, instead of calling the function that produces them again
+  source = """
+(def! calls (atom 0))
+(def! s (map (fn* (x) (swap! calls (fn* (c) (+ c 1)))) (range 3)))
+(prn s)
+(prn s)
+(prn (reduce + s) (count s) @calls)
+"""
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "(1 2 3)\n(1 2 3)\n6 3 3\n", result.stderr
+
+def test_infinite(lisp):
+  # Sequences built on an infinite range only realize the chunks that are asked for
+  source = """
+(prn (take (range) 5))
+(def! calls (atom 0))
+(def! evens (filter (fn* (x) (do (swap! calls (fn* (c) (+ c 1))) (= 0 (% x 2)))) (map (fn* (x) (* x 3)) (range))))
+(prn (take (drop evens 40) 3) (nth evens 100))
+(prn (< @calls 300) (first (rest (drop (range) 1000))))
+(prn (count (take (iterate (fn* (x) (+ x 1)) 0) 70)) (reduce + (take (range) 100)))
+"""
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "(0 1 2 3 4)\n(240 246 252) 600\ntrue 1001\n70 4950\n", result.stderr
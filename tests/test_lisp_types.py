@@ -0,0 +1,18 @@
+import sys
+import pytest
+from conftest import root
+
+""" Tests of the Lisp types, used from Python """
+
+sys.path.insert(0, root)
+from lisp_types import Cons, List
+
+def test_cons_methods():
+  # Cons cells have the methods of the lists they stand for, and none of those that would modify them
+  cell = Cons(1, Cons(2, Cons(1, List())))
+  assert len(cell) == 3
+  assert cell.count(1) == 2
+  assert cell.index(2) == 1
+  assert cell[-1] == 1
+  with pytest.raises(TypeError):
+    cell.append(3)
@@ -0,0 +1,15 @@
+from conftest import engines
+
+""" Tests of the optimization pass """
+
+def test_eval_expands_once(lisp):
+  # Optimizing a form that has nothing to optimize gives back the same form, so evaluating it again finds the expansions of its macro calls in the macro cache
+  source = """
+(def! n (atom 0))
+(defmacro! m (fn* (x) (do (swap! n (fn* (c) (+ c 1))) x)))
+(def! forms '((m 1) (+ (* 2 3) (m 2)) [(m 3)] (let* (a (m 4)) a) (do 1 (m 5))))
+(reduce (fn* (_ form) (do (reset! n 0) (eval form) (eval form) (eval form) (prn @n))) nil forms)
+"""
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "1\n" * 5, result.stderr
@@ -0,0 +1,33 @@
+from conftest import engines
+
+""" Tests of pmap and friends """
+
+def test_rebinding(lisp):
+  # Workers see the new value of a global the work refers to, however deep, even though changes to other globals don't fork the pool again
+  source = """
+(def! k 1)
+(def! addk (fn* (x) (+ x k)))
+(def! twice (fn* (x) (* 2 (addk x))))
+(prn (pmap twice [1 2 3]))
+(def! unrelated 1)
+(prn (pmap twice [1 2 3]))
+(def! k 100)
+(prn (pmap twice [1 2 3]))
+"""
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "(4 6 8)\n(4 6 8)\n(202 204 206)\n", result.stderr
+
+def test_future_after_fork(lisp):
+  # A future started before the pool is forked again still gets its result from the old pool
+  source = """
+(def! slow (fn* () (do (sleep 0.5) 42)))
+(def! k 1)
+(def! fut (future slow))
+(def! k 2)
+(prn (pmap (fn* (x) (+ x k)) [1 2 3]))
+(prn @fut)
+"""
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "(3 4 5)\n42\n", result.stderr
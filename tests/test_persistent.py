@@ -0,0 +1,77 @@
+import sys
+from conftest import engines, root
+
+""" Tests of the persistent collections """
+
+sys.path.insert(0, root)
+from persistent import Map, Node, Collision
+
+class Clash:
+  """ A key whose hash is the same as every other Clash's """
+  def __init__(self, name):
+    self.name = name
+
+  def __hash__(self):
+    return 42
+
+  def __eq__(self, other):
+    return isinstance(other, Clash) and other.name == self.name
+
+  def __repr__(self):
+    return f"Clash({self.name!r})"
+
+def test_map_order(lisp):
+  # Maps too big for the small representation still keep their keys in the order they were added, so that printing them gives the same output on every run
+  source = """
+(def! m (reduce (fn* (m i) (assoc m (str "k" i) i)) {} (range 20)))
+(prn (keys m))
+(prn (vals (dissoc (assoc m "k3" 30) "k0")))
+"""
+  keys = " ".join(f'"k{i}"' for i in range(20))
+  vals = " ".join(str(30 if i == 3 else i) for i in range(1, 20))
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == f"({keys})\n({vals})\n", result.stderr
+
+def test_small_to_trie():
+  # The ninth key turns the small map into a trie, which must keep the order of the first eight
+  m = Map()
+  for i in range(8):
+    m = m.assoc(f"k{i}", i)
+  assert type(m.root) is not Node
+  bigger = m.assoc("k8", 8)
+  assert type(bigger.root) is Node
+  assert list(bigger) == [f"k{i}" for i in range(9)]
+  assert list(m) == [f"k{i}" for i in range(8)]
+  assert list(bigger.dissoc("k4").assoc("k4", 40).items())[-1] == ("k4", 40)
+  assert bigger.dissoc("k8") == m
+  assert Map((f"k{i}", i) for i in range(9)) == bigger
+
+def test_collisions():
+  # Keys with the same hash share a collision node, which has to find, replace and remove them by equality
+  keys = [Clash(i) for i in range(4)]
+  m = Map((f"k{i}", i) for i in range(10))
+  for i, key in enumerate(keys):
+    m = m.assoc(key, i)
+  assert any(type(node) is Collision for node in nodes(m.root))
+  assert len(m) == 14
+  assert [m[key] for key in keys] == [0, 1, 2, 3]
+  assert Clash(9) not in m
+  m = m.assoc(Clash(1), 10)
+  assert len(m) == 14 and m[keys[1]] == 10
+  assert list(m)[10:] == keys
+  m = m.dissoc(Clash(2)).dissoc(Clash(0))
+  assert list(m)[10:] == [keys[1], keys[3]]
+  assert m.get(keys[2]) is None and m[keys[3]] == 3
+  m = m.dissoc(keys[1]).dissoc(keys[3])
+  assert m == Map((f"k{i}", i) for i in range(10))
+  # Python hashes -1 and -2 the same, so plain integer keys collide too
+  small = Map([(-1, 'a'), (-2, 'b')])
+  assert small[-1] == 'a' and small[-2] == 'b' and len(small.dissoc(-1)) == 1
+
+def nodes(node):
+  yield node
+  if type(node) is Node:
+    for child in node.array[1::2]:
+      if type(child) in (Node, Collision):
+        yield from nodes(child)
@@ -0,0 +1,13 @@
+import os, subprocess, sys
+from conftest import engines, root
+
+""" Tests of printing """
+
+def test_output_before_error(tmp_path):
+  # What a program printed comes out before the error that stopped it
+  path = tmp_path / 'program.lisp'
+  path.write_text('(prn 1)\n(println "two")\n(nth [1] 5)\n')
+  for engine in engines:
+    result = subprocess.run([sys.executable, os.path.join(root, 'lisp.py'), '--no-cache', '--engine', engine, str(path)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=120, cwd=tmp_path)
+    assert result.returncode != 0
+    assert result.stdout.startswith("1\ntwo\nTraceback"), result.stdout
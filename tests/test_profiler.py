@@ -0,0 +1,44 @@
+from conftest import engines
+
+""" Tests of the profiler """
+
+def test_memoized(lisp):
+  # Memoized procedures defined before profiling starts stay memoized procedures while it runs
+  source = """
+(def! mplus (memoize +))
+(def! fibm (memoize (fn* (n) (if (< n 2) n (+ (fibm (- n 1)) (fibm (- n 2)))))))
+(prn (profile (do (mplus 1 2) (fibm 20) (memo-stats mplus))))
+(prn (memo-stats fibm))
+"""
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "{:hits 0 :misses 1 :size 1 :limit 10000}\n{:hits 18 :misses 21 :size 21 :limit 10000}\n", result.stderr
+    assert "mplus" in result.stderr
+
+def test_stack_machine(lisp):
+  # The stack machine reports the procedures it enters, the special forms it runs and the tail calls it makes, like the ast engine
+  source = """
+(def! sq (fn* (x) (* x x)))
+(def! loop (fn* (i acc) (if (= i 0) acc (loop (- i 1) (+ acc (sq i))))))
+(prn (profile (loop 50 0)))
+"""
+  for engine in ('ast', 'stack'):
+    result = lisp(source, '--engine', engine, '--no-jit')
+    assert result.stdout == "42925\n", result.stderr
+    lines = result.stderr.splitlines()
+    assert any(line.split()[0] == '51' and line.endswith(' loop') for line in lines), result.stderr
+    assert any(line.split()[0] == '50' and line.endswith(' sq') for line in lines), result.stderr
+    assert "Special forms: if 51" in result.stderr
+    assert "Tail calls: 50, environments: 101" in result.stderr
+
+def test_defined_before(lisp):
+  # Procedures defined before profiling starts have their special forms counted too, the compiled engine's included
+  source = """
+(def! countdown (fn* (n) (if (= n 0) :done (countdown (- n 1)))))
+(prn (profile (countdown 20)))
+(prn (countdown 5))
+"""
+  for engine in engines:
+    result = lisp(source, '--engine', engine, '--no-jit')
+    assert result.stdout == ":done\n:done\n", result.stderr
+    assert "Special forms: if 21" in result.stderr, result.stderr
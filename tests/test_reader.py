@@ -0,0 +1,35 @@
+from conftest import engines
+
+""" Tests of the reader """
+
+def test_error_order(lisp):
+  # Syntax errors come out in order with what the program printed
+  source = '(prn 1)\n(read-string "(1 2")\n(prn 2)\n'
+  for engine in engines:
+    assert lisp(source, '--engine', engine).stdout == "1\nUnexpected EOF while parsing.\n2\n"
+
+def test_literals(lisp):
+  # Vectors and maps of literals, which the lexer builds without the parser, read the same as any other
+  source = r"""
+(def! x 3)
+(prn [1 2 3] [1.5 2. 1e3] [1, "a\"b" :k nil true false -2])
+(prn {:a 1 "b" nil} {} [] [1 2]x)
+(prn (read-string "{:a [1.5 2.5] :b {}}") (count {:a 1 :a 2}) (vector? [1 2]) (map? {:a 1}))
+"""
+  expected = '[1 2 3] [1.5 2.0 1000.0] [1 "a\\"b" :k nil true false -2]\n{:a 1 "b" nil} {} [] [1 2] 3\n{:a [1.5 2.5] :b {}} 1 true true\n'
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == expected, result.stderr
+
+def test_literal_errors(lisp):
+  # Maps with an odd number of elements and unterminated strings are reported whether or not they are made of literals
+  source = r"""
+(read-string "{:a}")
+(read-string "{:a 1 :b}")
+(read-string "{(+ 1 2)}")
+(read-string "\"abc")
+(read-string "[1 \"abc]")
+"""
+  expected = "Error parsing map literal.\n" * 3 + "Expected \", got EOF.\n" * 2
+  for engine in engines:
+    assert lisp(source, '--engine', engine).stdout == expected
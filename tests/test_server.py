@@ -0,0 +1,19 @@
+import os, subprocess, sys
+from conftest import root
+
+""" Tests of the eval server """
+
+def test_preload_output(tmp_path):
+  # What a preloaded file prints is printed by the server once, not sent back with the output of every request
+  (tmp_path / 'preload.lisp').write_text('(println "preloaded")\n(def! greeting "hello")\n')
+  socket = str(tmp_path / 'socket')
+  server = subprocess.Popen([sys.executable, os.path.join(root, 'lisp.py'), '--no-cache', '--preload', 'preload.lisp', '--serve', socket], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=tmp_path)
+  try:
+    assert server.stderr.readline().startswith("Serving on"), server.stderr.read()
+    for _ in range(2):
+      result = subprocess.run([sys.executable, os.path.join(root, 'server.py'), '-e', '(do (println greeting) 1)', socket], capture_output=True, text=True, timeout=60, cwd=tmp_path)
+      assert result.stdout == "hello\n1\n", result.stderr
+  finally:
+    server.terminate()
+    stdout, _ = server.communicate(timeout=60)
+  assert stdout == "preloaded\n"
@@ -0,0 +1,27 @@
+import os, subprocess, sys
+from conftest import root
+
+""" Tests of the source cache """
+
+def run(path):
+  return subprocess.run([sys.executable, os.path.join(root, 'lisp.py'), str(path)], capture_output=True, text=True, timeout=120).stdout
+
+def test_cached_forms(tmp_path):
+  # A file with more forms than fit in a batch reads the same from its cache file, and from a truncated one
+  path = tmp_path / 'forms.lisp'
+  path.write_text(''.join(f"(def! x{i} {i})\n" for i in range(3000)) + "(prn (+ x0 x1234 x2999))\n")
+  cache = tmp_path / '__lispcache__' / 'forms.lispc'
+  assert run(path) == "4233\n"
+  assert cache.exists()
+  assert run(path) == "4233\n"
+  data = cache.read_bytes()
+  cache.write_bytes(data[:len(data) // 2])
+  assert run(path) == "4233\n"
+  assert cache.read_bytes() == data
+
+def test_syntax_error(tmp_path):
+  # A file that doesn't parse leaves no cache file behind, not even a temporary one
+  path = tmp_path / 'broken.lisp'
+  path.write_text("(prn 1)\n(prn 2\n")
+  run(path)
+  assert os.listdir(tmp_path / '__lispcache__') == []
@@ -0,0 +1,48 @@
+import sys
+import pytest
+from conftest import engines, root
+
+""" Tests of strings, substring views and string builders """
+
+sys.path.insert(0, root)
+from lisp_types import nil
+from strings import StrView, view, subs, index_of
+
+def test_views(lisp):
+  # Substrings, and strings taken or dropped from, are views, which have to behave like the strings they stand for everywhere
+  source = """
+(def! s "hello, world")
+(def! w (subs s 7))
+(prn w (subs w 1 3) (count w) (string? w) (= w "world") (= "world" w))
+(prn (take s 5) (drop s 7) (take (drop s 7) -1) (nth w 0) (nth w -1))
+(prn (get {"world" 1} w) (get (assoc {} w 2) "world") (str w "!" (subs s 0 5)) (index-of w "o") (index-of s "o" 5))
+(def! rev (fn* (t acc) (if (empty? t) acc (rev (drop t 1) (str (nth t 0) acc)))))
+(prn (rev s "") (reverse w) (split (subs s 0 12) ", ") (join "-" [w (take s 2)]))
+(def! b (string-builder "a" 1))
+(append! b w :k)
+(prn (str b) (count b) (< w "zebra") (subs "abc" 3))
+"""
+  expected = '"world" "or" 5 true true true\n"hello" "world" "worl" "w" "d"\n1 2 "world!hello" 1 8\n"dlrow ,olleh" "dlrow" ("hello" "world") "world-he"\n"a1world:k" 9 true ""\n'
+  for engine in engines:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == expected, result.stderr
+
+def test_view_slices():
+  # Slicing a view gives a view of the same source, and only stepped slices copy the characters
+  text = "hello, world"
+  w = subs(text, 7)
+  assert type(w) is StrView and w.source is text
+  part = w[1:-1]
+  assert type(part) is StrView and part.source is text and part == "orl"
+  assert w[3:1] == "" and w[::-1] == "dlrow" and w[-1] == "d"
+  assert subs(part, 1) == "rl" and subs(part, 1).source is text
+  with pytest.raises(IndexError):
+    w[5]
+  with pytest.raises(IndexError):
+    subs(w, 2, 6)
+  # Comparing with a string and searching look at the source in place, without copying the characters out
+  fresh = subs(text, 7)
+  assert fresh == "world" and fresh != "worlds" and fresh != "hello"
+  assert index_of(fresh, "o") == 1 and index_of(fresh, "h") is nil and index_of(fresh, "l", 4) is nil
+  assert fresh.text is None
+  assert hash(fresh) == hash("world") and fresh == view("world")
@@ -0,0 +1,19 @@
+""" Tests of tasks and channels """
+
+source = """
+(def! c (chan))
+(spawn (fn* () (put! c 5)))
+(prn (take! c))
+(prn (await (spawn (fn* () (do (sleep 0.01) 3)))))
+"""
+
+def test_channel(lisp):
+  for engine in ['ast', 'stack']:
+    result = lisp(source, '--engine', engine)
+    assert result.stdout == "5\n3\n", result.stderr
+
+def test_compiled_spawn(lisp):
+  # Procedures created by the compiled engine can't be suspended, so spawning one fails right away, instead of the program waiting for a value that never comes
+  result = lisp(source, '--engine', 'compiled')
+  assert result.returncode != 0
+  assert "Tasks can't run procedures created by the compiled engine" in result.stderr